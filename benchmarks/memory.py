@@ -0,0 +1,98 @@
+# memory.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Memory used by a parsed 50k application drirc.
+
+Compares DRIConfig against the layout it used to have, where every
+object carried a __dict__ and its own copies of all strings.
+
+    python3 -m benchmarks.memory [--apps N]
+"""
+
+import argparse
+import gc
+import os
+import tempfile
+import tracemalloc
+
+from driconfig import dri
+from benchmarks import synthetic
+
+
+class LegacyApp:
+    def __init__(self, device, name, executable=None):
+        self.device = device
+        self.name = name
+        self.executable = executable
+        self.options = {}
+
+
+class LegacyDevice:
+    def __init__(self, config, screen=None, driver=None):
+        self.config = config
+        self.screen = screen
+        self.driver = driver
+        self.apps = []
+
+
+class LegacyConfig(dri.DRIConfig):
+    """DRIConfig building un-slotted objects without string interning."""
+
+    def startElement(self, name, attr):
+        if name == 'device':
+            self.curDevice = LegacyDevice(self, attr.get('screen'),
+                                          attr.get('driver'))
+            self.devices.append(self.curDevice)
+        elif name == 'application':
+            self.curApp = LegacyApp(self.curDevice, attr['name'],
+                                    attr.get('executable'))
+            self.curDevice.apps.append(self.curApp)
+        elif name == 'option':
+            self.curApp.options[attr['name']] = attr['value']
+
+
+def measure(cls, path):
+    gc.collect()
+    tracemalloc.start()
+    config = cls(path)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del config
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--apps', type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'drirc')
+        with open(path, 'w') as f:
+            synthetic.write_drirc(f, devices=5, apps=args.apps // 5)
+        legacy = measure(LegacyConfig, path)
+        compact = measure(dri.DRIConfig, path)
+
+    print('applications: {}'.format(args.apps))
+    print('legacy:       {:8.1f} MiB'.format(legacy / 2**20))
+    print('compact:      {:8.1f} MiB'.format(compact / 2**20))
+    print('reduction:    {:8.1f} %'.format(100 * (1 - compact / legacy)))
+
+
+if __name__ == '__main__':
+    main()
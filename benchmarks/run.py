@@ -0,0 +1,251 @@
+# run.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Time the dri module on synthetic data and report JSON.
+
+    python3 -m benchmarks.run [--apps N] [--output FILE] [--compare FILE]
+
+Each benchmark runs --repeat times and the minimum, median and mean are
+reported in seconds. With --compare the results of an earlier run are
+loaded and the ratio of the medians is printed for every benchmark.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from driconfig import backends, dri
+from benchmarks import synthetic
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+class Context:
+    """Synthetic files plus objects shared between benchmarks."""
+
+    def __init__(self, args, tmpdir):
+        self.args = args
+        self.drirc = os.path.join(tmpdir, 'drirc')
+        with open(self.drirc, 'w') as f:
+            synthetic.write_drirc(f, devices=args.devices,
+                                  apps=args.apps // args.devices,
+                                  options=args.options)
+        buf = io.StringIO()
+        synthetic.write_catalog(buf, options=args.options,
+                                languages=args.languages, enums=args.enums)
+        self.catalog = buf.getvalue()
+        self.config = dri.DRIConfig(self.drirc)
+        self.driver = dri.DriverInfo('synthetic', driInfo=self.catalog)
+        self.apps = [app for device in self.config.devices for app in device.apps]
+        rng = random.Random(0)
+        self.queries = [(rng.choice(self.apps).executable, rng.randint(0, 3),
+                         rng.choice(synthetic.DRIVERS)) for i in range(1000)]
+        screens = [{'driver': 'synthetic', 'vendor': 'Synthetic',
+                    'renderer': 'Synthetic GPU'} for i in range(args.devices)]
+        # Executable selectors as Mesa's drirc.d uses them
+        self.patterns = (['app%d' % i for i in range(500)] +
+                         ['^exe%d$' % i for i in range(2000)] +
+                         ['name%d.*x' % i for i in range(2000)])
+        self.regexSet = dri.RegexSet(self.patterns)
+        self.regexes = [re.compile(p) for p in self.patterns]
+        self.regexStrings = [rng.choice(('app', 'exe', 'name', 'other')) +
+                             str(rng.randrange(3000)) + rng.choice(('', 'x'))
+                             for i in range(100)]
+        self.backend = backends.FakeBackend({
+            'displays': {':0': screens},
+            'drivers': {'synthetic': self.catalog},
+        })
+
+
+@benchmark
+def parse_drirc(ctx):
+    dri.DRIConfig(ctx.drirc)
+
+
+@benchmark
+def serialize_drirc(ctx):
+    ctx.config.write(io.StringIO())
+
+
+@benchmark
+def parse_catalog(ctx):
+    dri.DriverInfo('synthetic', driInfo=ctx.catalog)
+
+
+@benchmark
+def validate_apps(ctx):
+    for app in ctx.apps:
+        ctx.driver.validate(app.options)
+
+
+@benchmark
+def validate_config_bulk(ctx):
+    dri.ConfigValidator({'synthetic': ctx.driver}).validate(ctx.config)
+
+
+@benchmark
+def type_options(ctx):
+    for app in ctx.apps:
+        app.getTypedOptions(ctx.driver)
+
+
+@benchmark
+def get_opt_info(ctx):
+    getOptInfo = ctx.driver.getOptInfo
+    for name in synthetic.option_names(ctx.args.options):
+        getOptInfo(name)
+
+
+@benchmark
+def describe_options(ctx):
+    table = ctx.driver.getDescTable(('de', 'en'))
+    for name in synthetic.option_names(ctx.args.options):
+        table.desc(name)
+
+
+@benchmark
+def build_resolver(ctx):
+    dri.OptionResolver(ctx.config)
+
+
+@benchmark
+def resolve_1000_queries(ctx):
+    resolver = dri.OptionResolver(ctx.config)
+    for query in ctx.queries:
+        resolver.getOptions(*query)
+
+
+@benchmark
+def match_regex_set(ctx):
+    for string in ctx.regexStrings:
+        ctx.regexSet.match(string)
+
+
+@benchmark
+def match_regexes_each(ctx):
+    # What RegexSet saves: searching every pattern in turn
+    for string in ctx.regexStrings:
+        [i for i, regex in enumerate(ctx.regexes) if regex.search(string)]
+
+
+@benchmark
+def probe_display_fake(ctx):
+    dri.SetBackend(ctx.backend)
+    dri.DisplayInfo(':0')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Keep the driver cache of probe benchmarks out of ~/.cache
+        os.environ['XDG_CACHE_HOME'] = os.path.join(tmpdir, 'cache')
+        ctx = Context(args, tmpdir)
+        for func in BENCHMARKS:
+            if args.filter and args.filter not in func.__name__:
+                continue
+            times = []
+            for i in range(args.repeat):
+                start = time.perf_counter()
+                func(ctx)
+                times.append(time.perf_counter() - start)
+            results[func.__name__] = {
+                'min': min(times),
+                'median': statistics.median(times),
+                'mean': statistics.mean(times),
+                'repeat': args.repeat,
+            }
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'scale': {
+            'devices': args.devices,
+            'apps': args.apps,
+            'options': args.options,
+            'languages': args.languages,
+            'enums': args.enums,
+        },
+        'results': results,
+    }
+
+
+def compare(old, new, out):
+    if old['scale'] != new['scale']:
+        out.write('warning: comparing runs of different scale\n')
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        before = old['results'][name]['median']
+        after = result['median']
+        out.write('{:24} {:10.4f}s -> {:10.4f}s  {:6.2f}x\n'.format(
+            name, before, after, before / after if after else float('inf')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=4)
+    parser.add_argument('--apps', type=int, default=4000,
+                        help='applications in the drirc, across all devices')
+    parser.add_argument('--options', type=int, default=200,
+                        help='options in the driver catalog')
+    parser.add_argument('--languages', type=int, default=3)
+    parser.add_argument('--enums', type=int, default=4,
+                        help='values of every enum option')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', help='only run benchmarks containing this')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    parser.add_argument('--compare', help='JSON of an earlier run to compare to')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report, sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# synthetic.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Generators for synthetic drirc files and driver option catalogs.
+
+The catalogs look like the output of xdriinfo options and the drirc files
+only set options that exist in the catalog of the same scale, so the two
+can be combined for validation benchmarks.
+"""
+
+import random
+from xml.sax.saxutils import quoteattr
+
+DRIVERS = ('radeonsi', 'i965', 'iris', 'nouveau', 'r600', 'radeon')
+LANGUAGES = ('en', 'de', 'es', 'fr', 'it', 'nl', 'sv', 'ca', 'pt', 'ja')
+TYPES = ('bool', 'int', 'enum', 'float')
+
+
+def option_names(count):
+    return ['option_{}'.format(i) for i in range(count)]
+
+
+def write_drirc(f, devices=4, apps=1000, options=200, per_app=3, seed=0):
+    """Write a drirc with devices * apps applications to the file f.
+
+    Every application sets per_app options picked from a pool of options
+    names, with values that are valid in the write_catalog catalog.
+    """
+    rng = random.Random(seed)
+    names = option_names(options)
+    f.write('<driconf>\n')
+    for d in range(devices):
+        if d == 0:
+            f.write('    <device>\n')
+        else:
+            f.write('    <device screen="{}" driver="{}">\n'.format(
+                d - 1, DRIVERS[d % len(DRIVERS)]))
+        for a in range(apps):
+            f.write('        <application name={} executable={}>\n'.format(
+                quoteattr('Application {} {}'.format(d, a)),
+                quoteattr('app{}_{}'.format(d, a))))
+            for i in rng.sample(range(options), min(per_app, options)):
+                name = names[i]
+                value = option_value(rng, option_type(i))
+                f.write('            <option name="{}" value="{}" />\n'.format(
+                    name, value))
+            f.write('        </application>\n')
+        f.write('    </device>\n')
+    f.write('</driconf>\n')
+
+
+def option_type(index):
+    return TYPES[index % len(TYPES)]
+
+
+def option_value(rng, type):
+    """A valid value for an option of the given type in write_catalog."""
+    if type == 'bool':
+        return rng.choice(('true', 'false'))
+    elif type == 'float':
+        return rng.choice(('0.5', '1.0', '2.0'))
+    else:
+        return str(rng.randint(0, 3))
+
+
+def write_catalog(f, sections=8, options=200, languages=3, enums=4):
+    """Write an xdriinfo options style catalog to the file f.
+
+    Options are spread over the sections and cycle through the four
+    option types. Enum options have enums values, every description is
+    present in the given number of languages.
+    """
+    langs = [LANGUAGES[i % len(LANGUAGES)] + ('' if i < len(LANGUAGES) else str(i))
+             for i in range(languages)]
+    names = option_names(options)
+    f.write('<?xml version="1.0" standalone="yes"?>\n<driinfo>\n')
+    for s in range(sections):
+        f.write('<section>\n')
+        for lang in langs:
+            f.write('<description lang="{}" text="Section {} ({})"/>\n'.format(
+                lang, s, lang))
+        for i in range(s, options, sections):
+            type = option_type(i)
+            if type == 'bool':
+                attrs = 'default="false"'
+            elif type == 'float':
+                attrs = 'default="1.0" valid="0.0:16.0"'
+            elif type == 'enum':
+                attrs = 'default="0" valid="0:{}"'.format(max(enums - 1, 3))
+            else:
+                attrs = 'default="1" valid="0:3,8,16:32"'
+            f.write('<option name="{}" type="{}" {}>\n'.format(
+                names[i], type, attrs))
+            for lang in langs:
+                if type != 'enum':
+                    f.write('<description lang="{}" text="Option {} ({})"/>\n'
+                            .format(lang, i, lang))
+                    continue
+                f.write('<description lang="{}" text="Option {} ({})">\n'
+                        .format(lang, i, lang))
+                for e in range(enums):
+                    f.write('<enum value="{}" text="Value {} ({})"/>\n'.format(
+                        e, e, lang))
+                f.write('</description>\n')
+            f.write('</option>\n')
+        f.write('</section>\n')
+    f.write('</driinfo>\n')
@@ -16,74 +16,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
-import signal
-from gettext import gettext as _
 
-import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import GLib, Gio, Gtk
+from . import cli
 
-from .window import Window
-from .about import AboutDialog
 
-class Application(Gtk.Application):
-    def __init__(self, **kwargs):
-        super().__init__(application_id='se.tingping.DriConfig',
-                         flags=Gio.ApplicationFlags.HANDLES_COMMAND_LINE,
-                         **kwargs)
-        self.window = None
-        self.dialog = None
+def main(argv):
+    # Headless commands must not pay for importing GTK
+    if cli.handles(argv[1:]):
+        return cli.main(argv[1:])
 
-        self.add_main_option('version', ord('v'), GLib.OptionFlags.NONE, GLib.OptionArg.NONE,
-                             _('Print the version'), None)
-
-    def do_startup(self):
-        Gtk.Application.do_startup(self)
-        signal.signal(signal.SIGINT, signal.SIG_DFL)
-
-        action = Gio.SimpleAction.new('about', None)
-        action.connect('activate', self.on_about)
-        self.add_action(action)
-
-        action = Gio.SimpleAction.new('quit', None)
-        action.connect('activate', self.on_quit)
-        self.add_action(action)
-        self.add_accelerator('<Primary>q', 'app.quit')
-
-        app_menu = Gio.Menu.new()
-        app_menu.append(_('About'), 'app.about')
-        app_menu.append(_('Quit'), 'app.quit')
-        self.set_app_menu(app_menu)
-
-    def do_command_line(self, command_line) -> int:
-        options = command_line.get_options_dict()
-
-        if options.contains('version'):
-            # Broken bindings...
-            type(command_line).do_print_literal(command_line, '{}\n'.format('0.1.0'))
-            return 0
-
-        self.do_activate()
-        return 0
-
-    def do_activate(self):
-        if not self.window:
-            self.window = Window(application=self)
-        self.window.present()
-
-    def do_shutdown(self):
-        Gtk.Application.do_shutdown(self)
-        if self.window:
-            self.window.destroy()
-
-    def on_about(self, action, param):
-        if not self.dialog:
-            self.dialog = AboutDialog(transient_for=self.window)
-        self.dialog.present()
-
-    def on_quit(self, action, param):
-        self.window.destroy()
+    from .application import Application
+    app = Application()
+    return app.run(argv)
 
 if __name__ == '__main__':
-    app = Application()
-    sys.exit(app.run())
+    sys.exit(main(sys.argv))
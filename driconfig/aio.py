@@ -0,0 +1,268 @@
+# aio.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""asyncio counterparts of the probing API in driconfig.dri.
+
+The coroutines here run xdriinfo and glxinfo with
+asyncio.create_subprocess_exec() and return the same objects as their
+blocking namesakes in dri. Every coroutine takes an optional timeout in
+seconds that applies to each child process; a child that times out or
+whose caller is cancelled gets killed.
+
+If dri.GetBackend() is not a dri.SubprocessBackend its queries are run
+in the default executor instead.
+"""
+
+import asyncio
+import locale
+import weakref
+
+from . import dri, trace
+from .dri import DRIError, XMLError
+
+# Per event loop: driver name -> [loading task, number of waiters]
+_pendingDrivers = weakref.WeakKeyDictionary()
+
+
+async def _run(program, args, timeout):
+    """Run program and return its stdout, raising DRIError on failure."""
+    with trace.span(program, 'spawn', args=' '.join(args)):
+        return await _run_untraced(program, args, timeout)
+
+
+async def _run_untraced(program, args, timeout):
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            program, *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    except FileNotFoundError:
+        raise DRIError(program + ' not found.')
+    try:
+        output, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except BaseException as e:
+        # Timed out or cancelled, don't leave the child behind
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        if isinstance(e, asyncio.TimeoutError):
+            raise DRIError(program + ' timed out.')
+        raise
+    if proc.returncode < 0:
+        raise DRIError(program + ' killed by signal ' + str(-proc.returncode) + '.')
+    elif proc.returncode != 0:
+        raise DRIError(program + ' returned with non-zero exit code.')
+    return output
+
+
+async def _in_executor(timeout, func, *args):
+    """Run a blocking backend query without blocking the loop."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(None, func, *args),
+                                      timeout)
+    except asyncio.TimeoutError:
+        raise DRIError('query timed out.')
+
+
+async def XDriInfo(argStr, dpy=None, timeout=None):
+    """Call xdriinfo and raise DRIError on different failure conditions."""
+    backend = dri.GetBackend()
+    if not isinstance(backend, dri.SubprocessBackend):
+        return await _in_executor(timeout, backend.xdriinfo, argStr, dpy)
+    args = argStr.split()
+    if dpy is not None:
+        args = ['-display', dpy] + args
+    output = await _run('xdriinfo', args, timeout)
+    return output.decode(locale.getpreferredencoding(False), 'replace')
+
+
+async def _scan_glxinfo(args):
+    """Run glxinfo until it printed vendor and renderer.
+
+    Returns the dri.GLXInfoScanner and the exit status."""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            'glxinfo', *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+    except FileNotFoundError:
+        raise DRIError('glxinfo not found.')
+    scanner = dri.GLXInfoScanner()
+    try:
+        found = False
+        async for line in proc.stdout:
+            if scanner.feed(line):
+                found = True
+                break
+        if found and proc.returncode is None:
+            proc.kill()
+        status = await proc.wait()
+    except BaseException:
+        # Timed out or cancelled, don't leave the child behind
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    return scanner, None if found else status
+
+
+async def GLXInfo(screen, dpy, timeout=None):
+    """Run glxinfo for a screen and return a dri.GLXInfo.
+
+    Like dri.GLXInfo this prefers brief output and stops glxinfo as soon
+    as the vendor and renderer strings were read."""
+    backend = dri.GetBackend()
+    if not isinstance(backend, dri.SubprocessBackend):
+        info = dri.GLXInfo.__new__(dri.GLXInfo)
+        info.setStrings(*await _in_executor(timeout, backend.glxStrings,
+                                            screen, dpy))
+        return info
+    runs = dri.GLXInfoRuns(screen, dpy)
+    with trace.span('glxinfo', 'spawn', screen=screen):
+        while runs.args is not None:
+            try:
+                scanner, status = await asyncio.wait_for(_scan_glxinfo(runs.args),
+                                                         timeout)
+            except asyncio.TimeoutError:
+                raise DRIError('glxinfo timed out.')
+            runs.finish(scanner, status)
+    scanner = runs.scanner
+    info = dri.GLXInfo.__new__(dri.GLXInfo)
+    info.setStrings(scanner.vendor, scanner.renderer)
+    return info
+
+
+async def DriverInfo(name, cache=True, timeout=None):
+    """Obtain and parse config info for a driver, see dri.DriverInfo."""
+    dri.CheckDriverName(name)
+    if cache:
+        fingerprint = dri.DriverFingerprint(name)
+        optSections = dri.LoadCachedDriver(name, fingerprint)
+        if optSections is not None:
+            trace.count('driver disk cache hit', driver=name)
+            return dri.DriverInfo.fromSections(name, optSections)
+        trace.count('driver disk cache miss', driver=name)
+    driInfo = await XDriInfo('options ' + name, timeout=timeout)
+    driver = dri.DriverInfo(name, driInfo=driInfo)
+    if cache:
+        dri.StoreCachedDriver(name, fingerprint, driver.optSections)
+    return driver
+
+
+async def GetDriver(name, catch=1, timeout=None):
+    """Get the driver object for the named driver, see dri.GetDriver.
+
+    Drivers are shared with dri.DisplayInfo.drivers, including negative
+    entries. Concurrent calls for the same driver share one xdriinfo child,
+    which is only killed once every caller waiting for it has been
+    cancelled.
+    """
+    try:
+        dri.CheckDriverName(name)
+    except DRIError:
+        if catch:
+            return None
+        raise
+    try:
+        driver = dri.DisplayInfo.drivers[name]
+    except KeyError:
+        pass
+    except DRIError:
+        trace.count('driver cache hit', driver=name, negative=True)
+        if catch:
+            return None
+        raise
+    else:
+        trace.count('driver cache hit', driver=name, negative=False)
+        return driver
+    pending = _pendingDrivers.setdefault(asyncio.get_running_loop(), {})
+    load = pending.get(name)
+    trace.count('driver cache miss' if load is None else 'driver cache wait',
+                driver=name)
+    if load is None:
+        task = asyncio.ensure_future(DriverInfo(name, timeout=timeout))
+        load = pending[name] = [task, 0]
+
+        def done(task):
+            if pending.get(name) is load:
+                del pending[name]
+            if task.cancelled():
+                return
+            if task.exception() is None:
+                dri.DisplayInfo.drivers.put(name, task.result())
+            elif isinstance(task.exception(), DRIError):
+                dri.DisplayInfo.drivers.putError(name, task.exception())
+        task.add_done_callback(done)
+    load[1] += 1
+    try:
+        return await asyncio.shield(load[0])
+    except DRIError:
+        if catch:
+            return None
+        raise
+    finally:
+        load[1] -= 1
+        if load[1] == 0 and not load[0].done():
+            load[0].cancel()
+
+
+async def ScreenInfo(screen, dpy=None, timeout=None):
+    """Find or create the driver for a screen, see dri.ScreenInfo."""
+    info = dri.ScreenInfo.__new__(dri.ScreenInfo)
+    info.num = screen
+    driverName = (await XDriInfo('driver ' + str(screen), dpy, timeout)).strip()
+    try:
+        info.driver = await GetDriver(driverName, 0, timeout)
+    except XMLError as problem:
+        raise XMLError(str(problem) + '(driver ' + driverName + ')')
+    try:
+        info.glxInfo = await GLXInfo(screen, dpy, timeout)
+    except DRIError:
+        info.glxInfo = None
+    return info
+
+
+async def _probeScreen(i, dpy, timeout):
+    try:
+        return await ScreenInfo(i, dpy, timeout)
+    except DRIError:
+        return None
+    except XMLError as problem:
+        raise XMLError(str(problem) + ' (screen ' + str(i) + ')')
+
+
+async def DisplayInfo(dpy=None, timeout=None):
+    """Probe all screens on dpy concurrently, see dri.DisplayInfo.
+
+    Raises a DRIError if xdriinfo does not work for some reason.
+    """
+    nScreens = int(await XDriInfo('nscreens', dpy, timeout))
+    display = dri.DisplayInfo.__new__(dri.DisplayInfo)
+    display.dpy = dpy
+    results = await asyncio.gather(
+        *(_probeScreen(i, dpy, timeout) for i in range(nScreens)),
+        return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    display.screens = list(results)
+    return display
@@ -0,0 +1,221 @@
+# backends.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Alternatives to running xdriinfo and glxinfo, see dri.Backend.
+
+CtypesBackend asks libGL in process, FakeBackend serves a fixture so
+that probing can be tested and benchmarked without an X server or GPU.
+RecordFixture() creates such a fixture from a real display.
+"""
+
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import threading
+
+from . import dri, trace
+from .dri import DRIError
+
+
+class CtypesBackend(dri.Backend):
+    """ Calls glXGetScreenDriver and glXGetDriverConfig through ctypes.
+
+    These are the functions xdriinfo uses, so the answers are the same
+    without forking a process per query. The vendor and renderer strings
+    need a GL context, those are still read from glxinfo. """
+
+    def __init__(self):
+        """ Raises DRIError if libX11 or libGL can't be loaded. """
+        x11 = ctypes.util.find_library('X11')
+        gl = ctypes.util.find_library('GL')
+        if x11 is None or gl is None:
+            raise DRIError('libX11 or libGL not found.')
+        try:
+            self.x11 = ctypes.CDLL(x11)
+            self.gl = ctypes.CDLL(gl)
+        except OSError as e:
+            raise DRIError(str(e))
+        self.x11.XInitThreads()
+        self.x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        self.x11.XOpenDisplay.restype = ctypes.c_void_p
+        self.x11.XScreenCount.argtypes = [ctypes.c_void_p]
+        self.x11.XScreenCount.restype = ctypes.c_int
+        self.x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        getProcAddress = self.gl.glXGetProcAddressARB
+        getProcAddress.argtypes = [ctypes.c_char_p]
+        getProcAddress.restype = ctypes.c_void_p
+        getScreenDriver = getProcAddress(b'glXGetScreenDriver')
+        getDriverConfig = getProcAddress(b'glXGetDriverConfig')
+        if not getScreenDriver or not getDriverConfig:
+            raise DRIError('libGL does not support DRI configuration.')
+        self.getScreenDriver = ctypes.CFUNCTYPE(
+            ctypes.c_char_p, ctypes.c_void_p, ctypes.c_int)(getScreenDriver)
+        self.getDriverConfig = ctypes.CFUNCTYPE(
+            ctypes.c_char_p, ctypes.c_char_p)(getDriverConfig)
+        self.lock = threading.Lock()
+        self.displays = {}
+        self.glxinfo = dri.SubprocessBackend()
+
+    def display(self, dpy):
+        """ The Display pointer of dpy, opened once. """
+        display = self.displays.get(dpy)
+        if display is None:
+            display = self.x11.XOpenDisplay(dpy.encode() if dpy is not None else None)
+            if not display:
+                raise DRIError('unable to open display ' + str(dpy) + '.')
+            self.displays[dpy] = display
+        return display
+
+    def close(self):
+        """ Close all displays. """
+        with self.lock:
+            for display in self.displays.values():
+                self.x11.XCloseDisplay(display)
+            self.displays.clear()
+
+    def nScreens(self, dpy):
+        with self.lock, trace.span('XScreenCount', 'ctypes'):
+            return self.x11.XScreenCount(self.display(dpy))
+
+    def screenDriver(self, screen, dpy):
+        with self.lock, trace.span('glXGetScreenDriver', 'ctypes', screen=screen):
+            name = self.getScreenDriver(self.display(dpy), screen)
+        if not name:
+            raise DRIError('screen ' + str(screen) + ' is not direct rendering capable.')
+        return name.decode('utf-8', 'replace')
+
+    def driverConfig(self, name):
+        with self.lock, trace.span('glXGetDriverConfig', 'ctypes', driver=name):
+            config = self.getDriverConfig(name.encode())
+        if not config:
+            raise DRIError('driver ' + name + ' does not support configuration.')
+        return config.decode('utf-8', 'replace')
+
+    def glxStrings(self, screen, dpy):
+        return self.glxinfo.glxStrings(screen, dpy)
+
+
+class FakeBackend(dri.Backend):
+    """ Serves recorded answers instead of asking an X server.
+
+    A fixture is a JSON object, or the name of a file containing one:
+
+        {"displays": {":0": [{"driver": "radeon", "vendor": "X.Org",
+                              "renderer": "AMD TURKS"}, null]},
+         "drivers": {"radeon": {"file": "radeon-options.xml"}}}
+
+    Every display lists its screens, null stands for a screen that isn't
+    direct rendering capable. The catalog of a driver is either a string
+    or a file relative to the fixture file. Displays are looked up without
+    the screen number, None means $DISPLAY or ":0". queries counts the
+    answered queries. """
+
+    def __init__(self, fixture):
+        """ Raises DRIError if the fixture can't be read. """
+        self.baseDir = os.getcwd()
+        try:
+            if isinstance(fixture, str):
+                self.baseDir = os.path.dirname(os.path.abspath(fixture))
+                with open(fixture) as f:
+                    fixture = json.load(f)
+            self.displays = fixture.get('displays', {})
+            self.drivers = fixture.get('drivers', {})
+            key = json.dumps(fixture, sort_keys=True).encode()
+        except (OSError, ValueError, AttributeError) as e:
+            raise DRIError('invalid fixture: ' + str(e))
+        self.cacheKey = ('fake', hashlib.sha1(key).hexdigest())
+        self.queries = 0
+
+    def screens(self, dpy):
+        name = dpy or os.environ.get('DISPLAY') or ':0'
+        dot = name.find('.')
+        if dot != -1:
+            name = name[:dot]
+        self.queries += 1
+        if name not in self.displays:
+            raise DRIError('unable to open display ' + name + '.')
+        return self.displays[name]
+
+    def screen(self, screen, dpy):
+        screens = self.screens(dpy)
+        if screen < 0 or screen >= len(screens) or not screens[screen]:
+            raise DRIError('screen ' + str(screen) + ' is not direct rendering capable.')
+        return screens[screen]
+
+    def nScreens(self, dpy):
+        return len(self.screens(dpy))
+
+    def screenDriver(self, screen, dpy):
+        driver = self.screen(screen, dpy).get('driver')
+        if not driver:
+            raise DRIError('screen ' + str(screen) + ' is not direct rendering capable.')
+        return driver
+
+    def driverConfig(self, name):
+        self.queries += 1
+        config = self.drivers.get(name)
+        if config is None:
+            raise DRIError('driver ' + name + ' does not support configuration.')
+        if isinstance(config, dict):
+            try:
+                with open(os.path.join(self.baseDir, config['file']),
+                          encoding='utf-8') as f:
+                    return f.read()
+            except (OSError, KeyError) as e:
+                raise DRIError('invalid fixture: ' + str(e))
+        return config
+
+    def glxStrings(self, screen, dpy):
+        info = self.screen(screen, dpy)
+        if 'vendor' not in info or 'renderer' not in info:
+            raise DRIError('unable to parse glxinfo output.')
+        return info['vendor'], info['renderer']
+
+
+def RecordFixture(backend, dpy=None):
+    """ Ask backend about every screen of dpy and the drivers they use.
+
+    Returns a fixture for FakeBackend with the catalogs inlined. """
+    name = dpy or os.environ.get('DISPLAY') or ':0'
+    screens = []
+    drivers = {}
+    for i in range(backend.nScreens(dpy)):
+        try:
+            info = {'driver': backend.screenDriver(i, dpy)}
+        except DRIError:
+            screens.append(None)
+            continue
+        try:
+            vendor, renderer = backend.glxStrings(i, dpy)
+        except DRIError:
+            pass
+        else:
+            if vendor and renderer:
+                info['vendor'] = dri._GLXInfoToUnicode(vendor)
+                info['renderer'] = dri._GLXInfoToUnicode(renderer)
+        if info['driver'] not in drivers:
+            try:
+                drivers[info['driver']] = backend.driverConfig(info['driver'])
+            except DRIError:
+                drivers[info['driver']] = None
+        screens.append(info)
+    return {
+        'displays': {name.split('.')[0]: screens},
+        'drivers': dict((k, v) for k, v in drivers.items() if v is not None),
+    }
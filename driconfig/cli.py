@@ -0,0 +1,395 @@
+# cli.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Headless command line interface.
+
+This module must never import GTK, it is used for scripting where
+startup time matters.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+from gettext import gettext as _
+
+from . import __version__, dri, snapshot
+
+COMMANDS = {}
+
+
+def command(name, help):
+    def decorator(func):
+        COMMANDS[name] = (func, help)
+        return func
+    return decorator
+
+
+def handles(args):
+    """Whether args are for the CLI rather than the GUI."""
+    return bool(args) and (args[0] in COMMANDS or
+                           args[0] in ('-h', '--help', '-v', '--version'))
+
+
+def add_config_args(parser):
+    parser.add_argument('--config', action='append', metavar='FILE',
+                        help=_('configuration file, may be repeated, lowest '
+                               'precedence first (default: the files Mesa reads)'))
+
+
+def add_device_args(parser):
+    parser.add_argument('--screen', type=int, help=_('screen number'))
+    parser.add_argument('--driver', help=_('driver name'))
+
+
+def load_config(args):
+    return dri.LayeredConfig(args.config, loader=snapshot.LoadConfig)
+
+
+def add_catalog_args(parser):
+    parser.add_argument('--catalog', action='append', default=[],
+                        metavar='DRIVER=FILE',
+                        help=_('read the options of DRIVER from FILE '
+                               'instead of running xdriinfo'))
+
+
+def catalog_paths(args):
+    """Map driver names to the files given with --catalog."""
+    paths = {}
+    for catalog in args.catalog:
+        name, sep, path = catalog.partition('=')
+        if not sep:
+            raise dri.DRIError(_('invalid catalog {}, expected DRIVER=FILE').format(catalog))
+        paths[name] = path
+    return paths
+
+
+def load_drivers(args, names):
+    """Get DriverInfos for names from --catalog files or xdriinfo."""
+    drivers = {}
+    for name, path in catalog_paths(args).items():
+        with open(path) as f:
+            drivers[name] = dri.DriverInfo(name, driInfo=f.read())
+    for name in names:
+        if name not in drivers:
+            drivers[name] = dri.GetDriver(name)
+    return drivers
+
+
+def print_json(value):
+    json.dump(value, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+@command('options', _('Print the effective options of an application'))
+def cmd_options(args):
+    parser = argparse.ArgumentParser(prog='driconfig options')
+    parser.add_argument('executable', nargs='?')
+    add_device_args(parser)
+    add_config_args(parser)
+    parser.add_argument('--sha1', help=_('SHA-1 of the executable'))
+    parser.add_argument('--application-name', help=_('name the application reports'))
+    parser.add_argument('--application-version', type=int)
+    parser.add_argument('--engine', help=_('name of the engine the application uses'))
+    parser.add_argument('--engine-version', type=int)
+    parser.add_argument('--device-name', help=_('name of the GPU'))
+    parser.add_argument('--socket', help=_('ask the daemon listening on this socket'))
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(args)
+
+    process = dict(sha1=args.sha1, applicationName=args.application_name,
+                   applicationVersion=args.application_version,
+                   engineName=args.engine, engineVersion=args.engine_version,
+                   deviceName=args.device_name)
+    if args.socket:
+        from . import daemon
+        with daemon.Client(args.socket) as client:
+            options = client.call('options', executable=args.executable,
+                                  screen=args.screen, driver=args.driver, **process)
+    else:
+        options = load_config(args).getOptions(args.executable, args.screen,
+                                               args.driver, **process)
+    if args.json:
+        print_json(options)
+    else:
+        for name, value in sorted(options.items()):
+            print('{}={}'.format(name, value))
+    return 0
+
+
+def probe_display(args):
+    return dri.DisplayInfo(args.display, concurrent=True)
+
+
+@command('screens', _('List the screens of the display and their drivers'))
+def cmd_screens(args):
+    parser = argparse.ArgumentParser(prog='driconfig screens')
+    parser.add_argument('--display')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(args)
+
+    screens = []
+    for screen in probe_display(args).screens:
+        if screen is None:
+            continue
+        glx = screen.glxInfo
+        screens.append({
+            'screen': screen.num,
+            'driver': screen.driver.name if screen.driver else None,
+            'vendor': glx.vendor if glx else None,
+            'renderer': glx.renderer if glx else None,
+        })
+    if args.json:
+        print_json(screens)
+    else:
+        for screen in screens:
+            print('{screen}: {driver} ({renderer})'.format(**screen))
+    return 0
+
+
+@command('drivers', _('List the drivers used on the display'))
+def cmd_drivers(args):
+    parser = argparse.ArgumentParser(prog='driconfig drivers')
+    parser.add_argument('--display')
+    args = parser.parse_args(args)
+
+    names = set()
+    for screen in probe_display(args).screens:
+        if screen is not None and screen.driver is not None:
+            names.add(screen.driver.name)
+    for name in sorted(names):
+        print(name)
+    return 0
+
+
+def add_edit_args(parser):
+    parser.add_argument('executable', help=_('executable, "all" for every application'))
+    parser.add_argument('option')
+    add_device_args(parser)
+    parser.add_argument('--file', default=os.path.expanduser(dri.USER_CONFIG),
+                        help=_('configuration file to modify (default: %(default)s)'))
+
+
+def edit_target(args):
+    executable = None if args.executable == 'all' else args.executable
+    return executable, dict(screen=args.screen, driver=args.driver)
+
+
+@command('set', _('Set an option for an application'))
+def cmd_set(args):
+    parser = argparse.ArgumentParser(prog='driconfig set')
+    add_edit_args(parser)
+    parser.add_argument('value')
+    add_catalog_args(parser)
+    args = parser.parse_args(args)
+
+    if args.driver:
+        driver = load_drivers(args, [args.driver])[args.driver]
+        opt = driver and driver.getOptInfo(args.option)
+        if driver is not None and opt is None:
+            sys.stderr.write(_('{}: unknown option for {}\n').format(args.option, args.driver))
+            return 1
+        if opt is not None and not opt.validate(args.value):
+            sys.stderr.write(_('{}: invalid value {}\n').format(args.option, args.value))
+            return 1
+
+    config = dri.DRIConfig(args.file, create=True)
+    executable, device = edit_target(args)
+    config.setOption(executable, args.option, args.value, **device)
+    config.save()
+    return 0
+
+
+@command('unset', _('Remove an option for an application'))
+def cmd_unset(args):
+    parser = argparse.ArgumentParser(prog='driconfig unset')
+    add_edit_args(parser)
+    args = parser.parse_args(args)
+
+    config = dri.DRIConfig(args.file, create=True)
+    executable, device = edit_target(args)
+    if not config.unsetOption(executable, args.option, **device):
+        sys.stderr.write(_('{}: not set\n').format(args.option))
+        return 1
+    config.save()
+    return 0
+
+
+@command('validate', _('Check configuration files against the driver options'))
+def cmd_validate(args):
+    parser = argparse.ArgumentParser(prog='driconfig validate')
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    add_catalog_args(parser)
+    parser.add_argument('--json', action='store_true', help=_('print JSON lines'))
+    args = parser.parse_args(args)
+
+    configs = [dri.DRIConfig(path) for path in args.files]
+    names = set(d.driver for c in configs for d in c.devices if d.driver)
+    validator = dri.ConfigValidator(load_drivers(args, sorted(names)))
+    status = 0
+    for config in configs:
+        for diag in validator.validate(config):
+            status = 1
+            if args.json:
+                json.dump({'file': config.fileName, 'application': diag.app.name,
+                           'option': diag.option, 'value': diag.value,
+                           'driver': diag.driver, 'problem': diag.problem},
+                          sys.stdout, sort_keys=True)
+                sys.stdout.write('\n')
+            else:
+                print('{}: {}'.format(config.fileName, diag))
+    return status
+
+
+@command('scan', _('Print the options set in configuration files'))
+def cmd_scan(args):
+    parser = argparse.ArgumentParser(prog='driconfig scan')
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('--driver', help=_('only devices for this driver'))
+    parser.add_argument('--executable', help=_('only applications for this executable'))
+    parser.add_argument('--json', action='store_true', help=_('print JSON lines'))
+    args = parser.parse_args(args)
+
+    for path in args.files:
+        for device, app, name, value in dri.IterConfig(
+                path, args.driver, args.executable, options=True):
+            if args.json:
+                json.dump({'file': path, 'screen': device.screen,
+                           'driver': device.driver, 'application': app.name,
+                           'executable': app.executable, 'option': name,
+                           'value': value}, sys.stdout, sort_keys=True)
+                sys.stdout.write('\n')
+            else:
+                print('{}: {}: {}={}'.format(path, app.name, name, value))
+    return 0
+
+
+def read_file_list(path):
+    f = sys.stdin if path == '-' else open(path)
+    try:
+        for line in f:
+            line = line.rstrip('\n')
+            if line:
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+@command('lint', _('Validate many configuration files in parallel'))
+def cmd_lint(args):
+    from . import lint
+    parser = argparse.ArgumentParser(prog='driconfig lint')
+    parser.add_argument('files', nargs='*', metavar='FILE')
+    parser.add_argument('--files-from', metavar='LIST',
+                        help=_('also check the files listed in LIST, one per line, '
+                               '"-" for standard input'))
+    add_catalog_args(parser)
+    parser.add_argument('--fixture', help=_('read driver catalogs from a fake backend fixture'))
+    parser.add_argument('-j', '--jobs', type=int,
+                        help=_('number of worker processes (default: one per CPU)'))
+    args = parser.parse_args(args)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error(_('--jobs must be at least 1'))
+
+    paths = iter(args.files)
+    if args.files_from:
+        paths = itertools.chain(paths, read_file_list(args.files_from))
+    status = 0
+    for path, diagnostics in lint.Lint(paths, catalog_paths(args), args.fixture, args.jobs):
+        for record in diagnostics:
+            status = 1
+            json.dump(record, sys.stdout, sort_keys=True)
+            sys.stdout.write('\n')
+        sys.stdout.flush()
+    return status
+
+
+@command('daemon', _('Answer queries on a Unix domain socket'))
+def cmd_daemon(args):
+    from . import daemon
+    parser = argparse.ArgumentParser(prog='driconfig daemon')
+    parser.add_argument('--socket', help=_('socket path (default: {})').format(
+        daemon.SocketPath()))
+    add_config_args(parser)
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help=_('seconds between checks for changed files'))
+    parser.add_argument('--probe-timeout', type=float, default=10.0,
+                        help=_('seconds after which xdriinfo and glxinfo are killed'))
+    args = parser.parse_args(args)
+
+    service = daemon.Service(args.config, loader=snapshot.LoadConfig,
+                             poll_interval=args.poll_interval,
+                             probe_timeout=args.probe_timeout)
+    with daemon.Server(args.socket, service) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+@command('search', _('Find applications by name, executable, option or description'))
+def cmd_search(args):
+    parser = argparse.ArgumentParser(prog='driconfig search')
+    parser.add_argument('query', nargs='+')
+    add_config_args(parser)
+    add_catalog_args(parser)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(args)
+
+    config = load_config(args)
+    apps = [app for device in config.devices for app in device.apps]
+    drivers = load_drivers(args, [])
+    index = dri.SearchIndex(apps, [d for d in drivers.values() if d is not None])
+    results = []
+    for app in index.search(' '.join(args.query)):
+        device = app.device
+        results.append({'file': device.config.fileName, 'screen': device.screen,
+                        'driver': device.driver, 'application': app.name,
+                        'executable': app.executable, 'options': app.options})
+    if args.json:
+        print_json(results)
+    else:
+        for result in results:
+            print('{file}: {application} ({executable})'.format(**result))
+    return 0
+
+
+def usage():
+    lines = [_('usage: driconfig [COMMAND] [ARGS...]'), '',
+             _('Without a command the graphical interface is started.'), '',
+             _('Commands:')]
+    for name, (func, help) in COMMANDS.items():
+        lines.append('  {:10} {}'.format(name, help))
+    return '\n'.join(lines) + '\n'
+
+
+def main(args):
+    if not args or args[0] in ('-h', '--help'):
+        sys.stdout.write(usage())
+        return 0
+    if args[0] in ('-v', '--version'):
+        print(__version__)
+        return 0
+    func, help = COMMANDS[args[0]]
+    try:
+        return func(args[1:])
+    except (dri.Error, OSError) as e:
+        sys.stderr.write('driconfig: {}\n'.format(e))
+        return 1
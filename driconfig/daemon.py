@@ -0,0 +1,299 @@
+# daemon.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Long running query service on a Unix domain socket.
+
+A Server keeps the configuration files, probed displays and driver
+catalogs in memory so that clients don't have to parse and probe again
+on every invocation. Configuration files are checked for changes at
+most every poll_interval seconds, before a query is answered.
+
+The protocol is JSON lines, one request and one response per line:
+
+    {"id": 1, "method": "options", "params": {"executable": "glxgears"}}
+    {"id": 1, "result": {"vblank_mode": "0"}}
+
+A failed request gets {"id": 1, "error": "message"} instead. The methods
+are the handle_* methods of Service, params are their keyword
+arguments.
+"""
+
+import asyncio
+import inspect
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+from . import __version__, aio, dri
+
+
+class DaemonError(dri.Error):
+    """ A request the daemon could not answer """
+    pass
+
+
+def SocketPath():
+    """ The default socket, in $XDG_RUNTIME_DIR if it is set. """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or dri.CacheDir()
+    return os.path.join(runtime_dir, 'driconfig.sock')
+
+
+class Service:
+    """ The state of the daemon and the methods clients can call.
+
+    Handlers run concurrently, one thread per connection. lock only
+    guards the configuration and the probed displays; probing happens
+    outside of it through driconfig.aio, so every xdriinfo and glxinfo
+    child is killed after probe_timeout seconds.
+
+    If a configuration file becomes invalid the last valid configuration
+    keeps being served and the problem is kept in problem, which ping
+    reports, until the file is fixed. """
+
+    def __init__(self, paths=None, loader=None, poll_interval=1.0,
+                 probe_timeout=10.0):
+        self.lock = threading.Lock()
+        self.config = dri.LayeredConfig(paths, loader=loader)
+        self.poll_interval = poll_interval
+        self.probe_timeout = probe_timeout
+        self.checked = time.monotonic()
+        self.displays = {}
+        self.problem = None
+
+    def call(self, method, params):
+        """ Run a method, raising DaemonError for bad requests. """
+        handler = getattr(self, 'handle_' + str(method), None)
+        if handler is None:
+            raise DaemonError('unknown method ' + str(method))
+        if not isinstance(params, dict):
+            raise DaemonError('params must be an object')
+        try:
+            inspect.signature(handler).bind(**params)
+        except TypeError as e:
+            raise DaemonError('invalid params: ' + str(e))
+        with self.lock:
+            now = time.monotonic()
+            if now - self.checked >= self.poll_interval:
+                self.checked = now
+                self.poll()
+        return handler(**params)
+
+    def poll(self):
+        """ Reload the configuration, keeping the last valid one if a file
+        is invalid. Called with lock held. """
+        try:
+            self.config.reload()
+        except (dri.Error, OSError) as e:
+            if str(e) != self.problem:
+                sys.stderr.write('driconfig: {}\n'.format(e))
+            self.problem = str(e)
+        else:
+            self.problem = None
+
+    def probe(self, coro):
+        """ Run an aio coroutine in the calling handler thread. """
+        return asyncio.run(coro)
+
+    def display(self, dpy, probe=False):
+        """ The DisplayInfo of dpy, probed once unless probe is true. """
+        with self.lock:
+            display = None if probe else self.displays.get(dpy)
+        if display is None:
+            display = self.probe(aio.DisplayInfo(dpy, self.probe_timeout))
+            with self.lock:
+                self.displays[dpy] = display
+        return display
+
+    def drivers(self, names):
+        """ Map names to their DriverInfos, None for unsupported drivers. """
+        async def load():
+            return await asyncio.gather(*(aio.GetDriver(name, timeout=self.probe_timeout)
+                                          for name in names))
+        return dict(zip(names, self.probe(load())))
+
+    def handle_ping(self):
+        with self.lock:
+            problem = self.problem
+        return {'version': __version__, 'pid': os.getpid(), 'problem': problem}
+
+    def handle_reload(self):
+        """ Check the configuration files now, returns the changed ones.
+
+        Unlike the periodic check this reports an invalid file as an
+        error. """
+        with self.lock:
+            self.checked = time.monotonic()
+            self.problem = None
+            try:
+                return self.config.reload()
+            except (dri.Error, OSError) as e:
+                self.problem = str(e)
+                raise
+
+    def handle_options(self, executable=None, screen=None, driver=None,
+                       sha1=None, applicationName=None, applicationVersion=None,
+                       engineName=None, engineVersion=None, deviceName=None):
+        with self.lock:
+            return self.config.getOptions(
+                executable, screen, driver, sha1=sha1,
+                applicationName=applicationName,
+                applicationVersion=applicationVersion, engineName=engineName,
+                engineVersion=engineVersion, deviceName=deviceName)
+
+    def handle_screens(self, display=None, probe=False):
+        screens = []
+        for screen in self.display(display, probe).screens:
+            if screen is None:
+                continue
+            glx = screen.glxInfo
+            screens.append({
+                'screen': screen.num,
+                'driver': screen.driver.name if screen.driver else None,
+                'vendor': glx.vendor if glx else None,
+                'renderer': glx.renderer if glx else None,
+            })
+        return screens
+
+    def handle_catalog(self, driver):
+        """ The option catalog of a driver as XML, None if it has none. """
+        info = self.drivers([driver])[driver]
+        return str(info) if info is not None else None
+
+    def handle_invalidate(self, driver=None):
+        """ Forget cached drivers and displays. """
+        dri.DisplayInfo.drivers.invalidate(driver)
+        with self.lock:
+            self.displays.clear()
+
+    def handle_validate(self, files=None):
+        """ Diagnostics for files, default the watched configuration. """
+        if files is None:
+            with self.lock:
+                configs = list(self.config.configs)
+        else:
+            configs = [dri.DRIConfig(path) for path in files]
+        names = set(d.driver for c in configs for d in c.devices if d.driver)
+        validator = dri.ConfigValidator(self.drivers(sorted(names)))
+        result = []
+        for config in configs:
+            for diag in validator.validate(config):
+                result.append({'file': config.fileName, 'application': diag.app.name,
+                               'option': diag.option, 'value': diag.value,
+                               'driver': diag.driver, 'problem': diag.problem})
+        return result
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                if not isinstance(request, dict):
+                    raise DaemonError('request must be an object')
+            except (ValueError, DaemonError) as e:
+                self.respond({'id': None, 'error': 'invalid request: ' + str(e)})
+                continue
+            response = {'id': request.get('id')}
+            try:
+                response['result'] = self.server.service.call(
+                    request.get('method'), request.get('params', {}))
+            except (dri.Error, OSError) as e:
+                response['error'] = str(e)
+            except Exception:
+                traceback.print_exc()
+                response['error'] = 'internal error'
+            self.respond(response)
+
+    def respond(self, response):
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Answers requests on a Unix domain socket.
+
+    A stale socket left behind by a daemon that died is replaced, a live
+    one raises DaemonError. """
+    daemon_threads = True
+
+    def __init__(self, path=None, service=None):
+        self.path = path or SocketPath()
+        self.service = service or Service()
+        if os.path.exists(self.path):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                raise DaemonError('a daemon is already listening on ' + self.path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        super().__init__(self.path, _Handler)
+        os.chmod(self.path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class Client:
+    """ Connection to a daemon.
+
+    Methods are called with call('options', executable='glxgears') and
+    errors reported by the daemon are raised as DaemonError. """
+
+    def __init__(self, path=None, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path or SocketPath())
+        except OSError:
+            self.sock.close()
+            raise
+        self.file = self.sock.makefile('rwb')
+        self.next_id = 0
+
+    def call(self, method, **params):
+        self.next_id += 1
+        request = {'id': self.next_id, 'method': method, 'params': params}
+        self.file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise DaemonError('daemon closed the connection')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise DaemonError(response['error'])
+        return response['result']
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
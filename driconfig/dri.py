@@ -18,12 +18,24 @@
 #
 # Contact: http://fxk.de.vu/
 
+import io
 import os
-import string
 import re
+import glob
 import locale
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import heapq
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
 import xml.parsers.expat
-from functools import reduce
+
+from . import trace
 
 
 class Error(Exception):
@@ -46,26 +58,135 @@ class XMLError(Error):
     pass
 
 
-def XDriInfo(argStr, dpy=None):
-    """ Call xdriinfo and raise DRIError on different failure conditions """
-    if dpy is not None:
-        dpyStr = "-display " + dpy + " "
-    else:
-        dpyStr = ""
-    infopipe = os.popen("xdriinfo " + dpyStr + argStr, "r")
-    driInfo = infopipe.read()
-    result = infopipe.close()
-    if result is not None:
-        signal = result & 0xff
-        status = result >> 8
-        if signal != 0:
-            raise DRIError("XDriInfo killed by signal " + signal + ".")
-        elif status == 127:
-            raise DRIError("XDriInfo not found.\n"
-                           "Please locate and install the package xdriinfo.")
-        else:
+class Backend:
+    """ How the dri module queries the X server and the DRI drivers.
+
+    Subclasses implement nScreens, screenDriver, driverConfig and
+    glxStrings, which raise DRIError if the information isn't available.
+    SubprocessBackend is the default, driconfig.backends has the others.
+    See GetBackend. """
+
+    # Distinguishes the driver catalogs of backends in the disk cache
+    cacheKey = None
+
+    def nScreens(self, dpy):
+        """ The number of screens of dpy. """
+        raise NotImplementedError
+
+    def screenDriver(self, screen, dpy):
+        """ The name of the DRI driver of a screen. """
+        raise NotImplementedError
+
+    def driverConfig(self, name):
+        """ The XML option catalog of a driver. """
+        raise NotImplementedError
+
+    def glxStrings(self, screen, dpy):
+        """ The raw OpenGL vendor and renderer strings of a screen. """
+        raise NotImplementedError
+
+    def xdriinfo(self, argStr, dpy=None):
+        """ Answer like xdriinfo with the arguments in argStr does. """
+        args = argStr.split()
+        if args == ["nscreens"]:
+            return str(self.nScreens(dpy)) + "\n"
+        elif len(args) == 2 and args[0] == "driver":
+            return self.screenDriver(int(args[1]), dpy) + "\n"
+        elif len(args) == 2 and args[0] == "options":
+            return self.driverConfig(args[1])
+        raise DRIError("unsupported query: " + argStr)
+
+
+class SubprocessBackend(Backend):
+    """ Runs the xdriinfo and glxinfo programs. """
+
+    def xdriinfo(self, argStr, dpy=None):
+        """ Call xdriinfo and raise DRIError on different failure
+        conditions """
+        return self.run(argStr.split(), dpy)
+
+    def run(self, args, dpy=None):
+        """ Run xdriinfo with the argument list args, never through a
+        shell, and return its output. """
+        if dpy is not None:
+            args = ["-display", dpy] + args
+        with trace.span("xdriinfo", "spawn", args=" ".join(args)):
+            try:
+                proc = subprocess.run(["xdriinfo"] + args, shell=False,
+                                      stdin=subprocess.DEVNULL,
+                                      stdout=subprocess.PIPE,
+                                      universal_newlines=True)
+            except FileNotFoundError:
+                raise DRIError("XDriInfo not found.\n"
+                               "Please locate and install the package "
+                               "xdriinfo.")
+        if proc.returncode < 0:
+            raise DRIError("XDriInfo killed by signal " +
+                           str(-proc.returncode) + ".")
+        elif proc.returncode != 0:
             raise DRIError("XDriInfo returned with non-zero exit code.")
-    return driInfo
+        return proc.stdout
+
+    def nScreens(self, dpy):
+        output = self.xdriinfo("nscreens", dpy)
+        try:
+            return int(output)
+        except ValueError:
+            raise DRIError("unable to parse xdriinfo output.")
+
+    def screenDriver(self, screen, dpy):
+        return self.xdriinfo("driver " + str(screen), dpy).strip()
+
+    def driverConfig(self, name):
+        CheckDriverName(name)
+        return self.run(["options", name])
+
+    def glxStrings(self, screen, dpy):
+        with trace.span("glxinfo", "spawn", screen=screen):
+            scanner = _ScanGLXInfo(screen, dpy)
+        return scanner.vendor, scanner.renderer
+
+
+_backend = None
+
+
+def GetBackend():
+    """ The Backend all queries go through.
+
+    Unless SetBackend was called it is chosen by the DRICONFIG_BACKEND
+    environment variable on first use: "subprocess" (the default),
+    "ctypes" or "fake:FIXTURE", see driconfig.backends. """
+    global _backend
+    if _backend is None:
+        spec = os.environ.get("DRICONFIG_BACKEND") or "subprocess"
+        kind, sep, arg = spec.partition(":")
+        if kind == "subprocess":
+            _backend = SubprocessBackend()
+        else:
+            from . import backends
+            if kind == "ctypes":
+                _backend = backends.CtypesBackend()
+            elif kind == "fake":
+                _backend = backends.FakeBackend(arg)
+            else:
+                raise DRIError("unknown backend " + spec)
+    return _backend
+
+
+def SetBackend(backend):
+    """ Use backend for all further queries, None restores the default.
+
+    Drivers cached in memory are dropped. """
+    global _backend
+    _backend = backend
+    DisplayInfo.drivers.invalidate()
+
+
+def XDriInfo(argStr, dpy=None):
+    """ Query like xdriinfo would, through the current backend.
+
+    Raises DRIError on different failure conditions. """
+    return GetBackend().xdriinfo(argStr, dpy)
 
 
 def StrToValue(str, type):
@@ -88,6 +209,32 @@ def StrToValue(str, type):
         raise XMLError("invalid value '" + str + "' for type '" + type + "'")
 
 
+# Memoized StrToValue results, _INVALID marks strings that don't convert
+_INVALID = object()
+_convertCache = {}
+_CONVERT_CACHE_SIZE = 65536
+
+
+def ConvertValue(str, type):
+    """ Helper: StrToValue with memoized results.
+
+    Option values in large configs repeat a lot, so each distinct string
+    is only converted once per type. """
+    key = (type, str)
+    value = _convertCache.get(key)
+    if value is None:
+        try:
+            value = StrToValue(str, type)
+        except XMLError:
+            value = _INVALID
+        if len(_convertCache) >= _CONVERT_CACHE_SIZE:
+            _convertCache.clear()
+        _convertCache[key] = value
+    if value is _INVALID:
+        raise XMLError("invalid value '" + str + "' for type '" + type + "'")
+    return value
+
+
 def ValueToStr(value, type):
     """ Helper: convert value of given type to string. """
     if type == "int" or type == "enum" or type == "float":
@@ -98,6 +245,174 @@ def ValueToStr(value, type):
         return "false"
 
 
+# Bump whenever the pickled layout of the option classes changes
+CACHE_VERSION = 3
+
+# Where Mesa installs DRI drivers unless LIBGL_DRIVERS_PATH says otherwise
+DRIVER_SEARCH_PATH = ("/usr/lib64/dri", "/usr/lib/dri",
+                      "/usr/lib/x86_64-linux-gnu/dri",
+                      "/usr/lib/i386-linux-gnu/dri",
+                      "/usr/lib/aarch64-linux-gnu/dri",
+                      "/usr/lib32/dri")
+
+
+def CacheDir():
+    """ Helper: directory holding persistent caches.
+
+    Follows the XDG base directory specification. """
+    base = os.environ.get("XDG_CACHE_HOME")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "dri-config")
+
+
+def _FileStamp(path):
+    """ Helper: (path, mtime, size) of a file or None if it doesn't exist. """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def DriverFingerprint(name):
+    """ Identify the installed xdriinfo and driver binaries.
+
+    A change to either of them invalidates cached config info. Returns
+    None if the driver library can't be found, an upgrade could then go
+    unnoticed, so its config info must not be cached. Backends with a
+    cacheKey identify the config info themselves and don't need it. """
+    stamps = []
+    xdriinfo = shutil.which("xdriinfo")
+    if xdriinfo is not None:
+        stamps.append(_FileStamp(xdriinfo))
+    searchPath = [d for d in os.environ.get("LIBGL_DRIVERS_PATH", "").split(":")
+                  if d]
+    found = False
+    for d in searchPath + list(DRIVER_SEARCH_PATH):
+        stamp = _FileStamp(os.path.join(d, name + "_dri.so"))
+        if stamp is not None:
+            stamps.append(stamp)
+            found = True
+            break
+    cacheKey = GetBackend().cacheKey
+    if cacheKey is not None:
+        stamps.append(cacheKey)
+    elif not found:
+        return None
+    return tuple(stamps)
+
+
+# ASCII only, \w would accept any letter and $ a trailing newline
+_DRIVER_NAME = re.compile(r"[A-Za-z0-9_.-]+")
+
+
+def CheckDriverName(name):
+    """ Raise a DRIError unless name can be the name of a DRI driver.
+
+    Driver names end up in command lines and file names, and they are
+    read from configuration files that may not be trustworthy. """
+    if not _DRIVER_NAME.fullmatch(name) or name.startswith((".", "-")):
+        raise DRIError("invalid driver name " + repr(name) + ".")
+
+
+def _DriverCachePath(name):
+    """ Helper: cache file for a driver or None if name is unsuitable. """
+    try:
+        CheckDriverName(name)
+    except DRIError:
+        return None
+    return os.path.join(CacheDir(), "drivers", name + ".pickle")
+
+
+def LoadCachedDriver(name, fingerprint):
+    """ Get the cached option sections of a driver.
+
+    Returns None if there is no usable cache entry for this fingerprint
+    or the fingerprint is None. """
+    path = _DriverCachePath(name)
+    if path is None or fingerprint is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            version, cachedName, cachedPrint, optSections = pickle.load(f)
+    except Exception:
+        return None
+    if version != CACHE_VERSION or cachedName != name or \
+       cachedPrint != fingerprint:
+        return None
+    return optSections
+
+
+def StoreCachedDriver(name, fingerprint, optSections):
+    """ Write the option sections of a driver to the cache.
+
+    Failing to write the cache is not an error. Nothing is written if
+    the fingerprint is None. """
+    path = _DriverCachePath(name)
+    if path is None or fingerprint is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((CACHE_VERSION, name, fingerprint, optSections),
+                            f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpPath, path)
+        except BaseException:
+            os.unlink(tmpPath)
+            raise
+    except OSError:
+        pass
+
+
+def XMLAttr(value):
+    """ Helper: quote and escape value for use as an XML attribute. """
+    return '"' + value.replace("&", "&amp;").replace("<", "&lt;") \
+        .replace(">", "&gt;").replace('"', "&quot;") + '"'
+
+
+def _ToStr(obj):
+    """ Helper: serialize obj by calling its write method. """
+    f = io.StringIO()
+    obj.write(f)
+    return f.getvalue()
+
+
+def SaveAtomically(filename, obj):
+    """ Write obj to filename by means of obj.write(f), or write obj
+    itself if it is bytes.
+
+    The data is written to a temporary file in the same directory which
+    then replaces filename, so readers see either the old or the new file
+    and never a partially written one. Permissions of an existing file
+    are kept. """
+    dirName = os.path.dirname(os.path.abspath(filename))
+    fd, tmpPath = tempfile.mkstemp(dir=dirName,
+                                   prefix="." + os.path.basename(filename))
+    try:
+        if isinstance(obj, bytes):
+            f = os.fdopen(fd, "wb")
+        else:
+            f = os.fdopen(fd, "w", encoding="UTF-8")
+        with f:
+            if isinstance(obj, bytes):
+                f.write(obj)
+            else:
+                obj.write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmpPath, os.stat(filename).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(tmpPath, 0o644)
+        os.replace(tmpPath, filename)
+    except BaseException:
+        os.unlink(tmpPath)
+        raise
+
+
 def GetDesc(desc, preferredLangs):
     """ Helper: get a description with a list of language preferences.
 
@@ -109,20 +424,75 @@ def GetDesc(desc, preferredLangs):
             return desc[lang]
     if "en" in desc:
         return desc["en"]
-    if len(list(desc.values())) > 0:
-        return list(desc.values())[0]
-    return None
+    return next(iter(desc.values()), None)
+
+
+def PreferredLangs():
+    """ The languages of the message locale, most preferred first.
+
+    Like gettext this looks at LANGUAGE, LC_ALL, LC_MESSAGES and LANG.
+    Each language is followed by its code without the territory, so
+    "de_AT.UTF-8" gives ("de_AT", "de"). """
+    for var in ("LANGUAGE", "LC_ALL", "LC_MESSAGES", "LANG"):
+        value = os.environ.get(var)
+        if value:
+            break
+    else:
+        return ()
+    langs = []
+    for name in value.split(":"):
+        name = name.split(".")[0].split("@")[0]
+        if not name or name in ("C", "POSIX"):
+            continue
+        for lang in (name, name.split("_")[0]):
+            if lang not in langs:
+                langs.append(lang)
+    return tuple(langs)
+
+
+class DescTable:
+    """ The descriptions of a DriverInfo resolved for one language list.
+
+    GetDesc is run once per option and section when the table is built,
+    afterwards every description and enum label is a dictionary lookup.
+    See DriverInfo.getDescTable. """
+    __slots__ = ("langs", "options", "sections")
+
+    def __init__(self, driver, langs):
+        self.langs = langs
+        self.options = {}
+        self.sections = []
+        for optSection in driver.optSections:
+            self.sections.append(GetDesc(optSection.desc, langs))
+            for name, opt in optSection.options.items():
+                if name not in self.options:
+                    self.options[name] = GetDesc(opt.desc, langs)
+
+    def desc(self, name):
+        """ The description text of an option, None if it has none. """
+        optDesc = self.options.get(name)
+        return optDesc.text if optDesc is not None else None
+
+    def enum(self, name, value):
+        """ The label of an enum value of an option, or None. """
+        optDesc = self.options.get(name)
+        return optDesc.enums.get(value) if optDesc is not None else None
+
+    def section(self, i):
+        """ The description of option section i. """
+        return self.sections[i]
 
 
 class Range:
     """ An interval """
+    __slots__ = ("start", "end")
 
     def __init__(self, str, type):
         """ Parse str as a range.
 
         Raises an XMLError if str is not a legal range. """
         assert type == "int" or type == "enum" or type == "float"
-        list = string.split(str, ":")
+        list = str.split(":")
         if len(list) == 0 or len(list) > 2:
             raise XMLError("Invalid range '" + str + "'")
         if len(list) >= 1:
@@ -144,6 +514,7 @@ class Range:
 
 class OptDesc:
     """ An option description in one language with enum values. """
+    __slots__ = ("lang", "text", "enums")
 
     def __init__(self, lang, text):
         self.lang = lang
@@ -151,17 +522,25 @@ class OptDesc:
         self.enums = {}
 
     def __str__(self):
-        result = '<description lang="' + self.lang + '" text="' + self.text + \
-                 '">\n'
-        for value in sort(list(self.enums.keys())):
-            result = result + '<enum value="' + str(value) + '" text="' + \
-                     self.enums[value] + '" />\n'
-        result = result + '</description>'
-        return result
+        return _ToStr(self)
+
+    def write(self, f):
+        """ Write the XML representation to the file-like object f. """
+        f.write('<description lang=' + XMLAttr(self.lang) + ' text=' +
+                XMLAttr(self.text) + '>\n')
+        for value in sorted(self.enums.keys()):
+            f.write('<enum value="' + str(value) + '" text=' +
+                    XMLAttr(self.enums[value]) + ' />\n')
+        f.write('</description>')
 
 
 class OptInfo:
-    """ All advertised information about an option. """
+    """ All advertised information about an option.
+
+    The valid ranges are also kept merged and sorted in rangeStarts and
+    rangeEnds, so that checking a value is a binary search. """
+    __slots__ = ("name", "type", "valid", "default", "desc",
+                 "rangeStarts", "rangeEnds")
 
     def __init__(self, name, type, default, valid=None):
         """ Initialize option information.
@@ -178,12 +557,15 @@ class OptInfo:
             raise XMLError("invalid type '" + type + "'")
         self.type = type
         self.valid = None
+        self.rangeStarts = None
+        self.rangeEnds = None
         if valid:
             if type == "bool":
                 raise XMLError(
                     "valid attribute is not allowed with bool options")
             else:
-                self.valid = [Range(x, type) for x in string.split(valid, ",")]
+                self.valid = [Range(x, type) for x in valid.split(",")]
+                self.compileRanges()
         if not self.validate(default):
             raise XMLError("default value is out of valid range")
         else:
@@ -191,38 +573,111 @@ class OptInfo:
         self.desc = {}
 
     def __str__(self):
-        result = '<option name="' + self.name + '" type="' + self.type + \
-                 '" default="' + ValueToStr(self.default, self.type) + '" '
+        return _ToStr(self)
+
+    def write(self, f):
+        """ Write the XML representation to the file-like object f. """
+        f.write('<option name=' + XMLAttr(self.name) + ' type="' + self.type +
+                '" default="' + ValueToStr(self.default, self.type) + '" ')
         if self.valid:
-            return result + 'valid="' + \
-                   reduce(lambda x, y: x+','+y, list(map(str, self.valid))) + \
-                   '" />'
-        else:
-            return result + '/>'
+            f.write('valid="' + ",".join(map(str, self.valid)) + '" ')
+        f.write('/>')
+
+    def compileRanges(self):
+        """ Merge and sort the valid ranges into rangeStarts/rangeEnds. """
+        starts = []
+        ends = []
+        for r in sorted(self.valid, key=lambda r: (r.start, r.end)):
+            if ends and r.start <= ends[-1]:
+                ends[-1] = max(ends[-1], r.end)
+            else:
+                starts.append(r.start)
+                ends.append(r.end)
+        self.rangeStarts = starts
+        self.rangeEnds = ends
+
+    def inRange(self, value):
+        """ Check that an already converted value is in a valid range. """
+        if not self.valid:
+            return 1
+        i = bisect_right(self.rangeStarts, value) - 1
+        return int(i >= 0 and value <= self.rangeEnds[i])
 
     def validate(self, str):
         """ Check that str is of correct type and in a valid range. """
         try:
-            v = StrToValue(str, self.type)
+            v = ConvertValue(str, self.type)
         except XMLError:
             return 0
-        if self.valid:
-            for r in self.valid:
-                if v >= r.start and v <= r.end:
-                    return 1
-            return 0
-        else:
-            return 1
+        return self.inRange(v)
 
     def getDesc(self, preferredLangs):
         return GetDesc(self.desc, preferredLangs)
 
 
+# Values of TypedValue.status
+VALUE_VALID = "valid"
+VALUE_UNKNOWN = "unknown option"
+VALUE_INVALID = "invalid"
+VALUE_OUT_OF_RANGE = "out of valid range"
+
+
+class TypedValue:
+    """ An option value converted once against the option's OptInfo.
+
+    raw is the string from the configuration and opt the OptInfo or None
+    if the option is unknown. value is the converted value, it is None if
+    raw isn't a valid value of the type. canonical is the string the
+    driver would write for value, or raw if it could not be converted.
+    status is one of the VALUE_* constants.
+
+    TypedValues are shared, don't modify them. """
+    __slots__ = ("raw", "opt", "value", "canonical", "status")
+
+    def __init__(self, raw, opt):
+        self.raw = raw
+        self.opt = opt
+        self.value = None
+        self.canonical = raw
+        if opt is None:
+            self.status = VALUE_UNKNOWN
+            return
+        try:
+            self.value = ConvertValue(raw, opt.type)
+        except XMLError:
+            self.status = VALUE_INVALID
+            return
+        self.canonical = sys.intern(ValueToStr(self.value, opt.type))
+        self.status = VALUE_VALID if opt.inRange(self.value) \
+            else VALUE_OUT_OF_RANGE
+
+    def __repr__(self):
+        return "TypedValue(" + repr(self.raw) + ", " + self.status + ")"
+
+
+_typedValues = {}
+
+
+def TypeValue(raw, opt):
+    """ Get the shared TypedValue of raw for the OptInfo opt.
+
+    Each distinct string is only converted once per option. """
+    key = (opt, raw)
+    typed = _typedValues.get(key)
+    if typed is None:
+        typed = TypedValue(raw, opt)
+        if len(_typedValues) >= _CONVERT_CACHE_SIZE:
+            _typedValues.clear()
+        _typedValues[key] = typed
+    return typed
+
+
 class OptSection:
     """ Representation of an option section.
 
     Contains descriptions and OptInfos as dictionaries. Options are also
     in a list so they can be extracted in a meaningful order. """
+    __slots__ = ("desc", "options", "optList")
 
     def __init__(self):
         """ Desc and options are initialized empty. """
@@ -231,11 +686,16 @@ class OptSection:
         self.optList = []
 
     def __str__(self):
-        result = '    <section>\n'
-        for opt in list(self.options.values()):
-            result = result + '        ' + str(opt) + '\n'
-        result = result + '    </section>'
-        return result
+        return _ToStr(self)
+
+    def write(self, f):
+        """ Write the XML representation to the file-like object f. """
+        f.write('    <section>\n')
+        for opt in self.options.values():
+            f.write('        ')
+            opt.write(f)
+            f.write('\n')
+        f.write('    </section>')
 
     def validate(self, valDict):
         """ Validate a dictionary of option values agains this OptSection. """
@@ -263,22 +723,24 @@ class DriverInfo:
             if "name" not in attr or "type" not in attr or \
                "default" not in attr:
                 raise XMLError("mandatory option attribute missing")
+            optName = sys.intern(attr["name"])
+            optType = sys.intern(attr["type"])
             if "valid" in attr:
-                self.curOption = OptInfo(attr["name"], attr["type"],
+                self.curOption = OptInfo(optName, optType,
                                          attr["default"], attr["valid"])
             else:
-                self.curOption = OptInfo(attr["name"], attr["type"],
-                                         attr["default"])
-            self.curOptSection.options[attr["name"]] = self.curOption
+                self.curOption = OptInfo(optName, optType, attr["default"])
+            self.curOptSection.options[optName] = self.curOption
             self.curOptSection.optList.append(self.curOption)
         elif name == "description":
             if "lang" not in attr or "text" not in attr:
                 raise XMLError("description attribute missing")
+            lang = sys.intern(attr["lang"])
             if self.curOption is not None:
-                self.curOptDesc = OptDesc(attr["lang"], attr["text"])
-                self.curOption.desc[attr["lang"]] = self.curOptDesc
+                self.curOptDesc = OptDesc(lang, attr["text"])
+                self.curOption.desc[lang] = self.curOptDesc
             elif self.curOptSection is not None:
-                self.curOptSection.desc[attr["lang"]] = attr["text"]
+                self.curOptSection.desc[lang] = attr["text"]
             else:
                 raise XMLError("description outside an option or section")
         elif name == "enum":
@@ -303,16 +765,57 @@ class DriverInfo:
         elif name == "description":
             self.curOptDesc = None
 
-    def __init__(self, name):
+    def __init__(self, name, cache=True, driInfo=None):
         """ Obtain and parse config info for this driver.
 
+        Unless cache is false, the parsed config info is kept in CacheDir()
+        and reused as long as DriverFingerprint(name) doesn't change.
+
+        If driInfo is given it is parsed instead of running xdriinfo and the
+        cache is not used.
+
         Raises a DRIError if the driver does not support configuration.
 
         Raises a XMLError if the config info is illegal. """
         self.name = name
-        driInfo = XDriInfo("options " + name)
+        self.curOptSection = None
+        self.curOption = None
+        self.curOptDesc = None
+        self.optIndex = None
+        self.descTable = None
+        if driInfo is not None:
+            self.parse(driInfo)
+            return
+        CheckDriverName(name)
+        if cache:
+            fingerprint = DriverFingerprint(name)
+            self.optSections = LoadCachedDriver(name, fingerprint)
+            if self.optSections is not None:
+                trace.count("driver disk cache hit", driver=name)
+                return
+            trace.count("driver disk cache miss", driver=name)
+        self.parse(GetBackend().driverConfig(name))
+        if cache:
+            StoreCachedDriver(name, fingerprint, self.optSections)
+
+    @classmethod
+    def fromSections(cls, name, optSections):
+        """ Create a DriverInfo from already parsed option sections. """
+        self = cls.__new__(cls)
+        self.name = name
+        self.optSections = optSections
+        self.curOptSection = None
+        self.curOption = None
+        self.curOptDesc = None
+        self.optIndex = None
+        self.descTable = None
+        return self
 
+    def parse(self, driInfo):
+        """ Parse config info as printed by xdriinfo options. """
         self.optSections = []
+        self.optIndex = None
+        self.descTable = None
         self.curOptSection = None
         self.curOption = None
         self.curOptDesc = None
@@ -322,32 +825,58 @@ class DriverInfo:
         p.EndElementHandler = self.endElement
 
         try:
-            p.Parse(driInfo)
+            with trace.span("parse driver info", "parse", driver=self.name):
+                p.Parse(driInfo, True)
         except xml.parsers.expat.ExpatError as problem:
             raise XMLError("ExpatError: " + str(problem))
 
     def __str__(self):
-        result = '<driconf>\n'
+        return _ToStr(self)
+
+    def write(self, f):
+        """ Write the XML representation to the file-like object f. """
+        f.write('<driconf>\n')
         for sect in self.optSections:
-            result = result + str(sect) + '\n'
-        result = result + '</driconf>\n'
-        return result
+            sect.write(f)
+            f.write('\n')
+        f.write('</driconf>\n')
 
     def validate(self, valDict):
         """ Validate a dictionary of option values against this DriverInfo. """
-        allValid = 1
-        for optSection in self.optSections:
-            allValid = allValid and optSection.validate(valDict)
-        return allValid
+        index = self.getOptIndex()
+        for name, value in valDict.items():
+            opt = index.get(name)
+            if opt is not None and not opt.validate(value):
+                return 0
+        return 1
+
+    def getOptIndex(self):
+        """ Get a dictionary of all options in all sections by name. """
+        if self.optIndex is None:
+            index = {}
+            for optSection in self.optSections:
+                for name, opt in optSection.options.items():
+                    index.setdefault(name, opt)
+            self.optIndex = index
+        return self.optIndex
+
+    def getDescTable(self, preferredLangs=None):
+        """ Get the DescTable for preferredLangs, default PreferredLangs().
+
+        The table is kept until it is asked for with other languages. """
+        if preferredLangs is None:
+            preferredLangs = PreferredLangs()
+        langs = tuple(preferredLangs)
+        table = self.descTable
+        if table is None or table.langs != langs:
+            table = self.descTable = DescTable(self, langs)
+        return table
 
     def getOptInfo(self, name):
         """ Return an option info for a given option name.
 
         If no such option exists in any section, None is returned. """
-        for optSection in self.optSections:
-            if name in optSection.options:
-                return optSection.options[name]
-        return None
+        return self.getOptIndex().get(name)
 
 
 def _GLXInfoToUnicode(string):
@@ -359,6 +888,8 @@ def _GLXInfoToUnicode(string):
     # Try a number of popular encodings starting with the locale's default.
     # Try utf-8 before latin1, since latin1 will almost always succeed
     # but not necessarily be correct.
+    if isinstance(string, str):
+        return string
     lang, defenc = locale.getlocale(locale.LC_MESSAGES)
     if not defenc:
         encodings = ('utf-8', 'iso8859-1')
@@ -374,40 +905,157 @@ def _GLXInfoToUnicode(string):
     return str(string, 'ascii', 'replace')
 
 
-class GLXInfo:
+def GLXDisplay(screen, dpy):
+    """ Helper: the display string glxinfo needs to query screen on dpy. """
+    if dpy is None:
+        if "DISPLAY" in os.environ:
+            dpy = os.environ["DISPLAY"]
+        else:
+            dpy = ":0"
+    dot = dpy.find(".")
+    if dot != -1:
+        dpy = dpy[:dot]
+    return dpy + "." + str(screen)
+
+
+# Whether glxinfo understands -B (brief output), None until it was tried
+GLXInfoBrief = None
+
+
+def GLXInfoArgs(screen, dpy):
+    """ Helper: the glxinfo arguments to query screen on dpy. """
+    args = ["-display", GLXDisplay(screen, dpy)]
+    if GLXInfoBrief is not False:
+        args.insert(0, "-B")
+    return args
+
+
+# Lines of glxinfo output that mean it didn't understand its arguments
+_GLXINFO_USAGE = re.compile(
+    rb"usage|unknown option|invalid option|unrecognized option", re.I)
+
+
+class GLXInfoScanner:
+    """ Picks the vendor and renderer strings out of glxinfo output.
+
+    Lines are fed as bytes and nothing is decoded, so that only the two
+    lines that matter need to be converted. usage is set if glxinfo
+    complained about its arguments. """
+    __slots__ = ("vendor", "renderer", "usage")
+    VENDOR = b"OpenGL vendor string: "
+    RENDERER = b"OpenGL renderer string: "
+
+    def __init__(self):
+        self.vendor = None
+        self.renderer = None
+        self.usage = False
+
+    def feed(self, line):
+        """ Look at one line, returns True once both strings were found. """
+        if line.startswith(self.VENDOR):
+            self.vendor = line[len(self.VENDOR):].rstrip(b"\r\n")
+        elif line.startswith(self.RENDERER):
+            self.renderer = line[len(self.RENDERER):].rstrip(b"\r\n")
+        elif _GLXINFO_USAGE.search(line):
+            self.usage = True
+        return self.vendor is not None and self.renderer is not None
+
+
+class GLXInfoRuns:
+    """ Decides which glxinfo runs are needed to query a screen.
+
+    Shared by _ScanGLXInfo and aio.GLXInfo, which only differ in how they
+    run glxinfo, with stderr merged into stdout:
+
+        runs = GLXInfoRuns(screen, dpy)
+        while runs.args is not None:
+            ... run glxinfo with runs.args, feeding a GLXInfoScanner ...
+            runs.finish(scanner, status)
+        return runs.scanner
+
+    Brief output is tried first. If it fails, glxinfo is run again with
+    full output, but GLXInfoBrief is only set to False if glxinfo
+    rejected -B, not if the display or screen was the problem. """
+
     def __init__(self, screen, dpy):
-        if dpy is None:
-            if "DISPLAY" in os.environ:
-                dpy = os.environ["DISPLAY"]
-            else:
-                dpy = ":0"
-        dot = dpy.find(".")
-        if dot != -1:
-            dpy = dpy[:dot]
-        dpyStr = "-display " + dpy + "." + str(screen)
-        infopipe = os.popen("glxinfo " + dpyStr, "r")
-        glxInfo = infopipe.read()
-        result = infopipe.close()
-        if result is not None:
-            signal = result & 0xff
-            status = result >> 8
-            if signal != 0:
-                raise DRIError("glxinfo killed by signal " + signal + ".")
-            elif status == 127:
-                raise DRIError("glxinfo not found.")
-            else:
-                raise DRIError("glxinfo returned with non-zero exit code.")
+        self.screen = screen
+        self.dpy = dpy
+        self.args = GLXInfoArgs(screen, dpy)
+        self.scanner = None
+
+    def finish(self, scanner, status):
+        """ Record a run. status is None if glxinfo was killed after the
+        strings were found. Raises DRIError if glxinfo failed. """
+        global GLXInfoBrief
+        brief = self.args[0] == "-B"
+        self.scanner = scanner
+        self.args = None
+        if scanner.vendor is not None and scanner.renderer is not None:
+            if brief:
+                GLXInfoBrief = True
+            return
+        if brief:
+            if scanner.usage and GLXInfoBrief is None:
+                GLXInfoBrief = False
+            self.args = ["-display", GLXDisplay(self.screen, self.dpy)]
+            return
+        if status is not None and status < 0:
+            raise DRIError("glxinfo killed by signal " + str(-status) + ".")
+        elif status:
+            raise DRIError("glxinfo returned with non-zero exit code.")
+
+
+def _ScanGLXInfo(screen, dpy):
+    """ Helper: run glxinfo until it printed vendor and renderer.
+
+    Returns the GLXInfoScanner. glxinfo is killed as soon as both strings
+    were read, before it lists extensions and visuals. """
+    runs = GLXInfoRuns(screen, dpy)
+    while runs.args is not None:
+        try:
+            proc = subprocess.Popen(["glxinfo"] + runs.args,
+                                    stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+        except FileNotFoundError:
+            raise DRIError("glxinfo not found.")
+        scanner = GLXInfoScanner()
+        with proc:
+            found = False
+            for line in proc.stdout:
+                if scanner.feed(line):
+                    found = True
+                    break
+            if found and proc.poll() is None:
+                proc.kill()
+            status = proc.wait()
+        runs.finish(scanner, None if found else status)
+    return runs.scanner
+
+
+class GLXInfo:
+    def __init__(self, screen, dpy, glxInfo=None):
+        """ Run glxinfo for a screen and parse its output.
+
+        If glxInfo is given it is parsed instead of running glxinfo. """
+        if glxInfo is None:
+            self.setStrings(*GetBackend().glxStrings(screen, dpy))
         else:
-            # Parse
-            vMatch = re.search("^OpenGL vendor string: (.*)$", glxInfo, re.M)
-            rMatch = re.search("^OpenGL renderer string: (.*)$", glxInfo, re.M)
-            self.vendor = vMatch and vMatch.group(1)
-            self.renderer = rMatch and rMatch.group(1)
-            if not self.vendor or not self.renderer:
-                raise DRIError("unable to parse glxinfo output.")
-            # Make sure we end up with valid unicode
-            self.vendor = _GLXInfoToUnicode(self.vendor)
-            self.renderer = _GLXInfoToUnicode(self.renderer)
+            self.parse(glxInfo)
+
+    def parse(self, glxInfo):
+        """ Extract vendor and renderer strings from glxinfo output. """
+        vMatch = re.search("^OpenGL vendor string: (.*)$", glxInfo, re.M)
+        rMatch = re.search("^OpenGL renderer string: (.*)$", glxInfo, re.M)
+        self.setStrings(vMatch and vMatch.group(1), rMatch and rMatch.group(1))
+
+    def setStrings(self, vendor, renderer):
+        """ Set vendor and renderer from raw glxinfo strings. """
+        if not vendor or not renderer:
+            raise DRIError("unable to parse glxinfo output.")
+        # Make sure we end up with valid unicode
+        self.vendor = _GLXInfoToUnicode(vendor)
+        self.renderer = _GLXInfoToUnicode(renderer)
 
 
 class ScreenInfo:
@@ -421,7 +1069,7 @@ class ScreenInfo:
 
         Raises a XMLError if the config info is illegal. """
         self.num = screen
-        driverName = XDriInfo("driver " + str(screen), dpy)
+        driverName = GetBackend().screenDriver(screen, dpy)
         try:
             self.driver = GetDriver(driverName, 0)
         except XMLError as problem:
@@ -433,19 +1081,171 @@ class ScreenInfo:
                 self.glxInfo = None
 
 
+class DriverCache:
+    """ Thread-safe, bounded cache of DriverInfos by driver name.
+
+    Drivers that don't support configuration are remembered as negative
+    entries holding their DRIError for negativeTTL seconds, so they are not
+    probed again on every query. At most maxSize entries are kept, the
+    least recently used are dropped first.
+
+    cache[name] returns the driver, raises the DRIError of a negative
+    entry or raises KeyError if name isn't cached. """
+
+    def __init__(self, maxSize=64, negativeTTL=60.0, clock=time.monotonic):
+        self.maxSize = maxSize
+        self.negativeTTL = negativeTTL
+        self.clock = clock
+        self.lock = threading.Lock()
+        # name -> (driver, error, expiry time or None)
+        self.entries = OrderedDict()
+        # Futures of drivers that are currently being loaded by some thread
+        self.pending = {}
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def __contains__(self, name):
+        with self.lock:
+            return self._lookup(name) is not None
+
+    def __getitem__(self, name):
+        with self.lock:
+            entry = self._lookup(name)
+        if entry is None:
+            raise KeyError(name)
+        driver, error, expires = entry
+        if error is not None:
+            raise error.with_traceback(None)
+        return driver
+
+    def _lookup(self, name):
+        """ The live entry for name or None, must hold lock. """
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        if entry[2] is not None and entry[2] <= self.clock():
+            del self.entries[name]
+            return None
+        self.entries.move_to_end(name)
+        return entry
+
+    def _store(self, name, entry):
+        """ Add an entry, evicting old ones, must hold lock. """
+        self.entries[name] = entry
+        self.entries.move_to_end(name)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def put(self, name, driver):
+        """ Cache a driver. """
+        with self.lock:
+            self._store(name, (driver, None, None))
+
+    def putError(self, name, error):
+        """ Remember that loading a driver failed with a DRIError. """
+        with self.lock:
+            self._store(name, (None, error,
+                               self.clock() + self.negativeTTL))
+
+    def invalidate(self, name=None):
+        """ Forget a driver, or all of them if name is None.
+
+        Loads that are in progress are not affected. """
+        with self.lock:
+            if name is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(name, None)
+
+    clear = invalidate
+
+    def load(self, name, loader):
+        """ Get a driver, calling loader(name) on a miss.
+
+        Concurrent misses for the same name share one call of loader. A
+        DRIError raised by loader is cached as a negative entry and
+        raised, like any other exception, to every caller. """
+        with self.lock:
+            entry = self._lookup(name)
+            if entry is None:
+                future = self.pending.get(name)
+                loading = future is None
+                if loading:
+                    from concurrent.futures import Future
+                    future = self.pending[name] = Future()
+        if entry is not None:
+            trace.count("driver cache hit", driver=name,
+                        negative=entry[1] is not None)
+            if entry[1] is not None:
+                raise entry[1].with_traceback(None)
+            return entry[0]
+        trace.count("driver cache miss" if loading else "driver cache wait",
+                    driver=name)
+        if loading:
+            try:
+                driver = loader(name)
+            except BaseException as problem:
+                with self.lock:
+                    if isinstance(problem, DRIError):
+                        self._store(name, (None, problem, self.clock() +
+                                           self.negativeTTL))
+                    del self.pending[name]
+                future.set_exception(problem)
+            else:
+                with self.lock:
+                    self._store(name, (driver, None, None))
+                    del self.pending[name]
+                future.set_result(driver)
+        return future.result()
+
+
 class DisplayInfo:
     """ Maintains config info for all screens and drivers on a display """
-    drivers = {}
+    # Shared by all displays, see GetDriver
+    drivers = DriverCache()
 
-    def __init__(self, dpy=None):
+    def __init__(self, dpy=None, concurrent=False):
         """ Find all direct rendering capable screens on dpy.
 
+        If concurrent is true all screens are probed at the same time
+        instead of one after the other.
+
         Raises a DRIError if xdriinfo does not work for some reason. """
         self.dpy = dpy
-        nScreens = int(XDriInfo("nscreens", dpy))
+        nScreens = GetBackend().nScreens(dpy)
         self.screens = [None for i in range(nScreens)]
-        for i in range(nScreens):
-            self.getScreen(i)
+        if concurrent and nScreens > 1:
+            self.probeScreens()
+        else:
+            for i in range(nScreens):
+                self.getScreen(i)
+
+    def probeScreens(self):
+        """ Probe all screens that are still unknown concurrently.
+
+        Drivers shared by several screens are only loaded once. The
+        resulting screens are the same as calling getScreen for each of
+        them in order, including the XMLError for the first bad screen. """
+        todo = [i for i in range(len(self.screens)) if self.screens[i] is None]
+        if not todo:
+            return
+        # concurrent.futures pulls in logging, keep it off the startup path
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(todo)) as pool:
+            futures = [(i, pool.submit(self._probeScreen, i)) for i in todo]
+        for i, future in futures:
+            self.screens[i] = future.result()
+
+    def _probeScreen(self, i):
+        """ Create the screen object for screen i without storing it. """
+        try:
+            return ScreenInfo(i, self.dpy)
+        except DRIError:
+            return None
+        except XMLError as problem:
+            raise XMLError(str(problem) + " (screen " + str(i) + ")")
 
     def getScreen(self, i):
         """ Get the screen object for screen i.
@@ -459,13 +1259,7 @@ class DisplayInfo:
             return None
         if self.screens[i] != None:
             return self.screens[i]
-        try:
-            screen = ScreenInfo(i, self.dpy)
-        except DRIError:
-            screen = None
-        except XMLError as problem:
-            self.screens[i] = None
-            raise XMLError(str(problem) + " (screen " + str(i) + ")")
+        screen = self._probeScreen(i)
         self.screens[i] = screen
         return screen
 
@@ -476,67 +1270,197 @@ def GetDriver(name, catch=1):
     Returns None if the DRI driver does not support configuration.
 
     Raises a XMLError if the DRI driver's configuration information is
-    invalid. """
-    if name in DisplayInfo.drivers:
-        return DisplayInfo.drivers[name]
+    invalid.
+
+    This is thread-safe. Drivers are cached in DisplayInfo.drivers, see
+    DriverCache, and concurrent calls for the same driver share a single
+    DriverInfo. """
     try:
-        driver = DriverInfo(name)
-    except DRIError as problem:
+        CheckDriverName(name)
+        return DisplayInfo.drivers.load(name, DriverInfo)
+    except DRIError:
         if catch:
-            driver = None
-        else:
-            raise DRIError() from problem
-    else:
-        DisplayInfo.drivers[name] = driver
-    return driver
+            return None
+        raise
+
+
+# Application attributes besides name and executable that restrict which
+# processes an application or engine element applies to
+APP_SELECTORS = ("executable_regexp", "sha1", "application_name_match",
+                 "application_versions")
+ENGINE_SELECTORS = ("engine_name_match", "engine_versions")
+
+
+def _Selectors(attr, names):
+    """ Helper: the selector attributes in attr as a dict, None if none. """
+    selectors = None
+    for name in names:
+        if name in attr:
+            if selectors is None:
+                selectors = {}
+            selectors[name] = sys.intern(attr[name])
+    return selectors
+
+
+def _SelectorAttrs(selectors):
+    """ Helper: selectors as XML attributes. """
+    if not selectors:
+        return ''
+    return ''.join(' ' + n + '=' + XMLAttr(v) for n, v in selectors.items())
+
+
+def OptionTag(name, value):
+    """ Helper: the XML element setting an option in a drirc. """
+    return '<option name=' + XMLAttr(name) + ' value=' + XMLAttr(value) + \
+        ' />'
 
 
 class AppConfig:
     """ Configuration data of an application given by the executable name.
 
-    If no executable name is specified it applies to all applications. """
+    If no executable name is specified it applies to all applications.
+
+    selectors holds the other attributes of APP_SELECTORS that further
+    restrict which processes the application applies to, or None. See
+    OptionResolver for how they are matched.
+
+    srcPos is the byte offset of the element in the file it was parsed
+    from, which allows DRIConfig.save to patch the file in place.
+
+    options maps option names to the strings in the file, typed holds
+    their TypedValues once getTypedOptions was called. """
+    __slots__ = ("device", "name", "executable", "options", "srcPos",
+                 "selectors", "typed")
+    TAG = "application"
+    SELECTORS = APP_SELECTORS
 
-    def __init__(self, device, name, executable=None):
+    def __init__(self, device, name, executable=None, selectors=None):
         self.device = device
         self.name = name
         self.executable = executable
         self.options = {}
+        self.srcPos = None
+        self.selectors = selectors
+        self.typed = None
 
     def __str__(self):
-        result = '        <application name="' + self.name + '"'
+        return _ToStr(self)
+
+    def getTypedOptions(self, driver):
+        """ Get the options as a dictionary of TypedValues for a driver.
+
+        driver is a DriverInfo or None if there is none, making every
+        option unknown. The result is kept and only options whose string
+        or OptInfo changed since the last call are looked up again. Don't
+        modify it. """
+        optIndex = driver.getOptIndex() if driver is not None else {}
+        typed = self.typed
+        if typed is None:
+            typed = self.typed = {}
+        elif len(typed) != len(self.options):
+            typed = self.typed = dict((n, v) for n, v in typed.items()
+                                      if n in self.options)
+        for name, raw in self.options.items():
+            opt = optIndex.get(name)
+            value = typed.get(name)
+            if value is None or value.opt is not opt or value.raw != raw:
+                typed[name] = TypeValue(raw, opt)
+        return typed
+
+    def startTag(self):
+        result = '<application name=' + XMLAttr(self.name)
         if self.executable is not None:
-            result = result + ' executable="' + self.executable + '">\n'
-        else:
-            result = result + '>\n'
-        for n, v in list(self.options.items()):
-            result = result + '            <option name="' + n + \
-                     '" value="' + v + '" />\n'
-        result = result + '        </application>'
-        return result
+            result = result + ' executable=' + XMLAttr(self.executable)
+        return result + _SelectorAttrs(self.selectors) + '>'
+
+    def write(self, f):
+        """ Write the XML representation to the file-like object f. """
+        f.write('        ' + self.startTag() + '\n')
+        for n, v in self.options.items():
+            f.write('            ' + OptionTag(n, v) + '\n')
+        f.write('        </' + self.TAG + '>')
+
+
+def EngineName(selectors):
+    """ A name to show for an engine element with the given selectors. """
+    selectors = selectors or {}
+    name = "Engine " + selectors.get("engine_name_match", "*")
+    if "engine_versions" in selectors:
+        name = name + " (" + selectors["engine_versions"] + ")"
+    return name
+
+
+class EngineConfig(AppConfig):
+    """ Configuration data of all applications using a game engine.
+
+    The engine is given by the ENGINE_SELECTORS in selectors, at least
+    engine_name_match. Engines have no executable, their name is made
+    up from the selectors for display and is not written to the file. """
+    __slots__ = ()
+    TAG = "engine"
+    SELECTORS = ENGINE_SELECTORS
+
+    def __init__(self, device, selectors):
+        AppConfig.__init__(self, device, EngineName(selectors), None, selectors)
+
+    def startTag(self):
+        return '<engine' + _SelectorAttrs(self.selectors) + '>'
 
 
 class DeviceConfig:
     """ Configuration data of a device given by screen and/or driver.
 
-    If neither screen nor driver is specified it applies to all devices. """
+    If neither screen nor driver is specified it applies to all devices.
+    deviceName is the device attribute which restricts the device to GPUs
+    of that name, or None.
 
-    def __init__(self, config, screen=None, driver=None):
+    srcPos is the byte offset of the element in the file it was parsed
+    from, see AppConfig. """
+    __slots__ = ("config", "screen", "driver", "apps", "srcPos", "deviceName")
+
+    def __init__(self, config, screen=None, driver=None, deviceName=None):
         self.config = config
         self.screen = screen
         self.driver = driver
         self.apps = []
+        self.srcPos = None
+        self.deviceName = deviceName
 
     def __str__(self):
-        result = '    <device'
+        return _ToStr(self)
+
+    def startTag(self):
+        result = '<device'
         if self.screen:
-            result = result + ' screen="' + self.screen + '"'
+            result = result + ' screen=' + XMLAttr(self.screen)
         if self.driver:
-            result = result + ' driver="' + self.driver + '"'
-        result = result + '>\n'
+            result = result + ' driver=' + XMLAttr(self.driver)
+        if self.deviceName is not None:
+            result = result + ' device=' + XMLAttr(self.deviceName)
+        return result + '>'
+
+    def write(self, f):
+        """ Write the XML representation to the file-like object f. """
+        f.write('    ' + self.startTag() + '\n')
         for a in self.apps:
-            result = result + str(a) + '\n'
-        result = result + '    </device>'
-        return result
+            a.write(f)
+            f.write('\n')
+        f.write('    </device>')
+
+    def getApp(self, executable, create=False):
+        """ Find the application for an executable, None for all.
+
+        Applications with selectors are not considered. Returns None if
+        there is none, unless create is true in which case a new
+        application named like the executable is appended. """
+        for app in self.apps:
+            if app.executable == executable and app.selectors is None:
+                return app
+        if not create:
+            return None
+        app = AppConfig(self, executable or "all", executable)
+        self.apps.append(app)
+        return app
 
     def getDriver(self, display):
         """ Get the driver object for this device.
@@ -563,61 +1487,1216 @@ class DRIConfig:
     def startElement(self, name, attr):
         """ Handle start_element events from XML parser. """
         if name == "device":
+            intern = sys.intern
             if "screen" in attr and "driver" in attr:
-                self.curDevice = DeviceConfig(self, attr["screen"],
-                                              attr["driver"])
+                self.curDevice = DeviceConfig(self, intern(attr["screen"]),
+                                              intern(attr["driver"]))
             elif "screen" in attr:
-                self.curDevice = DeviceConfig(self, screen=attr["screen"])
+                self.curDevice = DeviceConfig(self,
+                                              screen=intern(attr["screen"]))
             elif "driver" in attr:
-                self.curDevice = DeviceConfig(self, driver=attr["driver"])
+                self.curDevice = DeviceConfig(self,
+                                              driver=intern(attr["driver"]))
             else:
                 self.curDevice = DeviceConfig(self)
+            if "device" in attr:
+                self.curDevice.deviceName = intern(attr["device"])
+            self.curDevice.srcPos = self.parser.CurrentByteIndex
             self.devices.append(self.curDevice)
         elif name == "application":
             if self.curDevice is None:
                 raise XMLError("application outside a device")
             if "name" not in attr:
                 raise XMLError("mandatory application attribute missing")
-            if "executable" in attr:
-                self.curApp = AppConfig(self.curDevice, attr["name"],
-                                        attr["executable"])
-            else:
-                self.curApp = AppConfig(self.curDevice, attr["name"])
+            self.curApp = AppConfig(self.curDevice, attr["name"],
+                                    attr.get("executable"),
+                                    _Selectors(attr, APP_SELECTORS))
+            self.curApp.srcPos = self.parser.CurrentByteIndex
+            self.curDevice.apps.append(self.curApp)
+        elif name == "engine":
+            if self.curDevice is None:
+                raise XMLError("engine outside a device")
+            if "engine_name_match" not in attr:
+                raise XMLError("mandatory engine attribute missing")
+            self.curApp = EngineConfig(self.curDevice,
+                                       _Selectors(attr, ENGINE_SELECTORS))
+            self.curApp.srcPos = self.parser.CurrentByteIndex
             self.curDevice.apps.append(self.curApp)
         elif name == "option":
             if self.curApp is None:
                 raise XMLError("option outside an application")
             if "name" not in attr or "value" not in attr:
                 raise XMLError("option attribute missing")
-            self.curApp.options[attr["name"]] = attr["value"]
+            # Names and values repeat a lot in large files, share them
+            self.curApp.options[sys.intern(attr["name"])] = \
+                sys.intern(attr["value"])
 
     def endElement(self, name):
         """ Handle end_element events from XML parser. """
         if name == "device":
             self.curDevice = None
-        elif name == "application":
+        elif name == "application" or name == "engine":
             self.curApp = None
 
-    def __init__(self, filename: str):
-        """ Parse configuration file. """
+    def __init__(self, filename: str, create=False, source=None):
+        """ Parse configuration file.
+
+        The contents of the file are kept in source, so that save() can
+        preserve comments and formatting. If source is given it is parsed
+        instead of reading filename, so a caller that already read the
+        file parses exactly those bytes.
+
+        If create is true a file that doesn't exist yet is treated as an
+        empty configuration. """
         self.devices = []
         self.curDevice = None
         self.curApp = None
         self.fileName = filename
+        self.source = None
 
         assert(filename is not None)
-        with open(filename, 'rb') as f:
-            p = xml.parsers.expat.ParserCreate(encoding='UTF-8')
-            p.StartElementHandler = self.startElement
-            p.EndElementHandler = self.endElement
+        if source is None:
+            if create and not os.path.exists(filename):
+                return
+            with open(filename, 'rb') as f:
+                source = f.read()
+        p = xml.parsers.expat.ParserCreate(encoding='UTF-8')
+        p.StartElementHandler = self.startElement
+        p.EndElementHandler = self.endElement
+        self.parser = p
+        try:
+            with trace.span("parse config", "parse", file=filename):
+                p.Parse(source, True)
+        except xml.parsers.expat.ExpatError as problem:
+            raise XMLError("ExpatError: " + str(problem) + " (" +
+                           filename + ")") from problem
+        finally:
+            del self.parser
+        self.source = source
+
+    def __str__(self):
+        return _ToStr(self)
+
+    def write(self, f):
+        """ Write the XML representation to the file-like object f. """
+        f.write('<driconf>\n')
+        for d in self.devices:
+            d.write(f)
+            f.write('\n')
+        f.write('</driconf>\n')
+
+    def getDevice(self, screen=None, driver=None, create=False):
+        """ Find the device with exactly this screen and driver.
+
+        Returns None if there is none, unless create is true in which case
+        a new device is appended. """
+        screen = str(screen) if screen is not None else None
+        for device in self.devices:
+            if (device.screen or None) == screen and \
+               (device.driver or None) == driver and \
+               device.deviceName is None:
+                return device
+        if not create:
+            return None
+        device = DeviceConfig(self, screen, driver)
+        self.devices.append(device)
+        return device
+
+    def setOption(self, executable, name, value, screen=None, driver=None):
+        """ Set an option for an executable on a device.
+
+        executable None means all applications. The application and device
+        are created if necessary. """
+        device = self.getDevice(screen, driver, create=True)
+        app = device.getApp(executable, create=True)
+        app.options[name] = value
+
+    def unsetOption(self, executable, name, screen=None, driver=None):
+        """ Remove an option for an executable from a device.
+
+        Applications and devices left empty are removed. Returns whether
+        the option was set. """
+        device = self.getDevice(screen, driver)
+        app = device and device.getApp(executable)
+        if app is None or name not in app.options:
+            return False
+        del app.options[name]
+        if not app.options:
+            device.apps.remove(app)
+            if not device.apps:
+                self.devices.remove(device)
+        return True
+
+    def getPatches(self):
+        """ Get the edits that turn source into the current configuration.
+
+        Returns a sorted list of (start, end, bytes) replacing source[start:
+        end], or None if the configuration was not parsed from a file or
+        was restructured so much that it has to be written from scratch.
+
+        Configurations without source, like those IterConfig creates, are
+        always written from scratch. The source is parsed again to find
+        its elements, which is cheaper than keeping their spans in memory
+        for every configuration that is loaded but never saved. """
+        if self.source is None:
+            return None
+        layout = _SourceLayout(self.source)
+        if layout.root is None:
+            return None
+        patches = []
+        if not layout.patchChildren(patches, layout.root, self.devices,
+                                    layout.patchDevice):
+            return None
+        patches.sort(key=lambda p: p[0])
+        return patches
+
+    def patch(self):
+        """ The file contents for the current configuration as bytes.
+
+        Comments, whitespace and attribute order of unchanged parts of the
+        source are preserved, only changed elements are rewritten. """
+        patches = self.getPatches()
+        if patches is None:
+            return str(self).encode("UTF-8")
+        return _ApplyPatches(self.source, patches)
+
+    def save(self, filename=None):
+        """ Atomically write the configuration to filename.
+
+        Defaults to the file it was loaded from. Only the parts of the file
+        that changed are rewritten, see getPatches(). A configuration that
+        has to be written from scratch is streamed with write() and is
+        written from scratch on later saves as well. """
+        if filename is None:
+            filename = self.fileName
+        patches = self.getPatches()
+        if patches is None:
+            SaveAtomically(filename, self)
+            self.source = None
+            return
+        data = _ApplyPatches(self.source, patches)
+        SaveAtomically(filename, data)
+        self.rebase(data, patches)
+
+    def rebase(self, source, patches=None):
+        """ Make source, which must describe the current configuration, the
+        base for future patches.
+
+        If source is the result of applying patches to the current source
+        the offsets of the elements are moved along with the patches.
+        Otherwise, or if elements were added or rewritten as part of their
+        parent, source is parsed to find them. """
+        if patches is not None and self.source is not None and \
+           self.shiftPositions(patches):
+            self.source = source
+            return
+        layout = _SourceLayout(source)
+        root = layout.root
+        self.source = None
+        if root is None or len(root.children) != len(self.devices):
+            return
+        for device, devPos in zip(self.devices, root.children):
+            devElem = layout.elements[devPos]
+            if len(devElem.children) != len(device.apps):
+                return
+            device.srcPos = devPos
+            for app, appPos in zip(device.apps, devElem.children):
+                app.srcPos = appPos
+        self.source = source
+
+    def shiftPositions(self, patches):
+        """ Helper: move srcPos of all elements past the patches before
+        them. Returns False and changes nothing if an element has no
+        offset yet or lies inside a patch. """
+        items = []
+        for device in self.devices:
+            items.append(device)
+            items.extend(device.apps)
+        if any(item.srcPos is None for item in items):
+            return False
+        items.sort(key=lambda item: item.srcPos)
+        moved = []
+        delta = 0
+        i = 0
+        for item in items:
+            pos = item.srcPos
+            while i < len(patches):
+                start, end, data = patches[i]
+                if end > pos or (start == pos and end != start):
+                    break
+                delta += len(data) - (end - start)
+                i += 1
+            if i < len(patches) and patches[i][0] < pos:
+                return False
+            moved.append(pos + delta)
+        for item, pos in zip(items, moved):
+            item.srcPos = pos
+        return True
+
+
+def IterConfig(filename, driver=None, executable=None, options=False,
+               chunkSize=65536):
+    """ Read a configuration file incrementally.
+
+    Yields (device, app) for every application, or with options true
+    (device, app, name, value) for every option, as soon as it has been
+    read. Applications are complete when they are yielded, but they are
+    not added to device.apps and devices don't belong to a DRIConfig, so
+    memory use doesn't grow with the file. The file is read chunkSize
+    bytes at a time and reading stops when the caller stops iterating.
+
+    driver and executable restrict the output to devices with exactly
+    that driver and applications with exactly that executable.
+
+    Raises XMLError if the file is invalid. """
+    config = DRIConfig.__new__(DRIConfig)
+    config.devices = []
+    config.curDevice = None
+    config.curApp = None
+    config.fileName = filename
+    config.source = None
+    ready = []
+
+    def wanted():
+        return (driver is None or config.curDevice.driver == driver) and \
+            (executable is None or config.curApp.executable == executable)
+
+    def startElement(name, attr):
+        config.startElement(name, attr)
+        if name == "device":
+            del config.devices[:]
+        elif name == "option" and options and wanted():
+            ready.append((config.curDevice, config.curApp,
+                          sys.intern(attr["name"]), sys.intern(attr["value"])))
+
+    def endElement(name):
+        if name == "application" or name == "engine":
+            del config.curDevice.apps[:]
+            if not options and wanted():
+                ready.append((config.curDevice, config.curApp))
+        config.endElement(name)
+
+    p = xml.parsers.expat.ParserCreate(encoding="UTF-8")
+    p.StartElementHandler = startElement
+    p.EndElementHandler = endElement
+    config.parser = p
+    with open(filename, "rb") as f:
+        while True:
+            data = f.read(chunkSize)
             try:
-                p.ParseFile(f)
+                p.Parse(data, not data)
             except xml.parsers.expat.ExpatError as problem:
-                raise XMLError() from problem
+                raise XMLError("ExpatError: " + str(problem) + " (" +
+                               filename + ")") from problem
+            batch = ready[:]
+            del ready[:]
+            for record in batch:
+                yield record
+            if not data:
+                break
+
+
+def _ScreenKey(screen):
+    """ Helper: normalize a screen number given as int or string. """
+    if screen is None:
+        return None
+    try:
+        return int(screen)
+    except ValueError:
+        return str(screen)
+
+
+def _VersionRanges(ranges):
+    """ Helper: parse a version list like "0:23,30" into (low, high) pairs.
+
+    Returns None if ranges is invalid. """
+    result = []
+    for part in ranges.split(","):
+        low, sep, high = part.strip().partition(":")
+        try:
+            low = int(low)
+            high = int(high) if sep else low
+        except ValueError:
+            return None
+        result.append((low, high))
+    return result
+
+
+def _InVersionRanges(version, ranges):
+    """ Helper: whether version is in a version list like "0:23,30". """
+    ranges = _VersionRanges(ranges)
+    if ranges is None:
+        return False
+    version = version or 0
+    for low, high in ranges:
+        if low <= version <= high:
+            return True
+    return False
+
+
+def _Search(pattern, string):
+    """ Helper: whether the regular expression pattern matches somewhere in
+    string. Invalid patterns never match. """
+    if string is None:
+        return False
+    try:
+        return re.search(pattern, string) is not None
+    except re.error:
+        return False
+
+
+# Characters that make a regular expression more than literal text
+_REGEX_SPECIAL = frozenset(".^$*+?{}[]\\|()\n")
+
+
+def _RequiredLiteral(pattern):
+    """ Helper: text at the start of pattern that every match contains,
+    "" if there is none or it can't be told without parsing pattern. """
+    if "|" in pattern:
+        return ""
+    start = end = 1 if pattern.startswith("^") else 0
+    while end < len(pattern) and pattern[end] not in _REGEX_SPECIAL:
+        end += 1
+    if end < len(pattern) and pattern[end] in "*?{":
+        # The last character is optional
+        end -= 1
+    return pattern[start:end]
+
+
+class RegexSet:
+    """ Many regular expressions searched for at once.
+
+    Patterns that are plain text, optionally anchored with ^ and $, are
+    looked up in dictionaries or tested with string operations, which is
+    much cheaper than running the regular expression engine. Any other
+    pattern is only searched if the literal text it starts with occurs in
+    the string. Invalid patterns never match. """
+
+    def __init__(self, patterns):
+        self.exact = {}
+        self.prefixes = {}
+        self.suffixes = {}
+        self.substrings = []
+        self.searched = []
+        for i, pattern in enumerate(patterns):
+            try:
+                compiled = re.compile(pattern)
+            except re.error:
+                continue
+            anchorStart = pattern.startswith("^")
+            anchorEnd = pattern.endswith("$")
+            text = pattern[anchorStart:len(pattern) - anchorEnd]
+            if not text or not _REGEX_SPECIAL.isdisjoint(text):
+                self.searched.append((_RequiredLiteral(pattern), compiled, i))
+            elif anchorStart and anchorEnd:
+                self.exact.setdefault(text, []).append(i)
+            elif anchorStart:
+                self.prefixes.setdefault(len(text), {}) \
+                    .setdefault(text, []).append(i)
+            elif anchorEnd:
+                self.suffixes.setdefault(len(text), {}) \
+                    .setdefault(text, []).append(i)
+            else:
+                self.substrings.append((text, i))
+
+    def match(self, string):
+        """ List the indices of the patterns that match string, in
+        ascending order. """
+        result = list(self.exact.get(string, ()))
+        # $ also matches before a newline at the end
+        stripped = string[:-1] if string.endswith("\n") else None
+        if stripped is not None:
+            result.extend(self.exact.get(stripped, ()))
+        for length, prefixes in self.prefixes.items():
+            result.extend(prefixes.get(string[:length], ()))
+        for length, suffixes in self.suffixes.items():
+            result.extend(suffixes.get(string[-length:], ()))
+            if stripped is not None:
+                result.extend(suffixes.get(stripped[-length:], ()))
+        for text, i in self.substrings:
+            if text in string:
+                result.append(i)
+        for text, compiled, i in self.searched:
+            if text in string and compiled.search(string):
+                result.append(i)
+        result.sort()
+        return result
+
+
+class _Query:
+    """ Helper: what OptionResolver matches applications against. """
+    __slots__ = ("executable", "screen", "driver", "sha1", "applicationName",
+                 "applicationVersion", "engineName", "engineVersion",
+                 "deviceName")
+
+    def __init__(self, *args):
+        for name, value in zip(self.__slots__, args):
+            setattr(self, name, value)
+
+
+def AppIndexKey(app):
+    """ How OptionResolver indexes an AppConfig: (executable, plain).
+
+    plain is false if the application has selectors and can't be found
+    by its executable alone. """
+    return app.executable, app.selectors is None
+
+
+def _EntryOrder(entry):
+    return entry[0]
+
+
+class _ResolverLayer:
+    """ The index OptionResolver keeps for one DRIConfig. """
+
+    def __init__(self, config):
+        self.config = config
+        self.index = {}
+        # Applications that need more than the index:
+        # (order, app, screen, driver) and how to find them
+        self.selected = []
+        self.byExecutable = {}
+        self.bySha1 = {}
+        self.unkeyed = []
+        regexps = {"executable_regexp": [], "application_name_match": [],
+                   "engine_name_match": []}
+        order = 0
+        for device in config.devices:
+            screen = _ScreenKey(device.screen)
+            driver = device.driver or None
+            apps = device.apps
+            if device.deviceName is not None:
+                keys = [(None, False)] * len(apps)
+            elif hasattr(apps, "indexKeys"):
+                keys = apps.indexKeys()
+            else:
+                keys = [AppIndexKey(app) for app in apps]
+            for j, (executable, plain) in enumerate(keys):
+                if plain:
+                    key = (screen, driver, executable)
+                    self.index.setdefault(key, []).append((order, apps, j))
+                    order += 1
+                    continue
+                app = apps[j]
+                selectors = app.selectors
+                i = len(self.selected)
+                self.selected.append((order, app, screen, driver))
+                order += 1
+                selectors = selectors or {}
+                if app.executable is not None:
+                    self.byExecutable.setdefault(app.executable, []).append(i)
+                elif "sha1" in selectors:
+                    self.bySha1.setdefault(selectors["sha1"].lower(),
+                                           []).append(i)
+                else:
+                    for attr, patterns in regexps.items():
+                        if attr in selectors:
+                            patterns.append((selectors[attr], i))
+                            break
+                    else:
+                        self.unkeyed.append(i)
+        self.regexps = []
+        for attr, patterns in regexps.items():
+            if patterns:
+                self.regexps.append((attr, RegexSet([p for p, i in patterns]),
+                                     [i for p, i in patterns]))
+
+    def matches(self, entry, query):
+        """ Whether an entry of selected applies to a query. """
+        order, app, screen, driver = entry
+        if (screen is not None and screen != query.screen) or \
+           (driver is not None and driver != query.driver):
+            return False
+        deviceName = app.device.deviceName
+        if deviceName is not None and deviceName != query.deviceName:
+            return False
+        selectors = app.selectors or {}
+        if isinstance(app, EngineConfig):
+            return _Search(selectors["engine_name_match"],
+                           query.engineName) and \
+                ("engine_versions" not in selectors or
+                 _InVersionRanges(query.engineVersion,
+                                  selectors["engine_versions"]))
+        if app.executable is not None and app.executable != query.executable:
+            return False
+        if "sha1" in selectors and \
+           selectors["sha1"].lower() != (query.sha1 or "").lower():
+            return False
+        if "executable_regexp" in selectors and \
+           not _Search(selectors["executable_regexp"], query.executable):
+            return False
+        if "application_name_match" in selectors and \
+           not _Search(selectors["application_name_match"],
+                       query.applicationName):
+            return False
+        if "application_versions" in selectors and \
+           not _InVersionRanges(query.applicationVersion,
+                                selectors["application_versions"]):
+            return False
+        return True
+
+    def getSelected(self, query):
+        """ List (order, (app,), 0) of the applications with selectors that
+        apply to a query, in order. """
+        candidates = list(self.unkeyed)
+        if query.executable is not None:
+            candidates.extend(self.byExecutable.get(query.executable, ()))
+        if query.sha1 is not None:
+            candidates.extend(self.bySha1.get(query.sha1.lower(), ()))
+        strings = {"executable_regexp": query.executable,
+                   "application_name_match": query.applicationName,
+                   "engine_name_match": query.engineName}
+        for attr, regexSet, entries in self.regexps:
+            if strings[attr] is not None:
+                candidates.extend(entries[j]
+                                  for j in regexSet.match(strings[attr]))
+        candidates.sort()
+        result = []
+        for i in candidates:
+            entry = self.selected[i]
+            if self.matches(entry, query):
+                result.append((entry[0], (entry[1],), 0))
+        return result
+
+    def getEntries(self, keys, query):
+        """ Iterate over (order, apps, i) of the applications that apply
+        to a query, in order. keys are the index keys the query matches,
+        query is only needed if there are applications with selectors. """
+        index = self.index
+        lists = [index[key] for key in keys if key in index]
+        if self.selected:
+            lists.append(self.getSelected(query))
+        if len(lists) == 1:
+            return lists[0]
+        return heapq.merge(*lists, key=_EntryOrder)
+
+
+class OptionResolver:
+    """ Answers which option values apply to a given application.
+
+    Indexes the devices and applications of one or more DRIConfigs by
+    screen, driver and executable once, so that each query only looks at
+    the applications that actually match.
+
+    Precedence follows the drirc rules: every device that matches the
+    screen and driver and every application in it that matches the
+    executable applies, in document order, later values overriding
+    earlier ones. Devices without screen or driver and applications
+    without executable match anything. With several configs, later ones
+    take precedence.
+
+    Applications with selectors (see APP_SELECTORS), engines and devices
+    with a device name are matched like Mesa does: every attribute that
+    is given has to match. Their literal executables and sha1s are looked
+    up in dictionaries and their regular expressions are searched for
+    with one RegexSet per attribute, so a query doesn't test each of them
+    in turn.
+
+    Applications are indexed by AppIndexKey, or the indexKeys method of
+    a lazy list of applications like the snapshot module's, so only the
+    applications a query matches are created. """
+
+    def __init__(self, configs, memoSize=1024):
+        """ Build the index. configs is a DRIConfig or a list of them.
+
+        The results of the memoSize most recently used queries are kept,
+        a long running process sees an unbounded number of different
+        ones. """
+        if isinstance(configs, DRIConfig):
+            configs = [configs]
+        self.configs = list(configs)
+        self.layers = {}
+        self.memoSize = memoSize
+        self.rebuild()
+
+    def rebuild(self, changed=None):
+        """ Rebuild the index after the configs were modified.
+
+        changed lists the configs that were modified or added, by default
+        all of them. The index of any other config is kept. """
+        layers = {}
+        for config in self.configs:
+            layer = self.layers.get(id(config))
+            if layer is None or layer.config is not config or \
+               changed is None or any(c is config for c in changed):
+                layer = _ResolverLayer(config)
+            layers[id(config)] = layer
+        self.layers = layers
+        self.memo = OrderedDict()
+
+    def getApps(self, executable=None, screen=None, driver=None, sha1=None,
+                applicationName=None, applicationVersion=None,
+                engineName=None, engineVersion=None, deviceName=None):
+        """ List the AppConfigs that apply, in order of precedence.
+
+        Besides the executable, screen and driver a process is described
+        by the SHA-1 of its executable, the application and engine names
+        and versions an API client reported and the name of the device,
+        which are needed to match the respective selectors. """
+        screens = (_ScreenKey(screen), None) if screen is not None else (None,)
+        drivers = (driver, None) if driver else (None,)
+        executables = (executable, None) if executable is not None \
+            else (None,)
+        keys = [(s, d, e) for s in screens for d in drivers
+                for e in executables]
+        query = None
+        # Later configs take precedence, so their apps simply come last.
+        # Entries are (order, apps, i), only the matching apps are created.
+        result = []
+        for config in self.configs:
+            layer = self.layers[id(config)]
+            if layer.selected and query is None:
+                query = _Query(executable, _ScreenKey(screen), driver or None,
+                               sha1, applicationName, applicationVersion,
+                               engineName, engineVersion, deviceName)
+            result += [apps[i] for order, apps, i in
+                       layer.getEntries(keys, query)]
+        return result
+
+    def getOptions(self, executable=None, screen=None, driver=None,
+                   **process):
+        """ Get the effective option values as a dictionary of strings.
+
+        process takes the keyword arguments of getApps that describe the
+        process further. Results are memoized until the next rebuild(). """
+        key = (executable, _ScreenKey(screen), driver or None,
+               tuple(sorted(process.items())))
+        options = self.memo.get(key)
+        if options is None:
+            options = {}
+            for app in self.getApps(executable, screen, driver, **process):
+                options.update(app.options)
+            self.memo[key] = options
+            if len(self.memo) > self.memoSize:
+                self.memo.popitem(last=False)
+        else:
+            self.memo.move_to_end(key)
+        return dict(options)
+
+
+# Mesa's configuration files from lowest to highest precedence
+SYSTEM_CONFIG_DIR = "/usr/share/drirc.d"
+SYSTEM_CONFIG = "/etc/drirc"
+USER_CONFIG = "~/.drirc"
+
+
+def DefaultConfigPaths():
+    """ List the configuration files Mesa reads, lowest precedence first. """
+    paths = sorted(glob.glob(os.path.join(SYSTEM_CONFIG_DIR, "*.conf")))
+    paths.append(SYSTEM_CONFIG)
+    paths.append(os.path.expanduser(USER_CONFIG))
+    return paths
+
+
+class LayeredConfig:
+    """ Several configuration files merged in order of precedence.
+
+    devices holds the devices of all files, lowest precedence first, and
+    resolver answers effective option queries for the merged view. Both
+    are updated in place by reload(), which only parses and indexes files
+    that were added or changed since the last reload. """
+
+    def __init__(self, paths=None, loader=None):
+        """ Load the configuration files.
+
+        paths is a list of file names, lowest precedence first, or a
+        function returning one. It defaults to DefaultConfigPaths. Files
+        that don't exist are skipped.
+
+        loader is called with a file name to load a file and defaults to
+        DRIConfig.
+
+        Raises XMLError if a file is invalid. """
+        self.loader = loader or DRIConfig
+        if paths is None:
+            paths = DefaultConfigPaths
+        if callable(paths):
+            self.getPaths = paths
+        else:
+            paths = list(paths)
+            self.getPaths = lambda: paths
+        self.configs = []
+        self.stamps = {}
+        self.devices = []
+        self.resolver = OptionResolver([])
+        self.reload()
+
+    def reload(self):
+        """ Pick up added, changed and removed files.
+
+        Returns the list of paths that changed. If a file is invalid an
+        XMLError is raised and the merged view stays as it was. """
+        loaded = dict((c.fileName, c) for c in self.configs)
+        configs = []
+        stamps = {}
+        changed = []
+        fresh = []
+        for path in self.getPaths():
+            stamp = _FileStamp(path)
+            if stamp is None or path in stamps:
+                continue
+            stamps[path] = stamp
+            if path in loaded and self.stamps.get(path) == stamp:
+                configs.append(loaded[path])
+            else:
+                fresh.append(self.loader(path))
+                configs.append(fresh[-1])
+                changed.append(path)
+        changed.extend(sorted(set(loaded) - set(stamps)))
+        if not changed:
+            return changed
+
+        if [c.fileName for c in configs] == list(loaded):
+            # Same files, splice the devices of the changed ones
+            offset = 0
+            for old, new in zip(self.configs, configs):
+                if new is not old:
+                    self.devices[offset:offset + len(old.devices)] = \
+                        new.devices
+                offset += len(new.devices)
+        else:
+            self.devices[:] = [d for c in configs for d in c.devices]
+        self.configs[:] = configs
+        self.stamps = stamps
+        self.resolver.configs = self.configs
+        self.resolver.rebuild(fresh)
+        return changed
+
+    def getOptions(self, executable=None, screen=None, driver=None,
+                   **process):
+        """ Get the effective option values, see OptionResolver. """
+        return self.resolver.getOptions(executable, screen, driver,
+                                        **process)
+
+    def getLayer(self, path):
+        """ The DRIConfig loaded from path, None if it isn't loaded. """
+        for config in self.configs:
+            if config.fileName == path:
+                return config
+        return None
+
+    def getEditableLayer(self):
+        """ The file a user edits: the user's drirc, or the system drirc
+        if the user has none. None if neither exists.
+
+        The files in SYSTEM_CONFIG_DIR are Mesa's defaults and are never
+        returned. """
+        return self.getLayer(os.path.expanduser(USER_CONFIG)) or \
+            self.getLayer(SYSTEM_CONFIG)
+
+
+class Diagnostic:
+    """ A problem with one option value of an application. """
+    __slots__ = ("app", "option", "value", "driver", "problem")
+
+    def __init__(self, app, option, value, driver, problem):
+        self.app = app
+        self.option = option
+        self.value = value
+        self.driver = driver
+        self.problem = problem
 
     def __str__(self):
-        result = '<driconf>\n'
-        for d in self.devices:
-            result = result + str(d) + '\n'
-        result = result + '</driconf>'
+        result = self.app.name
+        if self.option is not None:
+            result = result + ": " + self.option + "=" + str(self.value)
+        if self.driver is not None:
+            result = result + " (" + self.driver + ")"
+        return result + ": " + self.problem
+
+
+class ConfigValidator:
+    """ Validates whole configurations against driver catalogs.
+
+    drivers maps driver names to DriverInfos, a driver mapped to None is
+    known not to support configuration. Devices without a driver are
+    checked against every driver in drivers, an option is then unknown if
+    no driver has it and invalid if any driver having it rejects the
+    value. """
+
+    def __init__(self, drivers):
+        self.drivers = dict((name, driver) for name, driver in drivers.items()
+                            if driver is not None)
+        self.unsupported = set(name for name, driver in drivers.items()
+                               if driver is None)
+
+    def validateApp(self, app, drivers=None):
+        """ List the Diagnostics for one AppConfig.
+
+        drivers defaults to the driver of the app's device, or all drivers
+        if the device has none. """
+        if drivers is None:
+            drivers = self.getDrivers(app.device)
+        result = []
+        for name, value in app.options.items():
+            known = False
+            for driver in drivers:
+                opt = driver.getOptIndex().get(name)
+                if opt is None:
+                    continue
+                known = True
+                status = TypeValue(value, opt).status
+                if status == VALUE_INVALID:
+                    result.append(Diagnostic(app, name, value, driver.name,
+                                             "not a valid " + opt.type))
+                elif status == VALUE_OUT_OF_RANGE:
+                    result.append(Diagnostic(app, name, value, driver.name,
+                                             status))
+            if not known and drivers:
+                result.append(Diagnostic(app, name, value,
+                                         drivers[0].name if len(drivers) == 1
+                                         else None, "unknown option"))
+        return result
+
+    def getDrivers(self, device):
+        """ The DriverInfos the apps of a device are checked against. """
+        if device.driver:
+            driver = self.drivers.get(device.driver)
+            return [driver] if driver is not None else []
+        return list(self.drivers.values())
+
+    def validate(self, config):
+        """ List the Diagnostics for every application in a DRIConfig.
+
+        Devices for drivers without config info get one Diagnostic per
+        application. """
+        result = []
+        for device in config.devices:
+            drivers = self.getDrivers(device)
+            if device.driver and not drivers:
+                if device.driver in self.unsupported:
+                    problem = "driver does not support configuration"
+                else:
+                    problem = "no config info for driver"
+                for app in device.apps:
+                    result.append(Diagnostic(app, None, None, device.driver,
+                                             problem))
+                continue
+            for app in device.apps:
+                result.extend(self.validateApp(app, drivers))
+        return result
+
+
+_WORD = re.compile(r"\w+")
+
+
+def SearchTokens(text):
+    """ Helper: the lower case words of text, as SearchIndex uses them. """
+    if not text:
+        return []
+    return _WORD.findall(text.lower())
+
+
+class SearchIndex:
+    """ Inverted index for finding applications while a query is typed.
+
+    Applications are indexed by the words of their name, executable,
+    option names and option values and by the words of the descriptions
+    of their options in every language of the given drivers. A query
+    matches the applications that have, for every word of the query, an
+    indexed word starting with it, so results can be shown for each
+    keystroke. Words are kept sorted, a query word costs a binary search
+    plus the union of the postings it covers.
+
+    Applications and drivers can be added later, but changes to indexed
+    applications are not picked up; build a new index then. """
+
+    def __init__(self, apps=(), drivers=()):
+        """ Index apps, an iterable of AppConfigs, and the descriptions of
+        drivers, an iterable of DriverInfos. """
+        self.apps = []
+        # word -> set of application numbers
+        self.postings = {}
+        # description word -> set of option names
+        self.descWords = {}
+        # option name -> set of application numbers
+        self.optionApps = {}
+        self.words = None
+        self.memo = {}
+        self.add(apps)
+        for driver in drivers:
+            self.addDriver(driver)
+
+    def add(self, apps):
+        """ Index more applications. """
+        postings = self.postings
+        for app in apps:
+            i = len(self.apps)
+            self.apps.append(app)
+            words = SearchTokens(app.name) + SearchTokens(app.executable)
+            for name, value in app.options.items():
+                self.optionApps.setdefault(name, set()).add(i)
+                words.extend(SearchTokens(name))
+                words.extend(SearchTokens(value))
+            for word in words:
+                postings.setdefault(word, set()).add(i)
+        self.words = None
+        self.memo.clear()
+
+    def addDriver(self, driver):
+        """ Index the option descriptions of a DriverInfo. """
+        for optSection in driver.optSections:
+            for opt in optSection.optList:
+                for desc in opt.desc.values():
+                    words = SearchTokens(desc.text)
+                    for text in desc.enums.values():
+                        words.extend(SearchTokens(text))
+                    for word in words:
+                        self.descWords.setdefault(word, set()).add(opt.name)
+        self.words = None
+        self.memo.clear()
+
+    def matchWord(self, prefix):
+        """ The set of application numbers with a word starting with
+        prefix. """
+        result = self.memo.get(prefix)
+        if result is not None:
+            return result
+        if self.words is None:
+            self.words = sorted(set(self.postings) | set(self.descWords))
+        words = self.words
+        result = set()
+        i = bisect_left(words, prefix)
+        while i < len(words) and words[i].startswith(prefix):
+            word = words[i]
+            apps = self.postings.get(word)
+            if apps:
+                result |= apps
+            for name in self.descWords.get(word, ()):
+                result |= self.optionApps.get(name, set())
+            i += 1
+        if len(self.memo) >= 256:
+            self.memo.clear()
+        self.memo[prefix] = result
         return result
+
+    def search(self, query):
+        """ List the applications matching query, in the order they were
+        added. An empty query matches everything. """
+        words = SearchTokens(query)
+        if not words:
+            return list(self.apps)
+        matches = None
+        # Longest words first, they tend to have the fewest matches
+        for word in sorted(words, key=len, reverse=True):
+            apps = self.matchWord(word)
+            matches = set(apps) if matches is None else matches & apps
+            if not matches:
+                return []
+        return [self.apps[i] for i in sorted(matches)]
+
+
+def _TagEnd(buf, pos):
+    """ Helper: offset after the '>' ending the tag that starts at pos. """
+    quote = None
+    for i in range(pos, len(buf)):
+        c = buf[i]
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c == 0x22 or c == 0x27:
+            quote = c
+        elif c == 0x3e:
+            return i + 1
+    return len(buf)
+
+
+def _ApplyPatches(source, patches):
+    """ Helper: source with the sorted (start, end, bytes) patches
+    applied. """
+    result = []
+    pos = 0
+    for start, end, data in patches:
+        result.append(source[pos:start])
+        result.append(data)
+        pos = end
+    result.append(source[pos:])
+    return b"".join(result)
+
+
+class _Element:
+    """ Byte ranges and original contents of a drirc element. """
+    __slots__ = ("start", "startTagEnd", "endTagStart", "end", "attr",
+                 "children", "options")
+
+    def __init__(self, start, attr):
+        self.start = start
+        self.startTagEnd = None
+        self.endTagStart = None
+        self.end = None
+        self.attr = attr
+        self.children = []
+        self.options = {}
+
+
+class _SourceLayout:
+    """ Where the devices, applications and options are in a drirc.
+
+    Used by DRIConfig to compute patches. Elements are identified by
+    their byte offset, which is what DeviceConfig.srcPos and
+    AppConfig.srcPos refer to. New lines use the line ending of the
+    first line of source. """
+
+    def __init__(self, source):
+        self.source = source
+        self.elements = {}
+        self.root = None
+        self.stack = []
+        firstLine = source.find(b"\n")
+        self.newline = b"\r\n" if firstLine > 0 and \
+            source[firstLine - 1] == 0x0d else b"\n"
+        p = xml.parsers.expat.ParserCreate(encoding="UTF-8")
+        p.StartElementHandler = self.startElement
+        p.EndElementHandler = self.endElement
+        self.parser = p
+        try:
+            p.Parse(source, True)
+        except xml.parsers.expat.ExpatError:
+            self.root = None
+        del self.parser
+
+    def startElement(self, name, attr):
+        pos = self.parser.CurrentByteIndex
+        elem = _Element(pos, attr)
+        if name == "driconf" and not self.stack:
+            self.root = elem
+        elif name == "device" or name == "application" or name == "engine":
+            self.elements[pos] = elem
+            if self.stack:
+                self.stack[-1].children.append(pos)
+        elif name == "option" and self.stack:
+            self.stack[-1].options.setdefault(attr.get("name"), []) \
+                .append(elem)
+        self.stack.append(elem)
+
+    def endElement(self, name):
+        elem = self.stack.pop()
+        elem.startTagEnd = _TagEnd(self.source, elem.start)
+        if self.source.startswith(b"/>", elem.startTagEnd - 2):
+            # Empty element, there is no end tag
+            elem.end = elem.startTagEnd
+        else:
+            elem.endTagStart = self.parser.CurrentByteIndex
+            elem.end = _TagEnd(self.source, elem.endTagStart)
+
+    def encode(self, text):
+        """ text as bytes with the line endings of source. """
+        if self.newline != b"\n":
+            text = text.replace("\n", self.newline.decode("ASCII"))
+        return text.encode("UTF-8")
+
+    def lineStart(self, pos):
+        """ pos moved back to the start of its line if only whitespace
+        precedes it on that line. """
+        i = pos
+        while i > 0 and self.source[i - 1] in b" \t":
+            i -= 1
+        if i == 0 or self.source[i - 1] == 0x0a:
+            return i
+        return pos
+
+    def indent(self, elem):
+        start = self.lineStart(elem.start)
+        return self.source[start:elem.start].decode("UTF-8")
+
+    def delete(self, patches, elem):
+        """ Remove an element including its line if it is alone on it. """
+        start = self.lineStart(elem.start)
+        end = elem.end
+        rest = len(self.source) - len(self.source[end:].lstrip(b" \t"))
+        if start != elem.start and self.source.startswith(self.newline, rest):
+            end = rest + len(self.newline)
+        else:
+            start = elem.start
+        patches.append((start, end, b""))
+
+    def insert(self, patches, parent, text):
+        """ Insert lines of text before the end tag of parent. """
+        pos = self.lineStart(parent.endTagStart)
+        if pos > 0 and self.source[pos - 1] != 0x0a:
+            # The end tag shares its line with something else
+            text = "\n" + text
+        patches.append((pos, pos, self.encode(text)))
+
+    def patchChildren(self, patches, parent, items, patchItem):
+        """ Patch the children of parent to become items.
+
+        Children kept from the source must stay in order and new ones
+        must come after them, otherwise False is returned. """
+        origPositions = parent.children
+        orig = set(origPositions)
+        kept = [item.srcPos for item in items if item.srcPos in orig]
+        keptSet = set(kept)
+        if len(kept) != len(keptSet) or \
+           kept != [pos for pos in origPositions if pos in keptSet] or \
+           kept != [item.srcPos for item in items[:len(kept)]]:
+            return False
+        new = items[len(kept):]
+        if new and parent.endTagStart is None:
+            return False
+
+        for pos in origPositions:
+            if pos not in keptSet:
+                self.delete(patches, self.elements[pos])
+        for item in items[:len(kept)]:
+            elem = self.elements[item.srcPos]
+            itemPatches = []
+            if patchItem(itemPatches, elem, item):
+                patches.extend(itemPatches)
+            else:
+                patches.append((elem.start, elem.end,
+                                self.encode(str(item).lstrip())))
+        if new:
+            text = "".join(str(item).rstrip("\n") + "\n" for item in new)
+            self.insert(patches, parent, text)
+        return True
+
+    def patchDevice(self, patches, elem, device):
+        attr = elem.attr
+        if (attr.get("screen") or None) != (device.screen or None) or \
+           (attr.get("driver") or None) != (device.driver or None) or \
+           attr.get("device") != device.deviceName:
+            if elem.endTagStart is None:
+                return False
+            patches.append((elem.start, elem.startTagEnd,
+                            device.startTag().encode("UTF-8")))
+        return self.patchChildren(patches, elem, device.apps,
+                                 self.patchApp)
+
+    def patchApp(self, patches, elem, app):
+        attr = elem.attr
+        if attr.get("name") != app.name or \
+           attr.get("executable") != app.executable or \
+           _Selectors(attr, app.SELECTORS) != app.selectors:
+            if elem.endTagStart is None:
+                return False
+            patches.append((elem.start, elem.startTagEnd,
+                            app.startTag().encode("UTF-8")))
+        added = []
+        for name, value in app.options.items():
+            optElems = elem.options.get(name)
+            if not optElems:
+                added.append(OptionTag(name, value))
+                continue
+            last = optElems[-1]
+            for optElem in optElems[:-1]:
+                self.delete(patches, optElem)
+            if last.attr.get("value") != value:
+                patches.append((last.start, last.end,
+                                OptionTag(name, value).encode("UTF-8")))
+        for name, optElems in elem.options.items():
+            if name not in app.options:
+                for optElem in optElems:
+                    self.delete(patches, optElem)
+        if added:
+            if elem.endTagStart is None:
+                return False
+            optIndent = None
+            for optElems in elem.options.values():
+                optIndent = self.indent(optElems[0])
+                break
+            if optIndent is None:
+                optIndent = self.indent(elem) + "    "
+            self.insert(patches, elem, "".join(optIndent + tag + "\n"
+                                                for tag in added))
+        return True
@@ -0,0 +1,108 @@
+# lint.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Validate large numbers of configuration files in parallel.
+
+Lint() hands the files to a pool of worker processes, each of which
+parses them with dri.DRIConfig and checks them with a
+dri.ConfigValidator. Results are yielded in the order of the files as
+soon as they are known, so the caller can stream them.
+
+A worker loads every driver catalog at most once: from a catalog file
+given by the caller, from a backends.FakeBackend fixture or with
+dri.GetDriver(), which prefers the disk cache over asking xdriinfo.
+"""
+
+import multiprocessing
+
+from . import dri
+
+# State of the current worker, set up by _init_worker
+_catalogs = {}
+_known = []
+_drivers = {}
+
+
+def _init_worker(catalogs, fixture):
+    _catalogs.clear()
+    _catalogs.update(catalogs)
+    _drivers.clear()
+    _known[:] = sorted(catalogs)
+    if fixture is not None:
+        from . import backends
+        backend = backends.FakeBackend(fixture)
+        dri.SetBackend(backend)
+        _known[:] = sorted(set(_known) | set(backend.drivers))
+
+
+def _get_driver(name):
+    if name not in _drivers:
+        path = _catalogs.get(name)
+        if path is None:
+            _drivers[name] = dri.GetDriver(name)
+        else:
+            with open(path) as f:
+                _drivers[name] = dri.DriverInfo(name, driInfo=f.read())
+    return _drivers[name]
+
+
+def _record(path, diag=None, problem=None):
+    if diag is None:
+        return {'file': path, 'application': None, 'option': None,
+                'value': None, 'driver': None, 'problem': problem}
+    return {'file': path, 'application': diag.app.name, 'option': diag.option,
+            'value': diag.value, 'driver': diag.driver, 'problem': diag.problem}
+
+
+def LintFile(path):
+    """ The diagnostics of one file as a list of JSON-ready dicts.
+
+    Files that can't be read or parsed get a single entry without an
+    application. Uses the drivers of the current worker. """
+    try:
+        config = dri.DRIConfig(path)
+        names = set(_known)
+        names.update(d.driver for d in config.devices if d.driver)
+        validator = dri.ConfigValidator(dict((name, _get_driver(name))
+                                             for name in sorted(names)))
+        return [_record(path, diag) for diag in validator.validate(config)]
+    except (dri.Error, OSError) as e:
+        return [_record(path, problem=str(e))]
+
+
+def _lint(path):
+    return path, LintFile(path)
+
+
+def Lint(paths, catalogs=None, fixture=None, jobs=None, chunksize=16):
+    """ Yield (path, diagnostics) for every path, see LintFile.
+
+    catalogs maps driver names to catalog files, fixture is the file
+    name of a backends.FakeBackend fixture. jobs is the number of worker
+    processes, by default one per CPU. With a single job the files are
+    checked in this process, which then keeps using the fixture. """
+    initargs = (dict(catalogs or {}), fixture)
+    if fixture is not None and jobs != 1:
+        # Fail here rather than in every worker the pool starts
+        from . import backends
+        backends.FakeBackend(fixture)
+    if jobs == 1:
+        _init_worker(*initargs)
+        yield from map(_lint, paths)
+        return
+    with multiprocessing.Pool(jobs, _init_worker, initargs) as pool:
+        yield from pool.imap(_lint, paths, chunksize)
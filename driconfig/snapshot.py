@@ -0,0 +1,327 @@
+# snapshot.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Binary snapshots of parsed configuration files.
+
+LoadConfig() returns a DRIConfig like dri.DRIConfig() does, but keeps a
+snapshot of every file it parses in dri.CacheDir(), named after the path
+of the file. A snapshot records the mtime, size and SHA-1 of its source
+and is used as long as size and SHA-1 still match, so merely touching a
+file doesn't invalidate it. Hashing is much cheaper than parsing. A
+usable snapshot is mapped into memory instead of running expat, and
+AppConfigs are only created when they are accessed. The source is kept
+along with the byte offsets of devices and applications, so saving a
+config loaded from a snapshot still only patches what changed.
+
+All integers are little endian. The layout is:
+
+    header   magic, version, source mtime (ns), size, SHA-1 and the number
+             of strings, devices, applications and options
+    strings  offsets (nStrings + 1) into a blob of UTF-8 strings
+    devices  screen, driver, device name, first application, number of
+             applications, source offset
+    apps     kind (0 application, 1 engine), name, executable, first
+             option, number of selectors, number of options, source offset
+    options  name, value; the selectors of an application come first
+
+Strings are referenced by index, -1 stands for None, as it does for
+source offsets.
+"""
+
+import collections.abc
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from . import dri, trace
+
+MAGIC = b'DRISNAP\0'
+VERSION = 3
+
+_header = struct.Struct('<8sIqQ20sIIII')
+_offset = struct.Struct('<I')
+_device = struct.Struct('<iiiIIq')
+_app = struct.Struct('<BiiIIIq')
+_option = struct.Struct('<ii')
+
+
+def SnapshotPath(filename):
+    """ The snapshot file used for a configuration file. """
+    key = hashlib.sha1(os.path.abspath(filename).encode('utf-8', 'surrogateescape'))
+    return os.path.join(dri.CacheDir(), 'configs', key.hexdigest() + '.snap')
+
+
+def _ReadFile(filename):
+    with open(filename, 'rb') as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    return st, hashlib.sha1(data).digest(), data
+
+
+def _Offset(srcPos):
+    return -1 if srcPos is None else srcPos
+
+
+class _StringTable:
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def add(self, string):
+        if string is None:
+            return -1
+        i = self.index.get(string)
+        if i is None:
+            i = self.index[string] = len(self.strings)
+            self.strings.append(string.encode('utf-8'))
+        return i
+
+
+def WriteSnapshot(config, path, stat, digest):
+    """ Atomically write a snapshot of config for a source with the given
+    os.stat_result and SHA-1 digest. """
+    strings = _StringTable()
+    devices = []
+    apps = []
+    options = []
+    for device in config.devices:
+        devices.append(_device.pack(strings.add(device.screen),
+                                    strings.add(device.driver),
+                                    strings.add(device.deviceName),
+                                    len(apps), len(device.apps),
+                                    _Offset(device.srcPos)))
+        for app in device.apps:
+            selectors = app.selectors or {}
+            apps.append(_app.pack(isinstance(app, dri.EngineConfig),
+                                  strings.add(app.name),
+                                  strings.add(app.executable),
+                                  len(options), len(selectors),
+                                  len(app.options), _Offset(app.srcPos)))
+            for name, value in list(selectors.items()) + list(app.options.items()):
+                options.append(_option.pack(strings.add(name), strings.add(value)))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_header.pack(MAGIC, VERSION, stat.st_mtime_ns, stat.st_size,
+                                 digest, len(strings.strings), len(devices),
+                                 len(apps), len(options)))
+            offset = 0
+            for s in strings.strings:
+                f.write(_offset.pack(offset))
+                offset += len(s)
+            f.write(_offset.pack(offset))
+            for part in (strings.strings, devices, apps, options):
+                f.write(b''.join(part))
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.unlink(tmpPath)
+        raise
+
+
+class Snapshot:
+    """ A memory mapped snapshot file. """
+
+    def __init__(self, path):
+        """ Raises OSError or ValueError if path is not a usable snapshot. """
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.mtime, self.size, self.digest, self.nStrings,
+         self.nDevices, self.nApps, self.nOptions) = _header.unpack_from(self.buf)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a snapshot')
+        self.offsetsStart = _header.size
+        self.blobStart = self.offsetsStart + (self.nStrings + 1) * _offset.size
+        blobSize = _offset.unpack_from(
+            self.buf, self.offsetsStart + self.nStrings * _offset.size)[0]
+        self.devicesStart = self.blobStart + blobSize
+        self.appsStart = self.devicesStart + self.nDevices * _device.size
+        self.optionsStart = self.appsStart + self.nApps * _app.size
+        if self.optionsStart + self.nOptions * _option.size != len(self.buf):
+            raise ValueError('truncated snapshot')
+        self.strings = {}
+        self._offsets = None
+
+    def matches(self, stat, digest):
+        return self.size == stat.st_size and self.digest == digest
+
+    def string(self, i):
+        if i < 0:
+            return None
+        s = self.strings.get(i)
+        if s is None:
+            start, end = struct.unpack_from('<II', self.buf,
+                                            self.offsetsStart + i * _offset.size)
+            s = self.strings[i] = sys.intern(
+                self.buf[self.blobStart + start:self.blobStart + end].decode('utf-8'))
+        return s
+
+    def device(self, config, i):
+        """ Create DeviceConfig i with a LazyAppList. """
+        screen, driver, deviceName, first, count, srcPos = _device.unpack_from(
+            self.buf, self.devicesStart + i * _device.size)
+        device = dri.DeviceConfig(config, self.string(screen), self.string(driver),
+                                  self.string(deviceName))
+        if srcPos >= 0:
+            device.srcPos = srcPos
+        device.apps = LazyAppList(self, device, first, count)
+        return device
+
+    def app(self, device, i):
+        """ Create AppConfig i. """
+        engine, name, executable, first, nSelectors, count, srcPos = _app.unpack_from(
+            self.buf, self.appsStart + i * _app.size)
+        selectors = self.pairs(first, nSelectors) if nSelectors else None
+        if engine:
+            app = dri.EngineConfig(device, selectors)
+        else:
+            app = dri.AppConfig(device, self.string(name), self.string(executable),
+                                selectors)
+        app.options = self.pairs(first + nSelectors, count)
+        if srcPos >= 0:
+            app.srcPos = srcPos
+        return app
+
+    def pairs(self, first, count):
+        """ Options first to first + count as a dict. """
+        result = {}
+        for offset in range(self.optionsStart + first * _option.size,
+                            self.optionsStart + (first + count) * _option.size,
+                            _option.size):
+            name, value = _option.unpack_from(self.buf, offset)
+            result[self.string(name)] = self.string(value)
+        return result
+
+    def indexKeys(self, first, count):
+        """ (executable, no selectors) of applications first to
+        first + count, without creating them. """
+        start = self.appsStart + first * _app.size
+        strings = self.strings
+        offsets = self.offsets()
+        blob = self.blobStart
+        keys = []
+        with memoryview(self.buf) as buf:
+            for record in _app.iter_unpack(buf[start:start + count * _app.size]):
+                i = record[2]
+                executable = strings.get(i)
+                if executable is None and i >= 0:
+                    executable = strings[i] = sys.intern(
+                        str(buf[blob + offsets[i]:blob + offsets[i + 1]], 'utf-8'))
+                keys.append((executable, record[4] == 0))
+        return keys
+
+    def offsets(self):
+        """ The whole string offset table, read on first use. """
+        if self._offsets is None:
+            self._offsets = struct.unpack_from('<%dI' % (self.nStrings + 1),
+                                               self.buf, self.offsetsStart)
+        return self._offsets
+
+
+class LazyAppList(collections.abc.MutableSequence):
+    """ The applications of a snapshot device, created on first access.
+
+    Any modification creates all remaining applications first and from
+    then on this behaves like a plain list. """
+
+    def __init__(self, snapshot, device, first, count):
+        self.snapshot = snapshot
+        self.device = device
+        self.first = first
+        self.items = [None] * count
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        app = self.items[i]
+        if app is None:
+            if i < 0:
+                i += len(self.items)
+            app = self.items[i] = self.snapshot.app(self.device, self.first + i)
+        return app
+
+    def materialize(self):
+        """ Create all applications, after this the snapshot isn't used. """
+        if self.snapshot is not None:
+            for i in range(len(self.items)):
+                self[i]
+            self.snapshot = None
+
+    def indexKeys(self):
+        """ dri.AppIndexKey of every application, without creating them. """
+        if self.snapshot is None:
+            return [dri.AppIndexKey(app) for app in self.items]
+        keys = self.snapshot.indexKeys(self.first, len(self.items))
+        for i, app in enumerate(self.items):
+            if app is not None:
+                keys[i] = dri.AppIndexKey(app)
+        return keys
+
+    def __setitem__(self, i, app):
+        self.materialize()
+        self.items[i] = app
+
+    def __delitem__(self, i):
+        self.materialize()
+        del self.items[i]
+
+    def insert(self, i, app):
+        self.materialize()
+        self.items.insert(i, app)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+
+def LoadConfig(filename, snapshot=True):
+    """ Load a DRIConfig, from its snapshot if the file is unchanged.
+
+    Without a usable snapshot the file is parsed and a new snapshot is
+    written. Failing to write the snapshot is not an error. """
+    if not snapshot:
+        return dri.DRIConfig(filename)
+    stat, digest, source = _ReadFile(filename)
+    path = SnapshotPath(filename)
+    try:
+        snap = Snapshot(path)
+    except (OSError, ValueError, struct.error):
+        snap = None
+    if snap is not None and snap.matches(stat, digest):
+        trace.count('config snapshot hit', file=filename)
+        config = dri.DRIConfig.__new__(dri.DRIConfig)
+        config.curDevice = None
+        config.curApp = None
+        config.fileName = filename
+        config.source = source
+        config.devices = [snap.device(config, i) for i in range(snap.nDevices)]
+        return config
+
+    trace.count('config snapshot miss', file=filename)
+    # Parse the bytes digest belongs to, the file may have changed since
+    config = dri.DRIConfig(filename, source=source)
+    try:
+        WriteSnapshot(config, path, stat, digest)
+    except OSError:
+        pass
+    return config
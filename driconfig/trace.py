@@ -0,0 +1,169 @@
+# trace.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Opt-in timing of subprocesses, parsing, caches and UI construction.
+
+Tracing is off unless enable() is called or DRICONFIG_TRACE is set in
+the environment. DRICONFIG_TRACE names a file that receives the events in
+Chrome's trace event format when the process exits (load it in
+chrome://tracing or https://ui.perfetto.dev); a summary table is printed
+to stderr at the same time.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+enabled = False
+
+_lock = threading.Lock()
+_events = []
+_counters = {}
+_epoch = time.perf_counter()
+
+
+def _now():
+    return (time.perf_counter() - _epoch) * 1e6
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Drop all recorded events and counters."""
+    with _lock:
+        del _events[:]
+        _counters.clear()
+
+
+class _Span:
+    __slots__ = ('name', 'cat', 'args', 'start')
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = _now()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        event = {
+            'name': self.name,
+            'cat': self.cat,
+            'ph': 'X',
+            'ts': self.start,
+            'dur': end - self.start,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': self.args,
+        }
+        with _lock:
+            _events.append(event)
+        return False
+
+
+_disabled_span = contextlib.nullcontext()
+
+
+def span(name, cat='dri', **args):
+    """Context manager recording how long its body takes."""
+    if not enabled:
+        return _disabled_span
+    return _Span(name, cat, args)
+
+
+def count(name, cat='cache', **args):
+    """Record that something happened once, e.g. a cache hit."""
+    if not enabled:
+        return
+    event = {
+        'name': name,
+        'cat': cat,
+        'ph': 'i',
+        's': 't',
+        'ts': _now(),
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+        'args': args,
+    }
+    with _lock:
+        _events.append(event)
+        _counters[name] = _counters.get(name, 0) + 1
+
+
+def events():
+    """A copy of the recorded events."""
+    with _lock:
+        return list(_events)
+
+
+def counters():
+    """A copy of the counters recorded by count()."""
+    with _lock:
+        return dict(_counters)
+
+
+def export(f):
+    """Write the events as Chrome trace event JSON to the file-like f."""
+    json.dump({'traceEvents': events(), 'displayTimeUnit': 'ms'}, f)
+
+
+def summary():
+    """A table of count, total, mean and max duration for every span name."""
+    spans = {}
+    for event in events():
+        if event['ph'] == 'X':
+            spans.setdefault(event['name'], []).append(event['dur'] / 1000)
+    lines = ['{:32} {:>7} {:>10} {:>10} {:>10}'.format(
+        'span', 'count', 'total ms', 'mean ms', 'max ms')]
+    for name, durations in sorted(spans.items(), key=lambda x: -sum(x[1])):
+        lines.append('{:32} {:7d} {:10.2f} {:10.2f} {:10.2f}'.format(
+            name, len(durations), sum(durations),
+            sum(durations) / len(durations), max(durations)))
+    for name, value in sorted(counters().items()):
+        lines.append('{:32} {:7d}'.format(name, value))
+    return '\n'.join(lines)
+
+
+def _write_at_exit(path):
+    try:
+        with open(path, 'w') as f:
+            export(f)
+    except OSError as e:
+        sys.stderr.write('driconfig: cannot write trace: {}\n'.format(e))
+    sys.stderr.write(summary() + '\n')
+
+
+if os.environ.get('DRICONFIG_TRACE'):
+    enable()
+    atexit.register(_write_at_exit, os.environ['DRICONFIG_TRACE'])
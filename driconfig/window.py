@@ -15,13 +15,24 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import threading
 from gettext import gettext as _
-from gi.repository import Gio, Gtk
+from gi.repository import GLib, Gio, GObject, Gtk
 
-from . import dri
+from . import aio, dri, trace
+
+# Number of applications added to the sidebar per main loop iteration
+LOAD_BATCH_SIZE = 500
+# Seconds after which a hung xdriinfo or glxinfo is killed
+PROBE_TIMEOUT = 10
 
 class Window(Gtk.ApplicationWindow):
     def __init__(self, **kwargs):
+        with trace.span('window construction', 'ui'):
+            self._init(**kwargs)
+
+    def _init(self, **kwargs):
         super().__init__(
             default_width=800,
             default_height=400,
@@ -39,28 +50,155 @@ class Window(Gtk.ApplicationWindow):
         add_btn = Gtk.Button.new_from_icon_name('list-add-symbolic', Gtk.IconSize.BUTTON)
         add_btn.props.action_name = 'win.add-application'
         header.pack_start(add_btn)
+        self.spinner = Gtk.Spinner()
+        header.pack_end(self.spinner)
         header.show_all()
         self.set_titlebar(header)
 
         box = Gtk.Box(Gtk.Orientation.HORIZONTAL)
-        sidebar = Gtk.StackSidebar()
-        sw = Gtk.ScrolledWindow(child=sidebar, hscrollbar_policy=Gtk.PolicyType.NEVER)
-        box.pack_start(sw, False, True, 0)
-
-        stack = Gtk.Stack()
-        # Just a basic mockup
-        conf = dri.DRIConfig('/etc/drirc')
-        device = conf.devices[0]
-        for app in device.apps:
-            # TODO: Group these by device
-            pane = ApplicationPane(app, visible=True)
-            stack.add_titled(pane, app.name, app.name)
-        sidebar.props.stack = stack
-
-        sw = Gtk.ScrolledWindow(child=stack)
-        box.pack_start(sw, True, True, 0)
-        box.show_all()
-        self.add(box)
+        # A TreeView only renders the rows that are visible, which keeps
+        # configs with tens of thousands of applications fast
+        self.sidebar = Gtk.TreeView(headers_visible=False, fixed_height_mode=True)
+        column = Gtk.TreeViewColumn(None, Gtk.CellRendererText(), text=0)
+        column.props.sizing = Gtk.TreeViewColumnSizing.FIXED
+        self.sidebar.append_column(column)
+        self.sidebar.get_selection().connect('changed', self.on_application_selected)
+        sw = Gtk.ScrolledWindow(child=self.sidebar, hscrollbar_policy=Gtk.PolicyType.NEVER,
+                                width_request=200)
+        # Searching is enabled once the index is built, see _on_index_built()
+        self.search_entry = Gtk.SearchEntry(sensitive=False,
+                                            placeholder_text=_('Search applications and options'))
+        self.search_entry.connect('search-changed', self.on_search_changed)
+        sidebar_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        sidebar_box.pack_start(self.search_entry, False, True, 0)
+        sidebar_box.pack_start(sw, True, True, 0)
+        box.pack_start(sidebar_box, False, True, 0)
+
+        # Panes are only built for the selected application
+        self.pane_window = Gtk.ScrolledWindow()
+        box.pack_start(self.pane_window, True, True, 0)
+
+        self.status_label = Gtk.Label(label=_('Loading configuration…'))
+        status = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6,
+                         valign=Gtk.Align.CENTER)
+        status.pack_start(Gtk.Spinner(active=True), False, True, 0)
+        status.pack_start(self.status_label, False, True, 0)
+
+        self.content = Gtk.Stack()
+        self.content.add_named(status, 'status')
+        self.content.add_named(box, 'config')
+        self.content.show_all()
+        self.add(self.content)
+
+        self.conf = None
+        self.display = None
+        self.index = None
+        # Applications matching the search, None shows all
+        self.matches = None
+        self.store = Gtk.ListStore(str, GObject.TYPE_PYOBJECT)
+        self.filter = self.store.filter_new()
+        self.filter.set_visible_func(self._app_visible)
+        self.sidebar.set_model(self.filter)
+        self.load_config()
+
+    def load_config(self):
+        """Parse the config and probe the display without blocking the UI.
+
+        The window shows a loading state until the first applications
+        arrive, the rest are added in batches from idle callbacks."""
+        self.spinner.start()
+        thread = threading.Thread(target=self._load_config_thread, daemon=True)
+        thread.start()
+
+    def _load_config_thread(self):
+        # Runs in a worker thread, anything touching widgets goes through idle_add()
+        try:
+            conf = dri.LayeredConfig()
+        except (dri.Error, OSError, ValueError) as e:
+            # ValueError includes UnicodeDecodeError
+            GLib.idle_add(self._on_load_error, str(e))
+            return
+        GLib.idle_add(self._on_config_loaded, conf)
+        # Show the file the user edits, not Mesa's defaults below it
+        layer = conf.getEditableLayer()
+        apps = [app for device in layer.devices for app in device.apps] \
+            if layer is not None else []
+        for i in range(0, len(apps), LOAD_BATCH_SIZE):
+            GLib.idle_add(self._add_applications, apps[i:i + LOAD_BATCH_SIZE])
+        with trace.span('build search index', 'ui', apps=len(apps)):
+            index = dri.SearchIndex(apps)
+        GLib.idle_add(self._on_index_built, index)
+
+        # Option descriptions become searchable once the display is probed
+        try:
+            display = asyncio.run(aio.DisplayInfo(timeout=PROBE_TIMEOUT))
+        except (dri.DRIError, dri.XMLError, ValueError):
+            display = None
+
+        drivers = []
+        if display is not None:
+            for screen in display.screens:
+                if screen is not None and screen.driver is not None \
+                        and screen.driver not in drivers:
+                    drivers.append(screen.driver)
+        GLib.idle_add(self._on_load_finished, display, drivers)
+
+    def _on_config_loaded(self, conf):
+        self.conf = conf
+        return GLib.SOURCE_REMOVE
+
+    def _add_applications(self, apps):
+        with trace.span('add applications', 'ui', count=len(apps)):
+            for app in apps:
+                # TODO: Group these by device
+                self.store.append((app.name, app))
+        self.content.props.visible_child_name = 'config'
+        return GLib.SOURCE_REMOVE
+
+    def _on_load_error(self, message):
+        self.spinner.stop()
+        self.status_label.props.label = message
+        return GLib.SOURCE_REMOVE
+
+    def _on_index_built(self, index):
+        self.index = index
+        self.search_entry.props.sensitive = True
+        self.content.props.visible_child_name = 'config'
+        return GLib.SOURCE_REMOVE
+
+    def _on_load_finished(self, display, drivers):
+        self.display = display
+        with trace.span('index option descriptions', 'ui', drivers=len(drivers)):
+            for driver in drivers:
+                self.index.addDriver(driver)
+        if drivers:
+            self.on_search_changed(self.search_entry)
+        self.spinner.stop()
+        return GLib.SOURCE_REMOVE
+
+    def _app_visible(self, model, it, data):
+        return self.matches is None or model[it][1] in self.matches
+
+    def on_search_changed(self, entry):
+        text = entry.props.text
+        if text.strip() and self.index is not None:
+            self.matches = set(self.index.search(text))
+        else:
+            self.matches = None
+        self.filter.refilter()
+
+    def on_application_selected(self, selection):
+        model, it = selection.get_selected()
+        child = self.pane_window.get_child()
+        if child:
+            child.destroy()
+        if it is not None:
+            app = model[it][1]
+            with trace.span('build application pane', 'ui', app=app.name):
+                pane = ApplicationPane(app)
+                # The window was shown before the pane existed
+                pane.show_all()
+                self.pane_window.add(pane)
 
     def on_add_application(self, action, param):
         def o(dialog, response):
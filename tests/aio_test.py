@@ -0,0 +1,66 @@
+# aio_test.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import time
+import unittest
+
+from driconfig import aio, dri
+from tests.dri_test import FakeXDriInfoMixin
+
+
+class AioTests(FakeXDriInfoMixin, unittest.IsolatedAsyncioTestCase):
+    async def test_display_info(self):
+        display = await aio.DisplayInfo(':0')
+        self.assertEqual(len(display.screens), 2)
+        self.assertEqual(display.screens[1].num, 1)
+        self.assertEqual(display.screens[0].glxInfo.vendor, 'X.Org')
+        self.assertIs(display.screens[0].driver, display.screens[1].driver)
+        self.assertEqual(self.spawns().count('options radeon'), 1)
+        self.assertIs(dri.GetDriver('radeon'), display.screens[0].driver)
+
+    async def test_unknown_driver(self):
+        self.assertIsNone(await aio.GetDriver('nouveau'))
+        with self.assertRaises(dri.DRIError):
+            await aio.GetDriver('nouveau', catch=0)
+
+    async def test_glxinfo_timeout(self):
+        os.environ['FAKE_GLXINFO_HANG'] = '1'
+        start = time.monotonic()
+        with self.assertRaises(dri.DRIError):
+            await aio.GLXInfo(0, ':0', timeout=0.2)
+        self.assertLess(time.monotonic() - start, 5)
+
+    async def test_glxinfo_stops_early(self):
+        os.environ['FAKE_GLXINFO_HANG_AFTER'] = '1'
+        start = time.monotonic()
+        info = await aio.GLXInfo(0, ':0', timeout=10)
+        self.assertEqual(info.vendor, 'X.Org')
+        self.assertLess(time.monotonic() - start, 5)
+
+    async def test_glxinfo_cancel(self):
+        os.environ['FAKE_GLXINFO_HANG'] = '1'
+        task = asyncio.ensure_future(aio.GLXInfo(0, ':0'))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await asyncio.wait_for(task, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
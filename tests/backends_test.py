@@ -0,0 +1,83 @@
+# backends_test.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+from unittest import mock
+
+from driconfig import aio, backends, dri
+from tests.dri_test import FakeXDriInfoMixin
+
+
+class FakeBackendTests(FakeXDriInfoMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        os.environ['DRICONFIG_BACKEND'] = 'fake:tests/fake-display.json'
+
+    def test_display_info(self):
+        display = dri.DisplayInfo(':0.0')
+        self.assertIsInstance(dri.GetBackend(), backends.FakeBackend)
+        self.assertEqual(len(display.screens), 3)
+        self.assertEqual(display.screens[0].driver.name, 'radeon')
+        self.assertEqual(display.screens[0].glxInfo.renderer, 'AMD TURKS (DRM 2.50.0)')
+        self.assertIsNone(display.screens[1])
+        self.assertIsNone(display.screens[2])
+        self.assertEqual(self.spawns(), [])
+
+    def test_xdriinfo_compatible(self):
+        self.assertEqual(dri.XDriInfo('nscreens', ':0'), '3\n')
+        self.assertEqual(dri.XDriInfo('driver 2', ':0'), 'nouveau\n')
+        with self.assertRaises(dri.DRIError):
+            dri.XDriInfo('options nouveau')
+        with self.assertRaises(dri.DRIError):
+            dri.XDriInfo('nscreens', ':1')
+
+    def test_cache_key(self):
+        fake = dri.DriverFingerprint('radeon')
+        dri.SetBackend(dri.SubprocessBackend())
+        self.assertNotEqual(dri.DriverFingerprint('radeon'), fake)
+
+    def test_record(self):
+        dri.SetBackend(dri.SubprocessBackend())
+        fixture = backends.RecordFixture(dri.GetBackend(), ':0')
+        dri.SetBackend(backends.FakeBackend(fixture))
+        self.assertEqual(len(self.spawns()), 4)
+        display = dri.DisplayInfo(':0')
+        self.assertEqual(len(self.spawns()), 4)
+        self.assertEqual(display.screens[1].glxInfo.vendor, 'X.Org')
+        with open('tests/radeon-options.xml') as f:
+            self.assertEqual(str(display.screens[1].driver),
+                             str(dri.DriverInfo('radeon', driInfo=f.read())))
+
+
+class FakeBackendAioTests(FakeXDriInfoMixin, unittest.IsolatedAsyncioTestCase):
+    async def test_display_info(self):
+        dri.SetBackend(backends.FakeBackend('tests/fake-display.json'))
+        display = await aio.DisplayInfo(':0')
+        self.assertEqual(display.screens[0].glxInfo.vendor, 'X.Org')
+        self.assertEqual(self.spawns(), [])
+
+
+class CtypesBackendTests(unittest.TestCase):
+    def test_missing_libraries(self):
+        with mock.patch('ctypes.util.find_library', return_value=None):
+            with self.assertRaises(dri.DRIError):
+                backends.CtypesBackend()
+
+
+if __name__ == '__main__':
+    unittest.main()
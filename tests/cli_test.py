@@ -0,0 +1,131 @@
+# cli_test.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from driconfig import cli, dri
+from tests.dri_test import FakeXDriInfoMixin
+
+
+class CliTests(FakeXDriInfoMixin, unittest.TestCase):
+    def run_cli(self, *args):
+        out = io.StringIO()
+        err = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            status = cli.main(list(args))
+        return status, out.getvalue(), err.getvalue()
+
+    def test_no_gtk_import(self):
+        code = ('import sys; from driconfig import __main__ as m; '
+                'status = m.main(["driconfig", "--version"]); '
+                'assert "gi" not in sys.modules; sys.exit(status)')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'0.1.0')
+
+    def test_help_without_gtk(self):
+        code = ('import sys; from driconfig import __main__ as m; '
+                'status = m.main(["driconfig", "--help"]); '
+                'assert "gi" not in sys.modules; sys.exit(status)')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertIn(b'search', output)
+        self.assertTrue(cli.handles(['-h']))
+
+    def test_options(self):
+        status, out, err = self.run_cli('options', 'tuxracer', '--screen', '0',
+                                        '--driver', 'radeon',
+                                        '--config', 'tests/drirc.xml')
+        self.assertEqual(status, 0)
+        self.assertEqual(out, 'tcl_mode=0\nvblank_mode=3\n')
+
+    def test_set_unset(self):
+        path = os.path.join(self.tmpdir.name, 'drirc')
+        status, out, err = self.run_cli('set', 'glxgears', 'vblank_mode', '0',
+                                        '--driver', 'radeon', '--file', path)
+        self.assertEqual(status, 0)
+        self.assertEqual(dri.DRIConfig(path).devices[0].apps[0].options,
+                         {'vblank_mode': '0'})
+
+        status, out, err = self.run_cli('set', 'glxgears', 'vblank_mode', '9',
+                                        '--driver', 'radeon', '--file', path)
+        self.assertEqual(status, 1)
+
+        status, out, err = self.run_cli('unset', 'glxgears', 'vblank_mode',
+                                        '--driver', 'radeon', '--file', path)
+        self.assertEqual(status, 0)
+        self.assertEqual(dri.DRIConfig(path).devices, [])
+
+    def test_scan(self):
+        status, out, err = self.run_cli('scan', 'tests/drirc.xml', '--executable', 'tuxracer')
+        self.assertEqual(status, 0)
+        self.assertEqual(out, 'tests/drirc.xml: tuxracer: tcl_mode=0\n')
+        status, out, err = self.run_cli('scan', 'tests/drirc.xml', '--json',
+                                        '--driver', 'radeon')
+        records = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0]['executable'], None)
+
+    def test_search(self):
+        status, out, err = self.run_cli('search', 'dual', 'source', '--config', 'tests/drirc.xml',
+                                        '--catalog', 'radeon=tests/radeon-options.xml')
+        self.assertEqual(status, 0)
+        self.assertEqual(out, 'tests/drirc.xml: Unigine Sanctuary (Sanctuary)\n')
+        self.assertEqual(self.spawns(), [])
+
+    def test_screens(self):
+        status, out, err = self.run_cli('screens', '--display', ':0', '--json')
+        self.assertEqual([s['driver'] for s in json.loads(out)],
+                         ['radeon', 'radeon'])
+
+    def test_validate(self):
+        status, out, err = self.run_cli(
+            'validate', 'tests/drirc.xml',
+            '--catalog', 'radeon=tests/radeon-options.xml')
+        self.assertEqual((status, out), (0, ''))
+
+    def test_validate_engine(self):
+        path = os.path.join(self.tmpdir.name, 'drirc')
+        with open(path, 'w') as f:
+            f.write('<driconf><device driver="radeon"><engine engine_name_match="^Unreal">'
+                    '<option name="tcl_mode" value="fast"/></engine></device></driconf>')
+        status, out, err = self.run_cli(
+            'validate', path, '--catalog', 'radeon=tests/radeon-options.xml')
+        self.assertEqual((status, err), (1, ''))
+        self.assertEqual(out, '{}: Engine ^Unreal: tcl_mode=fast (radeon): '
+                              'not a valid enum\n'.format(path))
+
+    def test_lint(self):
+        list_file = os.path.join(self.tmpdir.name, 'files')
+        with open(list_file, 'w') as f:
+            f.write('tests/drirc.xml\n' + os.path.join(self.tmpdir.name, 'missing') + '\n')
+        status, out, err = self.run_cli(
+            'lint', 'tests/drirc.xml', '--files-from', list_file, '-j', '2',
+            '--catalog', 'radeon=tests/radeon-options.xml')
+        self.assertEqual(status, 1)
+        records = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertTrue(records[0]['file'].endswith('missing'))
+        self.assertIsNone(records[0]['application'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# daemon_test.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import io
+import os
+import shutil
+import threading
+import time
+import unittest
+from unittest import mock
+
+from driconfig import daemon, dri
+from tests.dri_test import FakeXDriInfoMixin
+
+
+class DaemonTests(FakeXDriInfoMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.drirc = os.path.join(self.tmpdir.name, 'drirc')
+        shutil.copy('tests/drirc.xml', self.drirc)
+        self.socket = os.path.join(self.tmpdir.name, 'sock')
+        service = daemon.Service([self.drirc], poll_interval=0)
+        self.server = daemon.Server(self.socket, service)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+        self.client = daemon.Client(self.socket, timeout=10)
+        self.addCleanup(self.client.close)
+
+    def test_options_follow_file(self):
+        self.assertEqual(self.client.call('options', executable='glxgears',
+                                          screen=0, driver='radeon'),
+                         {'vblank_mode': '0'})
+        conf = dri.DRIConfig(self.drirc)
+        conf.setOption('glxgears', 'vblank_mode', '1', '0', 'radeon')
+        conf.save()
+        os.utime(self.drirc, ns=(0, 0))
+        self.assertEqual(self.client.call('options', executable='glxgears',
+                                          screen=0, driver='radeon'),
+                         {'vblank_mode': '1'})
+
+    def test_invalid_config_keeps_serving(self):
+        with open(self.drirc, 'w') as f:
+            f.write('<driconf><device>')
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            self.assertEqual(self.client.call('options', executable='glxgears',
+                                              screen=0, driver='radeon'),
+                             {'vblank_mode': '0'})
+            self.assertIn('ExpatError', self.client.call('ping')['problem'])
+            with self.assertRaisesRegex(daemon.DaemonError, 'ExpatError'):
+                self.client.call('reload')
+        self.assertEqual(stderr.getvalue().count('ExpatError'), 1)
+        shutil.copy('tests/drirc.xml', self.drirc)
+        os.utime(self.drirc, ns=(0, 0))
+        self.assertIsNone(self.client.call('ping')['problem'])
+
+    def test_warm_cache(self):
+        screens = self.client.call('screens', display=':0')
+        self.assertEqual([s['driver'] for s in screens], ['radeon', 'radeon'])
+        self.client.call('screens', display=':0')
+        catalog = self.client.call('catalog', driver='radeon')
+        self.assertIn('tcl_mode', catalog)
+        self.assertIsNone(self.client.call('catalog', driver='nouveau'))
+        self.client.call('catalog', driver='nouveau')
+        self.assertEqual(self.spawns().count('options radeon'), 1)
+        self.assertEqual(self.spawns().count('-display :0 nscreens'), 1)
+        self.assertEqual(self.spawns().count('options nouveau'), 1)
+
+    def test_validate(self):
+        self.assertEqual(self.client.call('validate'), [])
+        conf = dri.DRIConfig(self.drirc)
+        conf.setOption('glxgears', 'vblank_mode', '9', '0', 'radeon')
+        conf.save()
+        os.utime(self.drirc, ns=(0, 0))
+        problems = self.client.call('validate')
+        self.assertEqual([(p['option'], p['problem']) for p in problems],
+                         [('vblank_mode', 'out of valid range')])
+
+    def test_errors(self):
+        with self.assertRaisesRegex(daemon.DaemonError, 'unknown method'):
+            self.client.call('frobnicate')
+        with self.assertRaisesRegex(daemon.DaemonError, 'invalid params'):
+            self.client.call('catalog', drvier='radeon')
+        with self.assertRaisesRegex(daemon.DaemonError, 'invalid params'):
+            self.client.call('options', executable='glxgears', drvier='radeon')
+        self.assertEqual(self.client.call('ping')['pid'], os.getpid())
+
+    def test_hung_probe(self):
+        self.server.service.probe_timeout = 0.5
+        os.environ['FAKE_XDRIINFO_HANG'] = '30'
+        self.addCleanup(os.environ.pop, 'FAKE_XDRIINFO_HANG')
+        errors = []
+
+        def screens():
+            with daemon.Client(self.socket, timeout=10) as client:
+                try:
+                    client.call('screens', display=':0')
+                except daemon.DaemonError as e:
+                    errors.append(str(e))
+        thread = threading.Thread(target=screens)
+        thread.start()
+        deadline = time.monotonic() + 10
+        while not self.spawns() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Not blocked by the hanging xdriinfo
+        self.client.call('ping')
+        self.assertEqual(self.client.call('options', executable='glxgears',
+                                          screen=0, driver='radeon'),
+                         {'vblank_mode': '0'})
+        thread.join()
+        self.assertEqual(errors, ['xdriinfo timed out.'])
+
+    def test_internal_error(self):
+        with mock.patch.object(self.server.service, 'handle_ping',
+                               side_effect=ValueError('boom')):
+            with contextlib.redirect_stderr(io.StringIO()):
+                with self.assertRaisesRegex(daemon.DaemonError, 'internal error'):
+                    self.client.call('ping')
+        self.assertEqual(self.client.call('reload'), [])
+
+    def test_second_daemon_refused(self):
+        with self.assertRaises(daemon.DaemonError):
+            daemon.Server(self.socket, self.server.service)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,10 +15,51 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import re
+import tempfile
+import time
 import unittest
+import xml.parsers.expat
+from unittest import mock
 
 from driconfig import dri
 
+FAKE_BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
+
+
+class FakeXDriInfoMixin:
+    """Puts tests/bin/xdriinfo on PATH and isolates the cache directory."""
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.tmpdir.name, 'xdriinfo.log')
+        env = {
+            'PATH': FAKE_BIN + os.pathsep + os.environ.get('PATH', ''),
+            'XDG_CACHE_HOME': os.path.join(self.tmpdir.name, 'cache'),
+            'FAKE_XDRIINFO_LOG': self.log,
+            'DRICONFIG_BACKEND': '',
+        }
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+        dri.DisplayInfo.drivers.clear()
+        self.addCleanup(dri.DisplayInfo.drivers.clear)
+        for name in ('GLXInfoBrief', '_backend'):
+            patcher = mock.patch.object(dri, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def spawns(self):
+        try:
+            with open(self.log) as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+
 class DriTests(unittest.TestCase):
     def test_load(self):
         self.conf = dri.DRIConfig('tests/drirc.xml')
@@ -26,5 +67,676 @@ class DriTests(unittest.TestCase):
         self.assertEqual(len(self.conf.devices[0].apps), 3)
         self.assertEqual(len(self.conf.devices[1].apps[0].options), 2)
 
+    def test_compact(self):
+        conf = dri.DRIConfig('tests/drirc.xml')
+        all_apps, glxgears = conf.devices[0].apps[:2]
+        self.assertFalse(hasattr(glxgears, '__dict__'))
+        self.assertFalse(hasattr(conf.devices[0], '__dict__'))
+        name_a, = all_apps.options
+        name_b, = glxgears.options
+        self.assertIs(name_a, name_b)
+
+    def test_save_round_trip(self):
+        conf = dri.DRIConfig('tests/drirc.xml')
+        conf.devices[1].apps[0].name = 'Quotes " & <brackets>'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'drirc')
+            conf.save(path)
+            self.assertEqual(os.listdir(tmpdir), ['drirc'])
+            saved = dri.DRIConfig(path)
+        self.assertEqual(saved.devices[1].apps[0].name,
+                         'Quotes " & <brackets>')
+        self.assertEqual(str(saved), str(conf))
+
+    def test_save_new_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'drirc')
+            conf = dri.DRIConfig(path, create=True)
+            conf.setOption('glxgears', 'vblank_mode', '0')
+            conf.save()
+            with open(path) as f:
+                self.assertEqual(f.read(), str(conf))
+
+    def save_patched(self, edit):
+        with open('tests/drirc.xml') as f:
+            orig = f.read()
+        conf = dri.DRIConfig('tests/drirc.xml')
+        edit(conf)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'drirc')
+            conf.save(path)
+            with open(path) as f:
+                saved = f.read()
+            self.assertEqual(str(dri.DRIConfig(path)), str(conf))
+        return orig.splitlines(), saved.splitlines()
+
+    def test_save_preserves_layout(self):
+        orig, saved = self.save_patched(
+            lambda conf: conf.setOption('glxgears', 'vblank_mode', '1',
+                                        screen='0', driver='radeon'))
+        changed = [(a, b) for a, b in zip(orig, saved) if a != b]
+        self.assertEqual(len(orig), len(saved))
+        self.assertEqual(changed, [('      <option name="vblank_mode" value="0"/>',
+                                    '      <option name="vblank_mode" value="1" />')])
+
+    def test_save_patch_add_remove(self):
+        def edit(conf):
+            conf.unsetOption('tuxracer', 'tcl_mode', screen='0', driver='radeon')
+            conf.setOption('glxgears', 'tcl_mode', '1', screen='0', driver='radeon')
+            conf.setOption('Sanctuary', 'tcl_mode', '2')
+            conf.setOption('glxinfo', 'tcl_mode', '0', screen='1')
+        orig, saved = self.save_patched(edit)
+        self.assertIn('      <!-- Always synchronize with vertical refresh to avoid tearing -->',
+                      saved)
+        self.assertNotIn('tuxracer', '\n'.join(saved))
+        self.assertIn('      <option name="tcl_mode" value="1" />', saved)
+        self.assertIn('      <option name="tcl_mode" value="2" />', saved)
+
+    def test_save_new_device_minimal(self):
+        orig, saved = self.save_patched(
+            lambda conf: conf.setOption('glxinfo', 'tcl_mode', '0', screen='1'))
+        self.assertEqual(saved[:len(orig) - 1], orig[:-1])
+        self.assertEqual(saved[len(orig) - 1:],
+                         ['    <device screen="1">',
+                          '        <application name="glxinfo" executable="glxinfo">',
+                          '            <option name="tcl_mode" value="0" />',
+                          '        </application>',
+                          '    </device>',
+                          '</driconf>'])
+
+    def save_source(self, source, edit):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'drirc')
+            with open(path, 'wb') as f:
+                f.write(source)
+            conf = dri.DRIConfig(path)
+            edit(conf)
+            conf.save()
+            with open(path, 'rb') as f:
+                saved = f.read()
+            self.assertEqual(str(dri.DRIConfig(path)), str(conf))
+        return saved
+
+    def test_save_empty_before_end_tag(self):
+        source = (b'<driconf>\n'
+                  b'  <device driver="radeon">\n'
+                  b'    <application name="a" executable="a"/></device>\n'
+                  b'  <device driver="i965"/>\n'
+                  b'</driconf>\n')
+        saved = self.save_source(
+            source, lambda conf: conf.setOption('a', 'tcl_mode', '1',
+                                                driver='radeon'))
+        self.assertIn(b'<option name="tcl_mode" value="1" />', saved)
+
+        def remove(conf):
+            del conf.devices[0].apps[0]
+        saved = self.save_source(source, remove)
+        self.assertIn(b'<device driver="radeon">\n    </device>', saved)
+
+        saved = self.save_source(
+            source, lambda conf: conf.devices[1].getApp('b', create=True)
+            .options.update(tcl_mode='1'))
+        self.assertTrue(saved.endswith(b'</device>\n</driconf>\n'))
+
+    def test_save_crlf(self):
+        with open('tests/drirc.xml', 'rb') as f:
+            source = f.read().replace(b'\n', b'\r\n')
+
+        def edit(conf):
+            conf.unsetOption('tuxracer', 'tcl_mode', screen='0', driver='radeon')
+            conf.setOption('glxgears', 'tcl_mode', '1', screen='0', driver='radeon')
+            conf.setOption('glxinfo', 'tcl_mode', '0', screen='1')
+        saved = self.save_source(source, edit)
+        self.assertNotIn(b'tuxracer', saved)
+        self.assertEqual(saved.count(b'\n'), saved.count(b'\r\n'))
+
+    def test_save_rewrite_streams(self):
+        conf = dri.DRIConfig('tests/drirc.xml')
+        conf.devices.reverse()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'drirc')
+            with mock.patch.object(dri.DRIConfig, '__str__') as toStr:
+                conf.save(path)
+            self.assertFalse(toStr.called)
+            self.assertIsNone(conf.source)
+            self.assertEqual(str(dri.DRIConfig(path)), str(conf))
+
+    def test_save_parses_once(self):
+        conf = dri.DRIConfig('tests/drirc.xml')
+        conf.setOption('glxgears', 'vblank_mode', '1', screen='0', driver='radeon')
+        conf.setOption('glxgears', 'tcl_mode', '1', screen='0', driver='radeon')
+        conf.unsetOption('tuxracer', 'tcl_mode', screen='0', driver='radeon')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'drirc')
+            with mock.patch('xml.parsers.expat.ParserCreate',
+                            wraps=xml.parsers.expat.ParserCreate) as parser:
+                conf.save(path)
+            saved = dri.DRIConfig(path)
+        # Only the source is parsed, the offsets are moved by the patches
+        self.assertEqual(parser.call_count, 1)
+        self.assertEqual([(d.srcPos, [a.srcPos for a in d.apps])
+                          for d in conf.devices],
+                         [(d.srcPos, [a.srcPos for a in d.apps])
+                          for d in saved.devices])
+
+    def test_save_reorder_rewrites(self):
+        def edit(conf):
+            conf.devices.reverse()
+        orig, saved = self.save_patched(edit)
+        self.assertNotIn('<!--', '\n'.join(saved))
+
+    def test_save_twice(self):
+        conf = dri.DRIConfig('tests/drirc.xml')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'drirc')
+            conf.setOption('glxinfo', 'tcl_mode', '0')
+            conf.save(path)
+            conf.unsetOption('glxgears', 'vblank_mode', screen='0', driver='radeon')
+            conf.setOption('glxinfo', 'tcl_mode', '1')
+            conf.save(path)
+            with open(path) as f:
+                saved = f.read()
+            self.assertEqual(str(dri.DRIConfig(path)), str(conf))
+        self.assertIn('<!-- Tuxrace', saved)
+
+
+class OptionResolverTests(unittest.TestCase):
+    def setUp(self):
+        self.resolver = dri.OptionResolver(dri.DRIConfig('tests/drirc.xml'))
+
+    def test_precedence(self):
+        self.assertEqual(self.resolver.getOptions('glxgears', 0, 'radeon'),
+                         {'vblank_mode': '0'})
+        self.assertEqual(self.resolver.getOptions('glxinfo', '0', 'radeon'),
+                         {'vblank_mode': '3'})
+        self.assertEqual(self.resolver.getOptions('tuxracer', 0, 'radeon'),
+                         {'vblank_mode': '3', 'tcl_mode': '0'})
+
+    def test_device_mismatch(self):
+        self.assertEqual(self.resolver.getOptions('glxgears', 1, 'radeon'), {})
+        self.assertEqual(self.resolver.getOptions('glxgears', 0, 'i965'), {})
+        self.assertEqual(len(self.resolver.getOptions('Sanctuary', 3, 'i965')),
+                         2)
+
+    def test_rebuild(self):
+        conf = self.resolver.configs[0]
+        self.resolver.getOptions('glxgears', 0, 'radeon')
+        conf.devices[0].apps[1].options['vblank_mode'] = '1'
+        self.resolver.rebuild()
+        self.assertEqual(self.resolver.getOptions('glxgears', 0, 'radeon'),
+                         {'vblank_mode': '1'})
+
+
+class IterConfigTests(unittest.TestCase):
+    def test_matches_tree(self):
+        conf = dri.DRIConfig('tests/drirc.xml')
+        records = list(dri.IterConfig('tests/drirc.xml', chunkSize=16))
+        self.assertEqual([str(app) for device, app in records],
+                         [str(app) for device in conf.devices for app in device.apps])
+        self.assertEqual(records[0][0].driver, 'radeon')
+        self.assertEqual(records[0][0].apps, [])
+
+    def test_filters(self):
+        records = list(dri.IterConfig('tests/drirc.xml', driver='radeon',
+                                      options=True))
+        self.assertEqual([r[2:] for r in records],
+                         [('vblank_mode', '3'), ('vblank_mode', '0'), ('tcl_mode', '0')])
+        records = list(dri.IterConfig('tests/drirc.xml', executable='Sanctuary'))
+        self.assertEqual([app.name for device, app in records], ['Unigine Sanctuary'])
+
+    def test_early_termination(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'drirc')
+            with open('tests/drirc.xml') as f, open(path, 'w') as out:
+                out.write(f.read().replace('</driconf>', ' ' * 100000 + '<broken'))
+            records = dri.IterConfig(path, executable='glxgears', chunkSize=1024)
+            device, app = next(records)
+            records.close()
+            self.assertEqual(app.name, 'glxgears')
+            with self.assertRaises(dri.XMLError):
+                list(dri.IterConfig(path))
+
+
+class DescTableTests(unittest.TestCase):
+    def setUp(self):
+        with open('tests/radeon-options.xml') as f:
+            self.driver = dri.DriverInfo('radeon', driInfo=f.read())
+
+    def test_lookups(self):
+        table = self.driver.getDescTable(['de'])
+        self.assertEqual(table.section(0), 'Fehlersuche')
+        self.assertEqual(table.desc('tcl_mode'), 'TCL-Modus (Transformation, Clipping, Licht)')
+        # English fallback for options without German descriptions
+        self.assertEqual(table.desc('disable_blend_func_extended'),
+                         'Disable dual source blending')
+        self.assertIsNone(table.desc('no_such_option'))
+        self.assertIsNone(table.enum('tcl_mode', 42))
+        opt = self.driver.getOptInfo('tcl_mode')
+        self.assertEqual(table.desc('tcl_mode'), opt.getDesc(['de']).text)
+        self.assertEqual(table.enum('tcl_mode', 0), opt.getDesc(['de']).enums[0])
+        self.assertEqual(table.enum('tcl_mode', 3), None)
+
+    def test_rebuilt_on_locale_change(self):
+        with mock.patch.dict(os.environ, {'LANGUAGE': '', 'LC_ALL': 'de_AT.UTF-8'}):
+            self.assertEqual(dri.PreferredLangs(), ('de_AT', 'de'))
+            table = self.driver.getDescTable()
+            self.assertIs(self.driver.getDescTable(), table)
+            self.assertEqual(table.section(1), 'Leistung')
+        with mock.patch.dict(os.environ, {'LANGUAGE': 'C', 'LC_ALL': 'C'}):
+            self.assertEqual(dri.PreferredLangs(), ())
+            self.assertIsNot(self.driver.getDescTable(), table)
+            self.assertEqual(self.driver.getDescTable().section(1), 'Performance')
+
+    def test_get_desc(self):
+        self.assertEqual(dri.GetDesc({'fr': 'a'}, ['de']), 'a')
+        self.assertIsNone(dri.GetDesc({}, ['de']))
+
+
+class SearchIndexTests(unittest.TestCase):
+    def setUp(self):
+        conf = dri.DRIConfig('tests/drirc.xml')
+        self.apps = [app for device in conf.devices for app in device.apps]
+        with open('tests/radeon-options.xml') as f:
+            driver = dri.DriverInfo('radeon', driInfo=f.read())
+        self.index = dri.SearchIndex(self.apps, [driver])
+
+    def names(self, query):
+        return [app.name for app in self.index.search(query)]
+
+    def test_prefixes(self):
+        self.assertEqual(self.names('glxg'), ['glxgears'])
+        self.assertEqual(self.names('GLXGEARS'), ['glxgears'])
+        self.assertEqual(self.names('unigine sanct'), ['Unigine Sanctuary'])
+        self.assertEqual(self.names('unigine glx'), [])
+        self.assertEqual(len(self.names('  ')), 4)
+
+    def test_options(self):
+        self.assertEqual(self.names('vblank'), ['all', 'glxgears'])
+        self.assertEqual(self.names('vblank_mode glxgears'), ['glxgears'])
+        self.assertEqual(self.names('tcl'), ['tuxracer'])
+
+    def test_descriptions(self):
+        # "Disable dual source blending" and German descriptions
+        self.assertEqual(self.names('dual source'), ['Unigine Sanctuary'])
+        self.assertEqual(self.names('erweiterungen'), ['Unigine Sanctuary'])
+        self.assertEqual(self.names('lighting'), ['tuxracer'])
+
+    def test_add(self):
+        app = dri.AppConfig(self.apps[0].device, 'Quake', 'quake3')
+        self.assertEqual(self.names('quake'), [])
+        self.index.add([app])
+        self.assertEqual(self.names('quake'), ['Quake'])
+
+
+class SelectorTests(unittest.TestCase):
+    def setUp(self):
+        self.conf = dri.DRIConfig('tests/drirc-selectors.xml')
+        self.resolver = dri.OptionResolver(self.conf)
+
+    def test_parse(self):
+        games, hashed, demo, engine = self.conf.devices[0].apps
+        self.assertIsNone(games.executable)
+        self.assertEqual(games.selectors, {'executable_regexp': '^(quake|doom)[0-9]*$'})
+        self.assertIsInstance(engine, dri.EngineConfig)
+        self.assertEqual(engine.name, 'Engine ^Unreal (0:4,10)')
+        self.assertEqual(self.conf.devices[1].deviceName, 'AMD TURKS')
+        self.assertIsNone(self.conf.devices[0].getApp(None))
+        self.assertEqual(str(dri.DRIConfig('tests/drirc-selectors.xml')), str(self.conf))
+
+    def test_executable_regexp(self):
+        self.assertEqual(self.resolver.getOptions('quake3', driver='radeon'),
+                         {'vblank_mode': '0'})
+        self.assertEqual(self.resolver.getOptions('quake3x', driver='radeon'), {})
+        self.assertEqual(self.resolver.getOptions('doom', driver='radeon',
+                                                  deviceName='AMD TURKS'),
+                         {'vblank_mode': '0', 'def_max_anisotropy': '16.0'})
+        self.assertEqual(self.resolver.getOptions('doom', driver='radeon'),
+                         {'vblank_mode': '0'})
+
+    def test_sha1(self):
+        self.assertEqual(
+            self.resolver.getOptions('x', driver='radeon',
+                                     sha1='0123456789abcdef0123456789ABCDEF01234567'),
+            {'tcl_mode': '1'})
+
+    def test_versions(self):
+        query = dict(driver='radeon', applicationName='My Demo')
+        self.assertEqual(self.resolver.getOptions(applicationVersion=2, **query),
+                         {'tcl_mode': '2'})
+        self.assertEqual(self.resolver.getOptions(applicationVersion=4, **query), {})
+        query = dict(driver='radeon', engineName='UnrealEngine')
+        self.assertEqual(self.resolver.getOptions(engineVersion=10, **query),
+                         {'texture_units': '4'})
+        self.assertEqual(self.resolver.getOptions(engineVersion=5, **query), {})
+
+    def test_memo_bounded(self):
+        resolver = dri.OptionResolver(dri.DRIConfig('tests/drirc.xml'),
+                                      memoSize=2)
+        resolver.getOptions('glxgears', 0, 'radeon')
+        resolver.getOptions('tuxracer', 0, 'radeon')
+        resolver.getOptions('glxgears', 0, 'radeon')
+        resolver.getOptions('glxgears', 0, 'radeon', sha1='abc')
+        self.assertEqual(len(resolver.memo), 2)
+        with mock.patch.object(resolver, 'getApps') as getApps:
+            self.assertEqual(resolver.getOptions('glxgears', 0, 'radeon'),
+                             {'vblank_mode': '0'})
+        getApps.assert_not_called()
+
+    def test_regex_set(self):
+        regexes = dri.RegexSet(['^a', 'b$', '(c)\\1', '[', 'a|b'])
+        self.assertEqual(sorted(regexes.match('ab')), [0, 1, 4])
+        self.assertEqual(regexes.match('xccx'), [2])
+        self.assertEqual(regexes.match('x'), [])
+
+    def test_regex_set_literals(self):
+        patterns = ['^gears$', '^gl', 'gears$', 'xgear', 'gl.*s$', 'gx?ears',
+                    '^gl[a-z]+', '(?i)GEARS']
+        regexes = dri.RegexSet(patterns)
+        for string in ('glxgears', 'glxgears\n', 'gears', 'gears\n', 'geas',
+                       'GLXGEARS', 'gl', ''):
+            self.assertEqual(regexes.match(string),
+                             [i for i, p in enumerate(patterns)
+                              if re.search(p, string)], string)
+
+
+class LayeredConfigTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.system = os.path.join(self.tmpdir.name, 'drirc')
+        self.user = os.path.join(self.tmpdir.name, '.drirc')
+        self.write(self.system, '3')
+
+    def write(self, path, vblank_mode):
+        with open(path, 'w') as f:
+            f.write('<driconf><device><application name="all">'
+                    '<option name="vblank_mode" value="{}"/>'
+                    '</application></device></driconf>'.format(vblank_mode))
+        # Make sure the change is visible even on coarse timestamps
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def test_precedence_and_reload(self):
+        conf = dri.LayeredConfig([self.system, self.user])
+        self.assertEqual(len(conf.configs), 1)
+        self.assertEqual(conf.getOptions('glxgears'), {'vblank_mode': '3'})
+
+        self.write(self.user, '0')
+        self.assertEqual(conf.reload(), [self.user])
+        self.assertEqual(conf.getOptions('glxgears'), {'vblank_mode': '0'})
+
+        system = conf.configs[0]
+        devices = conf.devices
+        systemLayer = conf.resolver.layers[id(system)]
+        self.write(self.user, '1')
+        self.assertEqual(conf.reload(), [self.user])
+        self.assertIs(conf.configs[0], system)
+        self.assertIs(conf.devices, devices)
+        # Only the changed file is indexed again
+        self.assertIs(conf.resolver.layers[id(system)], systemLayer)
+        self.assertEqual(len(conf.devices), 2)
+        self.assertEqual(conf.getOptions('glxgears'), {'vblank_mode': '1'})
+        self.assertEqual(conf.reload(), [])
+
+        os.unlink(self.user)
+        self.assertEqual(conf.reload(), [self.user])
+        self.assertEqual(conf.getOptions('glxgears'), {'vblank_mode': '3'})
+
+    def test_editable_layer(self):
+        defaults = os.path.join(self.tmpdir.name, '00-mesa-defaults.conf')
+        self.write(defaults, '1')
+        with mock.patch.object(dri, 'SYSTEM_CONFIG', self.system), \
+                mock.patch.object(dri, 'USER_CONFIG', self.user):
+            conf = dri.LayeredConfig([defaults, self.system, self.user])
+            self.assertIs(conf.getEditableLayer(), conf.getLayer(self.system))
+            self.write(self.user, '0')
+            conf.reload()
+            self.assertEqual(conf.getEditableLayer().fileName, self.user)
+            os.unlink(self.system)
+            os.unlink(self.user)
+            conf.reload()
+            self.assertIsNone(conf.getEditableLayer())
+
+    def test_invalid_file_keeps_view(self):
+        conf = dri.LayeredConfig([self.system, self.user])
+        with open(self.user, 'w') as f:
+            f.write('<driconf><device>')
+        with self.assertRaises(dri.XMLError):
+            conf.reload()
+        self.assertEqual(conf.getOptions('glxgears'), {'vblank_mode': '3'})
+
+
+class ValidatorTests(unittest.TestCase):
+    def setUp(self):
+        with open('tests/radeon-options.xml') as f:
+            self.driver = dri.DriverInfo('radeon', driInfo=f.read())
+
+    def test_typed_options(self):
+        conf = dri.DRIConfig('tests/drirc.xml')
+        app = conf.devices[0].apps[2]
+        app.options.update({'texture_units': '04', 'def_max_anisotropy': '3',
+                            'tcl_mode': 'x', 'frobnicate': '1'})
+        typed = app.getTypedOptions(self.driver)
+        self.assertEqual(typed['texture_units'].value, 4)
+        self.assertEqual(typed['texture_units'].canonical, '4')
+        self.assertEqual(typed['texture_units'].status, dri.VALUE_VALID)
+        self.assertEqual(typed['def_max_anisotropy'].status, dri.VALUE_OUT_OF_RANGE)
+        self.assertEqual(typed['tcl_mode'].status, dri.VALUE_INVALID)
+        self.assertIsNone(typed['tcl_mode'].value)
+        self.assertEqual(typed['frobnicate'].status, dri.VALUE_UNKNOWN)
+
+        units = typed['texture_units']
+        app.options['tcl_mode'] = '1'
+        del app.options['frobnicate']
+        typed = app.getTypedOptions(self.driver)
+        self.assertIs(typed['texture_units'], units)
+        self.assertEqual(typed['tcl_mode'].value, 1)
+        self.assertNotIn('frobnicate', typed)
+        self.assertIs(dri.TypeValue('04', units.opt), units)
+
+    def test_ranges(self):
+        aniso = self.driver.getOptInfo('def_max_anisotropy')
+        self.assertEqual(aniso.rangeStarts, [1.0, 2.0, 4.0, 8.0, 16.0])
+        self.assertTrue(aniso.validate('4'))
+        self.assertFalse(aniso.validate('3.0'))
+        self.assertFalse(aniso.validate('32'))
+        self.assertFalse(aniso.validate('fast'))
+        units = self.driver.getOptInfo('texture_units')
+        self.assertTrue(units.validate('2') and units.validate('8'))
+        self.assertFalse(units.validate('1') or units.validate('9'))
+
+    def test_engine(self):
+        conf = dri.DRIConfig('tests/drirc-selectors.xml')
+        engine = conf.devices[0].apps[3]
+        engine.options['texture_units'] = '99'
+        (diag,) = dri.ConfigValidator({'radeon': self.driver}).validate(conf)
+        self.assertIs(diag.app, engine)
+        self.assertEqual(str(diag), 'Engine ^Unreal (0:4,10): texture_units=99 '
+                                    '(radeon): out of valid range')
+        self.assertNotIn('Engine ^Unreal', str(conf))
+
+    def test_bulk_validation(self):
+        conf = dri.DRIConfig('tests/drirc.xml')
+        validator = dri.ConfigValidator({'radeon': self.driver, 'i965': None})
+        self.assertEqual(validator.validate(conf), [])
+        self.assertTrue(self.driver.validate(conf.devices[0].apps[0].options))
+
+        conf.devices[0].apps[1].options['vblank_mode'] = '7'
+        conf.devices[1].apps[0].options['no_such_option'] = 'true'
+        conf.devices[1].apps[0].options['texture_units'] = 'many'
+        i965 = dri.DeviceConfig(conf, driver='i965')
+        i965.apps.append(dri.AppConfig(i965, 'all'))
+        conf.devices.append(i965)
+        problems = sorted((d.app.name, d.option, d.problem)
+                          for d in validator.validate(conf))
+        self.assertEqual(problems, [
+            ('Unigine Sanctuary', 'no_such_option', 'unknown option'),
+            ('Unigine Sanctuary', 'texture_units', 'not a valid int'),
+            ('all', None, 'driver does not support configuration'),
+            ('glxgears', 'vblank_mode', 'out of valid range'),
+        ])
+        self.assertFalse(self.driver.validate(conf.devices[0].apps[1].options))
+
+
+class DriverCacheTests(FakeXDriInfoMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        drivers = os.path.join(self.tmpdir.name, 'dri')
+        os.mkdir(drivers)
+        open(os.path.join(drivers, 'radeon_dri.so'), 'w').close()
+        patcher = mock.patch.dict(os.environ, {'LIBGL_DRIVERS_PATH': drivers})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_warm_start_skips_xdriinfo(self):
+        cold = dri.DriverInfo('radeon')
+        self.assertEqual(self.spawns(), ['options radeon'])
+        warm = dri.DriverInfo('radeon')
+        self.assertEqual(len(self.spawns()), 1)
+        self.assertEqual(str(warm), str(cold))
+        self.assertEqual(warm.getOptInfo('tcl_mode').desc['en'].enums[3],
+                         cold.getOptInfo('tcl_mode').desc['en'].enums[3])
+
+    def test_fingerprint_change_invalidates(self):
+        dri.DriverInfo('radeon')
+        with mock.patch.object(dri, 'DriverFingerprint', return_value=('new',)):
+            dri.DriverInfo('radeon')
+        self.assertEqual(len(self.spawns()), 2)
+
+    def test_library_not_found(self):
+        os.environ['LIBGL_DRIVERS_PATH'] = self.tmpdir.name
+        with mock.patch.object(dri, 'DRIVER_SEARCH_PATH', ()):
+            self.assertIsNone(dri.DriverFingerprint('radeon'))
+            dri.DriverInfo('radeon')
+            dri.DriverInfo('radeon')
+        self.assertEqual(len(self.spawns()), 2)
+        self.assertFalse(os.path.exists(os.path.join(dri.CacheDir(), 'drivers')))
+
+    def test_cache_disabled(self):
+        dri.DriverInfo('radeon', cache=False)
+        dri.DriverInfo('radeon', cache=False)
+        self.assertEqual(len(self.spawns()), 2)
+        self.assertFalse(os.path.exists(os.path.join(dri.CacheDir(), 'drivers')))
+
+
+class DriverNameTests(FakeXDriInfoMixin, unittest.TestCase):
+    def test_no_shell(self):
+        marker = os.path.join(self.tmpdir.name, 'pwned')
+        for name in ('x;touch ' + marker, '$(touch ' + marker + ')', '../radeon',
+                     '-radeon', '', 'radeon\n', 'rad\u00e9on'):
+            self.assertIsNone(dri.GetDriver(name))
+            self.assertRaises(dri.DRIError, dri.DriverInfo, name)
+            self.assertNotIn(name, dri.DisplayInfo.drivers)
+        self.assertFalse(os.path.exists(marker))
+        self.assertEqual(self.spawns(), [])
+
+    def test_display_is_one_argument(self):
+        marker = os.path.join(self.tmpdir.name, 'pwned')
+        dri.XDriInfo('nscreens', ':0 ; touch ' + marker)
+        self.assertFalse(os.path.exists(marker))
+        self.assertEqual(self.spawns(), ['-display :0 ; touch ' + marker + ' nscreens'])
+
+
+class MemoryDriverCacheTests(FakeXDriInfoMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 0.0
+        self.cache = dri.DriverCache(maxSize=2, negativeTTL=10,
+                                     clock=lambda: self.now)
+        patcher = mock.patch.object(dri.DisplayInfo, 'drivers', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_negative_entries_expire(self):
+        self.assertIsNone(dri.GetDriver('nouveau'))
+        self.assertIsNone(dri.GetDriver('nouveau'))
+        with self.assertRaises(dri.DRIError):
+            dri.GetDriver('nouveau', catch=0)
+        self.assertEqual(self.spawns(), ['options nouveau'])
+        self.now = 11
+        self.assertIsNone(dri.GetDriver('nouveau'))
+        self.assertEqual(len(self.spawns()), 2)
+
+    def test_lru_eviction(self):
+        loader = mock.Mock(side_effect=lambda name: name.upper())
+        self.cache.load('a', loader)
+        self.cache.load('b', loader)
+        self.cache.load('a', loader)
+        self.cache.load('c', loader)
+        self.assertEqual(list(self.cache.entries), ['a', 'c'])
+        self.assertEqual(self.cache['a'], 'A')
+        with self.assertRaises(KeyError):
+            self.cache['b']
+
+    def test_invalidate(self):
+        driver = dri.GetDriver('radeon')
+        self.assertIs(dri.GetDriver('radeon'), driver)
+        self.cache.invalidate('radeon')
+        self.assertNotIn('radeon', self.cache)
+        self.assertIsNot(dri.GetDriver('radeon'), driver)
+
+
+class GLXInfoTests(FakeXDriInfoMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.glxLog = os.path.join(self.tmpdir.name, 'glxinfo.log')
+        os.environ['FAKE_GLXINFO_LOG'] = self.glxLog
+
+    def glxinfo_calls(self):
+        with open(self.glxLog) as f:
+            return f.read().splitlines()
+
+    def test_brief(self):
+        info = dri.GLXInfo(0, ':0')
+        self.assertEqual(info.vendor, 'X.Org')
+        self.assertTrue(info.renderer.startswith('AMD TURKS'))
+        self.assertEqual(self.glxinfo_calls(), ['-B -display :0.0'])
+        self.assertIs(dri.GLXInfoBrief, True)
+
+    def test_without_brief(self):
+        os.environ['FAKE_GLXINFO_NO_BRIEF'] = '1'
+        self.assertEqual(dri.GLXInfo(0, ':0').vendor, 'X.Org')
+        self.assertEqual(dri.GLXInfo(1, ':0').vendor, 'X.Org')
+        self.assertEqual(self.glxinfo_calls(),
+                         ['-B -display :0.0', '-display :0.0', '-display :0.1'])
+
+    def test_failure_keeps_brief(self):
+        os.environ['FAKE_GLXINFO_FAIL'] = '1'
+        self.assertRaises(dri.DRIError, dri.GLXInfo, 0, ':0')
+        self.assertIsNone(dri.GLXInfoBrief)
+        del os.environ['FAKE_GLXINFO_FAIL']
+        self.assertEqual(dri.GLXInfo(0, ':0').vendor, 'X.Org')
+        self.assertEqual(self.glxinfo_calls(),
+                         ['-B -display :0.0', '-display :0.0', '-B -display :0.0'])
+        self.assertIs(dri.GLXInfoBrief, True)
+
+    def test_stops_early(self):
+        os.environ['FAKE_GLXINFO_HANG_AFTER'] = '1'
+        start = time.monotonic()
+        self.assertEqual(dri.GLXInfo(0, ':0').vendor, 'X.Org')
+        self.assertLess(time.monotonic() - start, 5)
+
+
+class DisplayInfoTests(FakeXDriInfoMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        os.environ['FAKE_XDRIINFO_NSCREENS'] = '4'
+
+    def test_concurrent_matches_sequential(self):
+        sequential = dri.DisplayInfo(':0')
+        dri.DisplayInfo.drivers.clear()
+        concurrent = dri.DisplayInfo(':0', concurrent=True)
+        self.assertEqual(len(concurrent.screens), 4)
+        for a, b in zip(sequential.screens, concurrent.screens):
+            self.assertEqual(a.num, b.num)
+            self.assertEqual(a.glxInfo.renderer, b.glxInfo.renderer)
+            self.assertEqual(str(a.driver), str(b.driver))
+
+    def test_concurrent_loads_driver_once(self):
+        display = dri.DisplayInfo(':0', concurrent=True)
+        self.assertEqual(self.spawns().count('options radeon'), 1)
+        self.assertEqual(len({id(s.driver) for s in display.screens}), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
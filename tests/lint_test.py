@@ -0,0 +1,90 @@
+# lint_test.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+
+from driconfig import dri, lint
+from tests.dri_test import FakeXDriInfoMixin
+
+BAD = '''<driconf>
+  <device driver="radeon">
+    <application name="glxgears" executable="glxgears">
+      <option name="vblank_mode" value="7"/>
+      <option name="no_such_option" value="1"/>
+    </application>
+  </device>
+</driconf>
+'''
+
+
+class LintTests(FakeXDriInfoMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.bad = os.path.join(self.tmpdir.name, 'bad')
+        with open(self.bad, 'w') as f:
+            f.write(BAD)
+        self.broken = os.path.join(self.tmpdir.name, 'broken')
+        with open(self.broken, 'w') as f:
+            f.write('<driconf>')
+        self.paths = ['tests/drirc.xml', self.bad, self.broken] * 10
+
+    def check(self, results):
+        self.assertEqual([path for path, diagnostics in results], self.paths)
+        good, bad, broken = results[:3]
+        self.assertEqual(good[1], [])
+        self.assertEqual([(d['application'], d['option'], d['problem']) for d in bad[1]],
+                         [('glxgears', 'vblank_mode', 'out of valid range'),
+                          ('glxgears', 'no_such_option', 'unknown option')])
+        self.assertEqual(len(broken[1]), 1)
+        self.assertIn('ExpatError', broken[1][0]['problem'])
+        self.assertEqual(results[3:6], results[:3])
+
+    def test_catalogs(self):
+        catalogs = {'radeon': 'tests/radeon-options.xml'}
+        self.check(list(lint.Lint(self.paths, catalogs, jobs=2, chunksize=4)))
+        self.check(list(lint.Lint(iter(self.paths), catalogs, jobs=1)))
+        self.assertEqual(self.spawns(), [])
+
+    def test_fixture(self):
+        self.check(list(lint.Lint(self.paths, fixture='tests/fake-display.json', jobs=2)))
+        self.assertEqual(self.spawns(), [])
+
+    def test_xdriinfo_once_per_worker(self):
+        self.check(list(lint.Lint(self.paths, jobs=1)))
+        self.assertEqual(self.spawns(), ['options radeon'])
+        dri.DisplayInfo.drivers.clear()
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmpdir.name, 'empty')
+        self.check(list(lint.Lint(self.paths, jobs=2, chunksize=1)))
+        self.assertLessEqual(len(self.spawns()), 3)
+
+    def test_untrusted_driver_names(self):
+        marker = os.path.join(self.tmpdir.name, 'pwned')
+        path = os.path.join(self.tmpdir.name, 'evil')
+        with open(path, 'w') as f:
+            f.write('<driconf><device driver="x;touch {}"><application name="a">'
+                    '<option name="o" value="1"/></application></device></driconf>'
+                    .format(marker))
+        (result,) = lint.Lint([path], jobs=1)
+        self.assertEqual([d['problem'] for d in result[1]],
+                         ['driver does not support configuration'])
+        self.assertFalse(os.path.exists(marker))
+        self.assertEqual(self.spawns(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# snapshot_test.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from driconfig import dri, snapshot
+from tests.dri_test import FakeXDriInfoMixin
+
+
+class SnapshotTests(FakeXDriInfoMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.tmpdir.name, 'drirc')
+        shutil.copy('tests/drirc.xml', self.path)
+
+    def test_warm_load_skips_expat(self):
+        cold = snapshot.LoadConfig(self.path)
+        self.assertTrue(os.path.exists(snapshot.SnapshotPath(self.path)))
+        with mock.patch('xml.parsers.expat.ParserCreate') as parser:
+            warm = snapshot.LoadConfig(self.path)
+        parser.assert_not_called()
+        self.assertIsInstance(warm.devices[0].apps, snapshot.LazyAppList)
+        self.assertEqual(str(warm), str(cold))
+
+    def test_lazy_apps(self):
+        snapshot.LoadConfig(self.path)
+        apps = snapshot.LoadConfig(self.path).devices[0].apps
+        keys = [(None, True), ('glxgears', True), ('tuxracer', True)]
+        self.assertEqual(apps.indexKeys(), keys)
+        self.assertEqual(apps.items.count(None), 3)
+        self.assertEqual(apps[2].name, 'tuxracer')
+        self.assertEqual(apps.indexKeys(), keys)
+        self.assertEqual(apps.items.count(None), 2)
+        self.assertEqual(apps[-1].options, {'tcl_mode': '0'})
+        apps.append(dri.AppConfig(apps.device, 'new'))
+        self.assertIsNone(apps.snapshot)
+        self.assertEqual(len(apps), 4)
+
+    def test_resolver_creates_matching_apps(self):
+        snapshot.LoadConfig(self.path)
+        conf = dri.LayeredConfig([self.path], loader=snapshot.LoadConfig)
+        apps = conf.devices[0].apps
+        self.assertEqual(apps.items.count(None), 3)
+        self.assertEqual(conf.getOptions('tuxracer', 0, 'radeon'),
+                         {'vblank_mode': '3', 'tcl_mode': '0'})
+        self.assertEqual([app is not None for app in apps.items], [True, False, True])
+
+    def test_save_patches_snapshot(self):
+        snapshot.LoadConfig(self.path)
+        warm = snapshot.LoadConfig(self.path)
+        self.assertIsInstance(warm.devices[0].apps, snapshot.LazyAppList)
+        warm.setOption('glxgears', 'vblank_mode', '1', '0', 'radeon')
+        warm.save()
+        with open('tests/drirc.xml') as f:
+            orig = f.read()
+        with open(self.path) as f:
+            saved = f.read()
+        self.assertEqual(saved, orig.replace('<option name="vblank_mode" value="0"/>',
+                                             '<option name="vblank_mode" value="1" />'))
+
+    def test_changed_source(self):
+        snapshot.LoadConfig(self.path)
+        conf = dri.DRIConfig(self.path)
+        conf.setOption('glxgears', 'vblank_mode', '2', 0, 'radeon')
+        conf.save()
+        reloaded = snapshot.LoadConfig(self.path)
+        self.assertNotIsInstance(reloaded.devices[0].apps, snapshot.LazyAppList)
+        self.assertEqual(reloaded.devices[0].apps[1].options, {'vblank_mode': '2'})
+        self.assertEqual(str(snapshot.LoadConfig(self.path)), str(reloaded))
+
+    def test_file_changes_while_loading(self):
+        readFile = snapshot._ReadFile
+
+        def racingRead(filename):
+            result = readFile(filename)
+            conf = dri.DRIConfig(filename)
+            conf.setOption('glxgears', 'vblank_mode', '2', 0, 'radeon')
+            conf.save()
+            return result
+        with mock.patch.object(snapshot, '_ReadFile', racingRead):
+            conf = snapshot.LoadConfig(self.path)
+        # The tree belongs to the bytes that were hashed
+        self.assertEqual(conf.devices[0].apps[1].options, {'vblank_mode': '0'})
+        with open('tests/drirc.xml', 'rb') as f:
+            self.assertEqual(conf.source, f.read())
+
+    def test_selectors(self):
+        shutil.copy('tests/drirc-selectors.xml', self.path)
+        cold = snapshot.LoadConfig(self.path)
+        warm = snapshot.LoadConfig(self.path)
+        self.assertIsInstance(warm.devices[0].apps, snapshot.LazyAppList)
+        self.assertIsInstance(warm.devices[0].apps[3], dri.EngineConfig)
+        self.assertEqual(str(warm), str(cold))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# trace_test.py
+#
+# Copyright (C) 2016 Patrick Griffis <tingping@tingping.se>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import json
+import unittest
+
+from driconfig import dri, trace
+from tests.dri_test import FakeXDriInfoMixin
+
+
+class TraceTests(FakeXDriInfoMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        trace.reset()
+        trace.enable()
+        self.addCleanup(trace.disable)
+        self.addCleanup(trace.reset)
+
+    def test_probe_is_traced(self):
+        dri.DisplayInfo(':0')
+        names = [e['name'] for e in trace.events() if e['ph'] == 'X']
+        self.assertEqual(names.count('xdriinfo'), 4)
+        self.assertEqual(names.count('glxinfo'), 2)
+        self.assertEqual(names.count('parse driver info'), 1)
+        self.assertEqual(trace.counters(), {
+            'driver disk cache miss': 1,
+            'driver cache miss': 1,
+            'driver cache hit': 1,
+        })
+
+        f = io.StringIO()
+        trace.export(f)
+        events = json.loads(f.getvalue())['traceEvents']
+        self.assertTrue(all('ts' in e and 'pid' in e for e in events))
+        self.assertIn('xdriinfo', trace.summary())
+
+    def test_disabled(self):
+        trace.disable()
+        dri.DRIConfig('tests/drirc.xml')
+        self.assertEqual(trace.events(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()